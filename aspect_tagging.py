@@ -0,0 +1,253 @@
+"""
+Aspect tags of experience pairs, for per-aspect retrieval sub-indices.
+
+Each pair is tagged with the judge aspects (subjective_scoring.ASPECTS) its
+rewrite is about, by a cheap local classifier:
+
+- POS differences: the positive and negative are POS-segmented (through the
+  shared segmentation cache) and aligned with difflib; every token of a
+  changed span counts as evidence for the aspect of its POS (nouns, verbs,
+  adjectives, numerals / classifiers / pronouns / adverbs / prepositions /
+  particles, conjunctions), short replacements between content words as
+  collocation evidence, and long rewrites, punctuation and sentence-count
+  changes as sentence-structure evidence.
+- feature_* signals: when the pool was compiled with features, the relative
+  difference of the positive's and negative's values of each aspect's
+  features (e.g. 36-41 for verbs, 93-97 for conjunctions) adds to that
+  aspect's evidence.
+
+An aspect's score is its share of the pair's evidence divided by its mean
+share over the pool, so nouns, which every rewrite changes, do not swamp the
+rest; a pair is tagged with every aspect scoring at least 1 (and at least its
+best one). Tags are one uint8 bitmask per pair (bit i: ASPECT_ORDER[i]),
+persisted next to the pool like the BM25 index:
+
+    examples.jsonl.aspects/   or   examples.pool/aspects/
+        meta.json             source size/mtime, aspect order, per-aspect counts
+        tags.npy              uint8 bitmask per pair
+
+    python aspect_tagging.py tag clase_exp/model_output/examples.jsonl
+    python aspect_tagging.py info clase_exp/model_output/examples.jsonl
+"""
+
+import argparse
+import difflib
+import json
+import os
+import shutil
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from linguistic_features.segmentation_cache import cut_text
+from linguistic_features.sentence_index import sentence_spans
+
+ASPECT_ORDER = ('noun', 'verb', 'adjective', 'small_words', 'sentence_coherence', 'sentence_structure',
+                'intra_sentence_collocation')
+SMALL_WORD_FLAGS = ('m', 'q', 'r', 'd', 'p', 'u', 'y', 'e')
+CONTENT_FLAGS = ('n', 'v', 'a')
+# Features whose difference between the two sides points at an aspect (names as in the feature extractor)
+FEATURE_GROUPS = {
+    'noun': range(42, 48),
+    'verb': range(36, 42),
+    'adjective': range(30, 36),
+    'small_words': list(range(60, 66)) + list(range(98, 101)),
+    'sentence_coherence': range(93, 98),
+    'sentence_structure': list(range(19, 23)) + list(range(74, 78)),
+    'intra_sentence_collocation': range(54, 60),
+}
+FEATURE_WEIGHT = 0.5
+LONG_SPAN = 4
+
+
+def flag_aspect(flag: str) -> Optional[str]:
+    """The aspect a changed token of this POS flag is evidence for."""
+    if flag in ('x', 'w'):
+        return 'sentence_structure'
+    if flag.startswith('c'):
+        return 'sentence_coherence'
+    if flag.startswith('n'):
+        return 'noun'
+    if flag.startswith('v'):
+        return 'verb'
+    if flag.startswith('a'):
+        return 'adjective'
+    if flag.startswith(SMALL_WORD_FLAGS):
+        return 'small_words'
+    return None
+
+
+def pos_evidence(positive: str, negative: str) -> np.ndarray:
+    """Evidence counts per aspect (ASPECT_ORDER) from the POS differences of a pair."""
+    evidence = np.zeros(len(ASPECT_ORDER))
+    pos_tokens, neg_tokens = cut_text(positive), cut_text(negative)
+    matcher = difflib.SequenceMatcher(None, [w for w, _ in pos_tokens], [w for w, _ in neg_tokens], autojunk=False)
+    structure = ASPECT_ORDER.index('sentence_structure')
+    collocation = ASPECT_ORDER.index('intra_sentence_collocation')
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            continue
+        changed = pos_tokens[i1:i2] + neg_tokens[j1:j2]
+        for _, flag in changed:
+            aspect = flag_aspect(flag)
+            if aspect is not None:
+                evidence[ASPECT_ORDER.index(aspect)] += 1
+        if max(i2 - i1, j2 - j1) >= LONG_SPAN:
+            evidence[structure] += 1
+        if op == 'replace' and i2 - i1 <= 2 and j2 - j1 <= 2 and \
+                any(f.startswith(CONTENT_FLAGS) for _, f in pos_tokens[i1:i2]) and \
+                any(f.startswith(CONTENT_FLAGS) for _, f in neg_tokens[j1:j2]):
+            # A word swapped for another inside an unchanged context
+            evidence[collocation] += 1
+    if len(sentence_spans(positive, 'terminal_keep')) != len(sentence_spans(negative, 'terminal_keep')):
+        evidence[structure] += 1
+    return evidence
+
+
+def feature_evidence(pos_features: np.ndarray, neg_features: np.ndarray, feature_names: List[str]) -> np.ndarray:
+    """
+    Mean relative difference |p - n| / (|p| + |n|) of each aspect's features,
+    one row per pair (rows of zeros if the pool has none of the features).
+    """
+    columns = {name: i for i, name in enumerate(feature_names)}
+    evidence = np.zeros((len(pos_features), len(ASPECT_ORDER)))
+    for a, aspect in enumerate(ASPECT_ORDER):
+        cols = [columns[str(f)] for f in FEATURE_GROUPS[aspect] if str(f) in columns]
+        if not cols:
+            continue
+        p = np.asarray(pos_features[:, cols], dtype=np.float64)
+        n = np.asarray(neg_features[:, cols], dtype=np.float64)
+        denominator = np.abs(p) + np.abs(n)
+        evidence[:, a] = np.where(denominator > 0, np.abs(p - n) / np.where(denominator > 0, denominator, 1), 0).mean(axis=1)
+    return evidence
+
+
+def _lift(evidence: np.ndarray) -> np.ndarray:
+    """Each pair's share of evidence per aspect, relative to the pool's mean share."""
+    totals = evidence.sum(axis=1, keepdims=True)
+    shares = np.divide(evidence, totals, out=np.zeros_like(evidence), where=totals > 0)
+    mean = shares.mean(axis=0) if len(shares) else np.zeros(len(ASPECT_ORDER))
+    return np.divide(shares, mean, out=np.zeros_like(shares), where=mean > 0)
+
+
+def tag_pairs(positives: Iterable[str], negatives: Iterable[str], total: Optional[int] = None,
+              pos_features: Optional[np.ndarray] = None, neg_features: Optional[np.ndarray] = None,
+              feature_names: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Aspect bitmask of every pair.
+
+    Args:
+        positives, negatives: Texts of the pairs, in pool order
+        total (int): Number of pairs, for the progress bar
+        pos_features, neg_features (np.ndarray): Objective features of both
+            sides (e.g. a compiled pool's), or None to use POS differences only
+        feature_names (list): Column names of the features
+
+    Returns:
+        np.ndarray: uint8 tags, bit i set for ASPECT_ORDER[i]
+    """
+    rows = [pos_evidence(p, n) for p, n in tqdm(zip(positives, negatives), total=total, desc="Tagging pairs")]
+    evidence = np.array(rows).reshape(-1, len(ASPECT_ORDER))
+    score = _lift(evidence)
+    if pos_features is not None and feature_names:
+        score = (score + FEATURE_WEIGHT * _lift(feature_evidence(pos_features, neg_features, feature_names))) / \
+            (1 + FEATURE_WEIGHT)
+    selected = score >= 1.0
+    if len(score):
+        selected[np.arange(len(score)), score.argmax(axis=1)] = True
+        # Pairs without any evidence stay visible to every aspect
+        selected[score.max(axis=1) <= 0] = True
+    bits = 1 << np.arange(len(ASPECT_ORDER))
+    return (selected * bits).sum(axis=1).astype(np.uint8)
+
+
+def tags_dir(exp_library: str) -> str:
+    """Where the aspect tags of examples.jsonl or of a compiled pool directory live."""
+    if os.path.isdir(exp_library):
+        return os.path.join(exp_library, 'aspects')
+    return exp_library + '.aspects'
+
+
+def _source_stat(exp_library: str) -> Dict:
+    path = os.path.join(exp_library, 'meta.json') if os.path.isdir(exp_library) else exp_library
+    return {"size": os.path.getsize(path), "mtime": os.path.getmtime(path)}
+
+
+def _pool_pairs(exp_library: str):
+    """Positives, negatives, pair count and (compiled pools with features) features of a pool."""
+    from compiled_pool import CompiledPool, is_compiled_pool
+    if is_compiled_pool(exp_library):
+        pool = CompiledPool(exp_library)
+        return pool.positives, pool.negatives, len(pool), pool.pos_features, pool.neg_features, pool.feature_names
+    from jsonl_index import iter_jsonl
+    pairs = [pair for exp in iter_jsonl(exp_library) for pair in exp.get('pair', [])]
+    return [p['positive'] for p in pairs], [p['negative'] for p in pairs], len(pairs), None, None, None
+
+
+def build_tags(exp_library: str) -> np.ndarray:
+    """Tag the pairs of a pool and persist the tags (replacing older ones)."""
+    positives, negatives, total, pos_features, neg_features, feature_names = _pool_pairs(exp_library)
+    source = _source_stat(exp_library)
+    tags = tag_pairs(positives, negatives, total, pos_features, neg_features, feature_names)
+    directory = tags_dir(exp_library)
+    tmp_dir = f"{directory.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'tags.npy'), tags)
+    meta = {
+        "source": source,
+        "aspects": list(ASPECT_ORDER),
+        "pairs": int(len(tags)),
+        "features": pos_features is not None,
+        "counts": {aspect: int(((tags >> i) & 1).sum()) for i, aspect in enumerate(ASPECT_ORDER)},
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return tags
+
+
+def load_tags(exp_library: str, rebuild: bool = False) -> np.ndarray:
+    """
+    Aspect tags of a pool's pairs, built and persisted on first use and
+    rebuilt when the pool has changed since.
+    """
+    directory = tags_dir(exp_library)
+    if not rebuild:
+        try:
+            with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['source'] == _source_stat(exp_library) and meta['aspects'] == list(ASPECT_ORDER):
+                return np.load(os.path.join(directory, 'tags.npy'), mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            pass
+    return build_tags(exp_library)
+
+
+def aspect_rows(tags: np.ndarray, n: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """Sub-index of each aspect: ids of the pairs among the first n tagged with it."""
+    tags = np.asarray(tags[:n])
+    return {aspect: np.flatnonzero((tags >> i) & 1) for i, aspect in enumerate(ASPECT_ORDER)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag experience pairs with the aspects they illustrate")
+    commands = parser.add_subparsers(dest='command', required=True)
+    tag_parser = commands.add_parser('tag', help="Tag (or re-tag) the pairs of a pool")
+    tag_parser.add_argument('pool', help="examples.jsonl or a compiled pool directory")
+    info_parser = commands.add_parser('info', help="Sub-index sizes of a pool")
+    info_parser.add_argument('pool')
+    args = parser.parse_args()
+
+    tags = build_tags(args.pool) if args.command == 'tag' else load_tags(args.pool)
+    rows = aspect_rows(tags)
+    print(f"{len(tags)} pairs, {np.mean([bin(t).count('1') for t in tags.tolist()]) if len(tags) else 0:.2f} "
+          f"aspects per pair -> {tags_dir(args.pool)}")
+    for aspect, ids in rows.items():
+        print(f"  {aspect:<28}{len(ids):>8}  ({len(ids) / max(len(tags), 1):.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Judge prompt tokens with one shared example set vs per-aspect sub-indices.
+
+For each document of the test corpus, takes x query sentences of its
+`generated` text, retrieves the top y pairs of an experience pool for each
+with the BM25 index of lexical_index, and builds the seven judge prompts of
+subjective_scoring twice: with the union of all retrieved pairs in every
+prompt (the default), and with each aspect's pairs retrieved from its own
+sub-index of aspect-tagged pairs (CLASE_ASPECT_RETRIEVAL=1). With
+`--budget`, the shared pairs are also ranked and packed into that many tokens
+per call (CLASE_PROMPT_BUDGET). Reports the estimated input tokens per
+document and per call (prompt_tokens.count_tokens) and the examples per
+prompt of each.
+
+    python -m benchmarks.aspect_prompt_tokens --pool data/examples.jsonl --x 5 --y 5 --budget 4000
+"""
+
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+
+from aspect_tagging import aspect_rows, load_tags
+from benchmarks.common import TEST_CORPUS, latency_summary, load_corpus, percentile
+from lexical_index import load_index
+from prompt_tokens import count_tokens
+from subjective_scoring import ASPECTS, judge_prompt, load_lexical_experiences, merge_pairs, packed_prompt, pairs_of
+
+
+def document_queries(text, x, rng):
+    """x random sentences of a document, standing in for its generated queries."""
+    sentences = [s.strip() for s in re.split(r'[。；\n]', text) if len(s.strip()) >= 8]
+    return [sentences[i] for i in rng.choice(len(sentences), size=min(x, len(sentences)), replace=False)]
+
+
+def prompt_tokens(generated, pairs, budget=None):
+    """Estimated tokens of each judge prompt and examples per prompt."""
+    tokens, examples = [], []
+    for aspect, info in ASPECTS.items():
+        group = pairs.get(aspect, []) if isinstance(pairs, dict) else pairs
+        if budget is not None:
+            prompt, packing = packed_prompt(generated, group, info, budget)
+            group = packing.pairs
+        else:
+            prompt = judge_prompt(generated, group, info)
+        tokens.append(count_tokens(prompt))
+        examples.append(len(group))
+    return tokens, float(np.mean(examples))
+
+
+def mode_summary(tokens, examples, latencies):
+    calls = [t for document in tokens for t in document]
+    return {
+        "tokens_per_document": float(np.mean([sum(document) for document in tokens])) if tokens else 0.0,
+        "tokens_per_call": {"p50": percentile(calls, 50), "p95": percentile(calls, 95), "max": max(calls, default=0)},
+        "examples_per_prompt": float(np.mean(examples)) if examples else 0.0,
+        "retrieval_latency": latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Judge prompt tokens of shared vs per-aspect example retrieval")
+    parser.add_argument('--pool', required=True, help="examples.jsonl or a compiled pool directory")
+    parser.add_argument('--corpus', default=TEST_CORPUS)
+    parser.add_argument('--documents', type=int, default=50)
+    parser.add_argument('--x', type=int, default=5, help="Queries per document")
+    parser.add_argument('--y', type=int, default=5, help="Pairs retrieved per query")
+    parser.add_argument('--budget', type=int, default=None, help="Also pack the shared pairs into this many tokens per call")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    experiences = load_lexical_experiences(args.pool)
+    index = load_index(args.pool)
+    start = time.perf_counter()
+    rows = aspect_rows(load_tags(args.pool), len(experiences))
+    tagging = time.perf_counter() - start
+    n = len(experiences)
+    quota = {aspect: max(1, round(args.y * len(ids) / n)) for aspect, ids in rows.items()} if n else {}
+
+    rng = np.random.default_rng(args.seed)
+    modes = ('shared', 'per_aspect') + (('packed',) if args.budget else ())
+    tokens = {mode: [] for mode in modes}
+    examples = {mode: [] for mode in modes}
+    latencies = {mode: [] for mode in modes}
+    for record in load_corpus(args.corpus, args.documents):
+        queries = document_queries(record['generated'], args.x, rng)
+        start = time.perf_counter()
+        results = [pairs_of(experiences, index.search(q, args.y, limit=n)[0]) for q in queries]
+        shared = merge_pairs(results)
+        latencies['shared'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        retrieved = []
+        for q in queries:
+            scores = index.scores(q, limit=n)
+            retrieved.append(pairs_of(experiences, {aspect: index.rank(scores, quota[aspect], ids)[0]
+                                                    for aspect, ids in rows.items()}))
+        per_aspect = merge_pairs(retrieved)
+        latencies['per_aspect'].append(time.perf_counter() - start)
+
+        prompts = {'shared': (shared, None), 'per_aspect': (per_aspect, None)}
+        if args.budget:
+            start = time.perf_counter()
+            prompts['packed'] = (merge_pairs(results, ranked=True), args.budget)
+            latencies['packed'].append(latencies['shared'][-1] + time.perf_counter() - start)
+        for mode, (pairs, budget) in prompts.items():
+            calls, per_prompt = prompt_tokens(record['generated'], pairs, budget)
+            tokens[mode].append(calls)
+            examples[mode].append(per_prompt)
+
+    report = {
+        "pool_size": n,
+        "documents": len(tokens['shared']),
+        "x": args.x,
+        "y": args.y,
+        "budget": args.budget,
+        "sub_index_sizes": {aspect: int(len(ids)) for aspect, ids in rows.items()},
+        "tagging_seconds": tagging,
+    }
+    report.update({mode: mode_summary(tokens[mode], examples[mode], latencies[mode]) for mode in modes})
+    saved = 1 - report['per_aspect']['tokens_per_document'] / max(report['shared']['tokens_per_document'], 1)
+    report["token_reduction"] = saved
+    print(f"{report['documents']} documents, x={args.x} y={args.y}, {n} pairs "
+          f"(tags loaded in {tagging:.2f}s): " + ", ".join(f"{a} {s}" for a, s in report['sub_index_sizes'].items()))
+    for name in modes:
+        r = report[name]
+        print(f"{name:<11}{r['tokens_per_document']:>10.0f} tokens/document  call p50 {r['tokens_per_call']['p50']} "
+              f"max {r['tokens_per_call']['max']}  {r['examples_per_prompt']:.1f} examples/prompt  "
+              f"retrieval p50 {r['retrieval_latency']['p50'] * 1000:.2f} ms")
+    print(f"per-aspect judge input tokens -{saved:.1%}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
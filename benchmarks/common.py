@@ -0,0 +1,38 @@
+"""Shared helpers for the benchmark scripts."""
+
+import json
+import math
+
+TEST_CORPUS = "data/test/restored_4001-4200.jsonl"
+
+
+def load_corpus(path=TEST_CORPUS, limit=None):
+    """Load test records ({"index", "gold", "generated"}) from a JSONL file."""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if limit is not None and len(records) >= limit:
+                break
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(latencies):
+    """Mean and tail latencies in seconds."""
+    return {
+        "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else 0.0,
+    }
@@ -0,0 +1,124 @@
+"""
+Recall, memory and latency of quantised embedding retrieval.
+
+Compares top-k cosine retrieval over float16 and int8 (per-vector scale)
+matrices, with and without float32 re-ranking of a shortlist, against the
+exact float64 search the subjective pipeline performs today (one float64
+array per experience, scored with `cosine_similarity`; here vectorised, with
+the same ranking). Recall@k is the fraction of the exact top k that each mode
+returns.
+
+The embeddings are either those of a compiled pool (`--pool`, queries are
+perturbed pool rows) or synthetic clustered unit vectors, generated in
+float32 so large matrices fit in memory.
+
+    python -m benchmarks.embedding_quantization --rows 100000 --dim 1536 --k 10 --rerank 50 200
+    python -m benchmarks.embedding_quantization --pool data/examples.pool --k 5
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.common import latency_summary
+from embedding_index import EmbeddingIndex, normalize_rows
+
+
+def synthetic_embeddings(rows, dim, clusters, seed):
+    """Unit vectors around random cluster centres (float32, generated block by block)."""
+    rng = np.random.default_rng(seed)
+    centres = normalize_rows(rng.standard_normal((clusters, dim), dtype=np.float32))
+    matrix = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 8192):
+        stop = min(start + 8192, rows)
+        noise = rng.standard_normal((stop - start, dim), dtype=np.float32) * (1.0 / np.sqrt(dim))
+        matrix[start:stop] = normalize_rows(centres[rng.integers(clusters, size=stop - start)] + noise)
+    return matrix
+
+
+def make_queries(matrix, n, noise, seed):
+    rng = np.random.default_rng(seed + 1)
+    rows = matrix[rng.integers(len(matrix), size=n)].astype(np.float64)
+    return rows + rng.standard_normal(rows.shape) * (noise / np.sqrt(matrix.shape[1]))
+
+
+def exact_top(matrix, query, k, block_rows=8192):
+    """Exact float64 cosine top k (the current float path's ranking)."""
+    q = query / np.linalg.norm(query)
+    scores = np.empty(len(matrix))
+    for start in range(0, len(matrix), block_rows):
+        block = matrix[start:start + block_rows].astype(np.float64)
+        scores[start:start + len(block)] = (block @ q) / np.maximum(np.linalg.norm(block, axis=1), 1e-300)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def run_mode(index, queries, truth, k):
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found, _ = index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found.tolist()) & set(expected.tolist()))
+    return hits / (k * len(queries)), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantised embedding retrieval benchmark")
+    parser.add_argument('--pool', default=None, help="Compiled pool with negative embeddings")
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--clusters', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--query-noise', type=float, default=0.5)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rerank', type=int, nargs='*', default=[50, 200], help="Shortlist sizes to re-rank")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    if args.pool:
+        from compiled_pool import CompiledPool
+        matrix = CompiledPool(args.pool).neg_embeddings
+        if matrix is None:
+            raise SystemExit(f"{args.pool} has no embeddings")
+    else:
+        matrix = synthetic_embeddings(args.rows, args.dim, args.clusters, args.seed)
+    rows, dim = matrix.shape
+    queries = make_queries(matrix, args.queries, args.query_noise, args.seed)
+    k = min(args.k, rows)
+
+    start = time.perf_counter()
+    truth = [exact_top(matrix, query, k) for query in queries]
+    exact_latency = (time.perf_counter() - start) / len(queries)
+
+    modes = {"float32": EmbeddingIndex(normalize_rows(matrix))}
+    for dtype in ('float16', 'int8'):
+        modes[dtype] = EmbeddingIndex.build(matrix, dtype)
+        for rerank in args.rerank:
+            modes[f"{dtype}+rerank{rerank}"] = EmbeddingIndex(modes[dtype].codes, modes[dtype].scales, matrix, rerank)
+
+    report = {
+        "rows": rows, "dim": dim, "k": k, "queries": len(queries),
+        "float64": {"recall": 1.0, "bytes": rows * dim * 8, "latency": {"mean": exact_latency}},
+    }
+    for name, index in modes.items():
+        recall, latencies = run_mode(index, queries, truth, k)
+        report[name] = {"recall": recall, "bytes": index.nbytes, "latency": latency_summary(latencies)}
+
+    print(f"{rows} x {dim}, k={k}, {len(queries)} queries")
+    print(f"{'mode':<20}{'recall':>8}{'MiB':>10}{'vs f64':>8}{'ms/query':>10}")
+    for name in ['float64'] + list(modes):
+        stats = report[name]
+        print(f"{name:<20}{stats['recall']:>8.3f}{stats['bytes'] / 2 ** 20:>10.1f}"
+              f"{stats['bytes'] / report['float64']['bytes']:>8.3f}{stats['latency']['mean'] * 1000:>10.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
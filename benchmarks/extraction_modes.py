@@ -0,0 +1,112 @@
+"""
+Thread versus process throughput of `extract_all_features`.
+
+Extracts the 100 features of the `gold` and `generated` texts of the test
+corpus sequentially, in a thread pool (one ExtractionContext per thread) and in
+a process pool, and reports documents per second, per-document latency and
+whether every mode produced the same features as the sequential run. Every
+mode starts with an empty segmentation cache.
+
+jieba is pure Python, so threads only pay off when the GIL is released
+elsewhere (e.g. next to LLM calls in an asyncio service) or on a
+free-threaded interpreter; the process pool is the CPU-bound reference.
+
+    python -m benchmarks.extraction_modes --workers 4 --limit 50
+"""
+
+import argparse
+import json
+import time
+from multiprocessing import Pool
+
+import jieba
+
+from benchmarks.common import TEST_CORPUS, latency_summary, load_corpus
+from linguistic_features.context import default_context
+from linguistic_features.feature_extractor import extract_all_features, extract_features_threaded
+from linguistic_features.instrumentation import Instrumentation
+from linguistic_features.segmentation_cache import SegmentationCache, set_cache
+
+
+def load_texts(path, fields, limit=None):
+    return [record[field] for record in load_corpus(path, limit) for field in fields]
+
+
+def timed_extract(text, ctx=None):
+    start = time.perf_counter()
+    features = extract_all_features(text, ctx=ctx)
+    return features, time.perf_counter() - start
+
+
+def _reset_cache():
+    set_cache(SegmentationCache())
+
+
+def run_sequential(texts):
+    ctx = default_context().fork()
+    results = [timed_extract(text, ctx) for text in texts]
+    return [features for features, _ in results], [seconds for _, seconds in results]
+
+
+def run_threads(texts, workers):
+    latencies = []
+    instrumentation = Instrumentation([lambda profile: latencies.append(profile.total)])
+    features = extract_features_threaded(texts, workers, instrumentation=instrumentation)
+    return features, latencies
+
+
+def run_processes(texts, workers):
+    with Pool(workers, initializer=_reset_cache) as pool:
+        results = pool.map(timed_extract, texts, chunksize=max(1, len(texts) // (workers * 4)))
+    return [features for features, _ in results], [seconds for _, seconds in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thread vs process feature extraction benchmark")
+    parser.add_argument('--input', default=TEST_CORPUS)
+    parser.add_argument('--fields', nargs='+', default=['gold', 'generated'])
+    parser.add_argument('--limit', type=int, default=None, help="Only use the first N records")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', default=['sequential', 'threads', 'processes'])
+    parser.add_argument('--output', default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    texts = load_texts(args.input, args.fields, args.limit)
+    jieba.initialize()
+    default_context().warm()
+
+    runners = {
+        'sequential': lambda: run_sequential(texts),
+        'threads': lambda: run_threads(texts, args.workers),
+        'processes': lambda: run_processes(texts, args.workers),
+    }
+    report = {}
+    reference = None
+    for mode in args.modes:
+        start = time.perf_counter()
+        features, latencies = runners[mode]()
+        elapsed = time.perf_counter() - start
+        encoded = [json.dumps(f, sort_keys=True) for f in features]
+        if reference is None:
+            reference = encoded
+        report[mode] = {
+            "workers": 1 if mode == 'sequential' else args.workers,
+            "seconds": elapsed,
+            "docs_per_sec": len(texts) / elapsed if elapsed > 0 else 0.0,
+            "latency": latency_summary(latencies),
+            "matches_reference": encoded == reference,
+        }
+
+    print(f"{'mode':<12}{'workers':>8}{'docs/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'same':>6}")
+    for mode, stats in report.items():
+        print(f"{mode:<12}{stats['workers']:>8}{stats['docs_per_sec']:>10.1f}"
+              f"{stats['latency']['p50'] * 1000:>10.1f}{stats['latency']['p95'] * 1000:>10.1f}"
+              f"{'yes' if stats['matches_reference'] else 'NO':>6}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"docs": len(texts), "modes": report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
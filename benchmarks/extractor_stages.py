@@ -0,0 +1,163 @@
+"""
+Per-extractor microbenchmark on the bundled test corpus.
+
+Runs every `feature_*` stage over the `gold` and `generated` texts of
+`data/test/restored_4001-4200.jsonl` and reports per-stage mean / p95 time,
+peak allocation and documents per second. Results can be saved as a JSON
+baseline; later runs compared against it fail (exit code 1) when a stage slows
+down beyond the tolerance or when any feature value differs from the baseline.
+
+    python -m benchmarks.extractor_stages --save-baseline benchmarks/baseline_extractors.json
+    python -m benchmarks.extractor_stages --compare benchmarks/baseline_extractors.json --max-slowdown 0.15
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import jieba
+
+from benchmarks.common import TEST_CORPUS, load_corpus, percentile
+from linguistic_features.feature_extractor import FEATURE_STAGES
+
+
+def load_documents(path, fields, limit=None):
+    """Return (doc_id, text) pairs for the requested fields of each record."""
+    documents = []
+    for record in load_corpus(path, limit):
+        for field in fields:
+            documents.append((f"{record['index']}:{field}", record[field]))
+    return documents
+
+
+def canonical(values):
+    """Serialise feature values so that equality means bit-for-bit equality."""
+    return json.dumps(values, ensure_ascii=False, sort_keys=True)
+
+
+def time_stages(documents, stages, repeat):
+    """Time each stage per document; keep the fastest of `repeat` runs."""
+    timings = {name: [] for name, _ in stages}
+    values = {name: {} for name, _ in stages}
+    for doc_id, text in documents:
+        for name, stage in stages:
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = stage(text)
+                best = min(best, time.perf_counter() - start)
+            timings[name].append(best)
+            values[name][doc_id] = result
+    return timings, values
+
+
+def measure_allocations(documents, stages):
+    """Peak traced allocation (bytes) and allocated blocks per stage call."""
+    peaks = {name: [] for name, _ in stages}
+    blocks = {name: [] for name, _ in stages}
+    tracemalloc.start()
+    try:
+        for _, text in documents:
+            for name, stage in stages:
+                before = tracemalloc.take_snapshot()
+                tracemalloc.reset_peak()
+                base, _ = tracemalloc.get_traced_memory()
+                stage(text)
+                _, peak = tracemalloc.get_traced_memory()
+                after = tracemalloc.take_snapshot()
+                peaks[name].append(peak - base)
+                blocks[name].append(sum(max(0, s.count_diff) for s in after.compare_to(before, 'filename')))
+    finally:
+        tracemalloc.stop()
+    return peaks, blocks
+
+
+def summarise(timings, peaks, blocks):
+    report = {}
+    for name, times in timings.items():
+        total = sum(times)
+        report[name] = {
+            "mean_ms": total / len(times) * 1000 if times else 0.0,
+            "p95_ms": percentile(times, 95) * 1000,
+            "docs_per_sec": len(times) / total if total > 0 else 0.0,
+            "peak_kib": (sum(peaks[name]) / len(peaks[name]) / 1024) if peaks.get(name) else None,
+            "net_blocks": (sum(blocks[name]) / len(blocks[name])) if blocks.get(name) else None,
+        }
+    return report
+
+
+def compare(report, values, baseline, max_slowdown, min_delta_ms):
+    """Return a list of regression messages against a saved baseline."""
+    problems = []
+    for name, stats in report.items():
+        old = baseline['stages'].get(name)
+        if old is None:
+            continue
+        for metric in ('mean_ms', 'p95_ms'):
+            delta = stats[metric] - old[metric]
+            if delta > min_delta_ms and stats[metric] > old[metric] * (1 + max_slowdown):
+                problems.append(f"{name}: {metric} {old[metric]:.3f} -> {stats[metric]:.3f} ms "
+                                f"(+{delta / old[metric] * 100 if old[metric] else float('inf'):.1f}%)")
+        old_values = baseline['values'].get(name, {})
+        mismatched = [doc_id for doc_id, result in values[name].items()
+                      if doc_id in old_values and canonical(result) != canonical(old_values[doc_id])]
+        if mismatched:
+            problems.append(f"{name}: feature values differ from baseline for {len(mismatched)} documents "
+                            f"(first: {mismatched[0]})")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-extractor microbenchmark")
+    parser.add_argument('--input', default=TEST_CORPUS)
+    parser.add_argument('--fields', nargs='+', default=['gold', 'generated'])
+    parser.add_argument('--limit', type=int, default=None, help="Only use the first N records")
+    parser.add_argument('--stages', nargs='+', default=None, help="Subset of stage names to run")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per document, fastest is kept")
+    parser.add_argument('--no-alloc', action='store_true', help="Skip the tracemalloc pass")
+    parser.add_argument('--save-baseline', default=None)
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--max-slowdown', type=float, default=0.10, help="Allowed relative slowdown")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="Ignore slowdowns below this many ms")
+    args = parser.parse_args()
+
+    stages = [(name, fn) for name, fn in FEATURE_STAGES if args.stages is None or name in args.stages]
+    documents = load_documents(args.input, args.fields, args.limit)
+
+    jieba.initialize()
+    for _, stage in stages:
+        stage(documents[0][1])
+
+    timings, values = time_stages(documents, stages, args.repeat)
+    peaks, blocks = ({}, {}) if args.no_alloc else measure_allocations(documents, stages)
+    report = summarise(timings, peaks, blocks)
+
+    print(f"{'stage':<20}{'mean ms':>10}{'p95 ms':>10}{'docs/s':>10}{'peak KiB':>10}{'blocks':>10}")
+    for name, stats in report.items():
+        peak = f"{stats['peak_kib']:.1f}" if stats['peak_kib'] is not None else '-'
+        net = f"{stats['net_blocks']:.0f}" if stats['net_blocks'] is not None else '-'
+        print(f"{name:<20}{stats['mean_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['docs_per_sec']:>10.1f}{peak:>10}{net:>10}")
+    total = sum(sum(times) for times in timings.values())
+    print(f"all stages: {len(documents) / total:.1f} docs/s over {len(documents)} documents")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({"input": args.input, "fields": args.fields, "docs": len(documents),
+                       "stages": report, "values": values}, f, ensure_ascii=False)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        problems = compare(report, values, baseline, args.max_slowdown, args.min_delta_ms)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print("No regressions against baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+End-to-end throughput benchmark for the LLM pipelines against the local mock server.
+
+Runs `exp_train_parallel` (experience extraction) and `subjective_scoring`
+(query construction, retrieval and aspect judging) on the bundled test corpus
+and reports documents per second, per-document tail latency and API calls per
+document for each pipeline.
+
+    python -m benchmarks.pipeline_throughput --docs 50 --chat-latency lognormal:-3,0.5 --rate-limit-rate 0.02
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+
+from openai import OpenAI
+
+from benchmarks.common import TEST_CORPUS, latency_summary, load_corpus
+from mock_openai_server import MockOpenAIServer
+
+
+def request_counts(requests):
+    counts = defaultdict(int)
+    for req in requests:
+        counts[f"{req['endpoint']}:{req['status']}"] += 1
+    return dict(counts)
+
+
+def calls_per_doc(requests, docs):
+    counts = defaultdict(int)
+    for req in requests:
+        counts[req['endpoint']] += 1
+    return {endpoint: count / docs for endpoint, count in counts.items()} if docs else {}
+
+
+def bench_experience_extraction(server, records, workdir):
+    """Run progressive_comparative_learning_parallel over gold/generated pairs."""
+    from exp_train_parallel import progressive_comparative_learning_parallel
+
+    reason_file = os.path.join(workdir, 'reason.json')
+    restored_file = os.path.join(workdir, 'restored.jsonl')
+    with open(reason_file, 'w', encoding='utf-8') as f:
+        json.dump([{"index": r['index'], "reason": r['gold']} for r in records], f, ensure_ascii=False)
+    with open(restored_file, 'w', encoding='utf-8') as f:
+        for r in records:
+            f.write(json.dumps({"index": r['index'], "restored": r['generated']}, ensure_ascii=False) + '\n')
+
+    os.environ['BASE_URL'] = server.base_url
+    os.environ['OPENAI_API_KEY'] = 'mock'
+    output_prefix = os.path.join(workdir, 'model_output')
+
+    server.stats.reset()
+    start = time.perf_counter()
+    progress, examples_jsonl = progressive_comparative_learning_parallel(
+        reason_file, restored_file, max_samples=len(records), output_prefix=output_prefix)
+    elapsed = time.perf_counter() - start
+    requests = server.stats.snapshot()['requests']
+
+    # One extract_examples call per document; retries resend the same body.
+    spans = defaultdict(lambda: [float('inf'), 0.0])
+    for req in requests:
+        span = spans[req['body_hash']]
+        span[0] = min(span[0], req['started'])
+        span[1] = max(span[1], req['finished'])
+    latencies = [end - begin for begin, end in spans.values()]
+    failed = sum(1 for p in progress if not p.get('successful', False))
+
+    return {
+        "docs": len(records),
+        "failed": failed,
+        "elapsed": elapsed,
+        "docs_per_sec": len(records) / elapsed if elapsed > 0 else 0.0,
+        "latency": latency_summary(latencies),
+        "calls_per_doc": calls_per_doc(requests, len(records)),
+        "requests": request_counts(requests),
+    }, examples_jsonl
+
+
+def bench_subjective_scoring(server, records, exp_library, x, y, N):
+    """Score each generated text with score_document, timing every document."""
+    from subjective_scoring import load_experiences, score_document
+
+    client = OpenAI(base_url=server.base_url, api_key='mock')
+    embedding_model = 'mock-embedding'
+    generation_model = 'mock-chat'
+
+    server.stats.reset()
+    setup_start = time.perf_counter()
+    experiences = load_experiences(exp_library, N, client, embedding_model)
+    setup_elapsed = time.perf_counter() - setup_start
+    setup_requests = server.stats.snapshot()['requests']
+
+    server.stats.reset()
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+    for record in records:
+        doc_start = time.perf_counter()
+        try:
+            score_document(record['generated'], experiences, generation_model, embedding_model, x, y, client, client)
+        except Exception as e:
+            print(f"Error scoring {record['index']}: {e}")
+            failed += 1
+        latencies.append(time.perf_counter() - doc_start)
+    elapsed = time.perf_counter() - start
+    requests = server.stats.snapshot()['requests']
+
+    return {
+        "docs": len(records),
+        "failed": failed,
+        "pool_pairs": len(experiences),
+        "setup_elapsed": setup_elapsed,
+        "setup_calls": len(setup_requests),
+        "elapsed": elapsed,
+        "docs_per_sec": len(records) / elapsed if elapsed > 0 else 0.0,
+        "latency": latency_summary(latencies),
+        "calls_per_doc": calls_per_doc(requests, len(records)),
+        "requests": request_counts(requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline throughput benchmark against the mock OpenAI server")
+    parser.add_argument('--input', default=TEST_CORPUS)
+    parser.add_argument('--docs', type=int, default=20, help="Number of test documents to run")
+    parser.add_argument('--x', type=int, default=5, help="Queries per document")
+    parser.add_argument('--y', type=int, default=5, help="Retrieved pairs per query")
+    parser.add_argument('--N', type=int, default=None, help="Experience steps loaded for retrieval")
+    parser.add_argument('--chat-latency', default='constant:0')
+    parser.add_argument('--embedding-latency', default='constant:0')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="Optional JSON report path")
+    args = parser.parse_args()
+
+    records = load_corpus(args.input, args.docs)
+    server = MockOpenAIServer(chat_latency=args.chat_latency, embedding_latency=args.embedding_latency,
+                              error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed)
+    report = {"config": vars(args)}
+    with server, tempfile.TemporaryDirectory() as workdir:
+        report['exp_train_parallel'], examples_jsonl = bench_experience_extraction(server, records, workdir)
+        report['subjective_scoring'] = bench_subjective_scoring(server, records, examples_jsonl, args.x, args.y, args.N)
+
+    for name in ('exp_train_parallel', 'subjective_scoring'):
+        result = report[name]
+        calls = ', '.join(f"{k}={v:.1f}" for k, v in sorted(result['calls_per_doc'].items()))
+        print(f"{name}: {result['docs_per_sec']:.2f} docs/s, p50 {result['latency']['p50'] * 1000:.1f} ms, "
+              f"p95 {result['latency']['p95'] * 1000:.1f} ms, p99 {result['latency']['p99'] * 1000:.1f} ms, "
+              f"calls/doc {calls}, failed {result['failed']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Overlap of local BM25 retrieval with embedding retrieval.
+
+For query sentences taken from the test corpus, retrieves the top y negatives
+of an experience pool with the BM25 index of lexical_index and with exact
+cosine search over negative embeddings, as `find_top_pairs` does, and reports
+overlap@y (shared results / y), per-query latency and the embedding API calls
+the BM25 path avoids.
+
+Embeddings come from a compiled pool built with `--embedding-model`, from the
+endpoint configured by EMBEDDING_BASE_URL / EMBEDDING_API_KEY
+(`--embedding-model`), or, with `--mock-embeddings`, from the hashed-bigram
+embedder of mock_openai_server (itself lexical, so only a smoke test).
+
+    python -m benchmarks.retrieval_overlap --pool data/examples.jsonl --embedding-model text-embedding-3-small --y 5
+"""
+
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+
+from benchmarks.common import TEST_CORPUS, latency_summary, load_corpus
+from compiled_pool import CompiledPool, is_compiled_pool, openai_embedder
+from embedding_index import normalize_rows
+from lexical_index import load_index, pool_negatives
+
+
+def query_sentences(path, n, seed):
+    """Random sentences of the `generated` texts of the test corpus."""
+    sentences = [s for record in load_corpus(path) for s in re.split(r'[。；\n]', record['generated'])
+                 if len(s.strip()) >= 8]
+    rng = np.random.default_rng(seed)
+    return [sentences[i].strip() for i in rng.choice(len(sentences), size=min(n, len(sentences)), replace=False)]
+
+
+def mock_embedder(dim=256):
+    from mock_openai_server import embed_text
+    return lambda texts: np.array([embed_text(text, dim) for text in texts])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 vs embedding retrieval overlap benchmark")
+    parser.add_argument('--pool', required=True, help="examples.jsonl or a compiled pool directory")
+    parser.add_argument('--corpus', default=TEST_CORPUS, help="Source of the query sentences")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--y', type=int, default=5)
+    parser.add_argument('--embedding-model', default=None)
+    parser.add_argument('--mock-embeddings', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+
+    if args.mock_embeddings:
+        embed = mock_embedder()
+    elif args.embedding_model:
+        from subjective_scoring import make_clients
+        embed = openai_embedder(make_clients()[1], args.embedding_model)
+    else:
+        raise SystemExit("Pass --embedding-model or --mock-embeddings")
+
+    queries = query_sentences(args.corpus, args.queries, args.seed)
+    index = load_index(args.pool)
+    if is_compiled_pool(args.pool) and not args.mock_embeddings and CompiledPool(args.pool).neg_embeddings is not None:
+        matrix = normalize_rows(CompiledPool(args.pool).neg_embeddings)
+        pool_calls = 0
+    else:
+        texts, total = pool_negatives(args.pool)
+        texts = list(texts)
+        batches = [embed(texts[i:i + args.batch_size]) for i in range(0, total, args.batch_size)]
+        matrix = normalize_rows(np.vstack(batches)) if batches else np.zeros((0, 1), dtype=np.float32)
+        pool_calls = len(batches)
+
+    overlaps, bm25_latencies, embedding_latencies = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        lexical, _ = index.search(query, args.y)
+        bm25_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        q = normalize_rows(embed([query])[0])
+        sims = matrix @ q
+        dense = np.argsort(sims)[-args.y:][::-1]
+        embedding_latencies.append(time.perf_counter() - start)
+        overlaps.append(len(set(lexical.tolist()) & set(dense.tolist())) / max(min(args.y, len(sims)), 1))
+
+    report = {
+        "pool_size": len(index),
+        "queries": len(queries),
+        "y": args.y,
+        "overlap": float(np.mean(overlaps)) if overlaps else 0.0,
+        "full_overlap_rate": float(np.mean([o == 1.0 for o in overlaps])) if overlaps else 0.0,
+        "bm25_latency": latency_summary(bm25_latencies),
+        "embedding_latency": latency_summary(embedding_latencies),
+        "embedding_calls_avoided": pool_calls + len(queries),
+    }
+    print(f"{len(queries)} queries over {len(index)} negatives, y={args.y}")
+    print(f"overlap@{args.y}: {report['overlap']:.3f} (identical top-{args.y}: {report['full_overlap_rate']:.3f})")
+    print(f"bm25 p50 {report['bm25_latency']['p50'] * 1000:.2f} ms, "
+          f"embedding p50 {report['embedding_latency']['p50'] * 1000:.2f} ms (incl. query embedding)")
+    print(f"embedding calls avoided: {report['embedding_calls_avoided']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,298 @@
+"""
+Compiled, memory-mapped experience pool.
+
+`examples.jsonl` (`{"step": ..., "pair": [{"positive": ..., "negative": ...}]}`
+per line) is compiled once into a directory of flat arrays:
+
+    pool/
+        meta.json               counts, source file, embedding model, feature names
+        pos_blob.bin            UTF-8 positives laid end to end
+        pos_offsets.npy         int64, pair i is pos_blob[offsets[i]:offsets[i + 1]]
+        neg_blob.bin            UTF-8 negatives laid end to end
+        neg_offsets.npy         int64
+        lines.npy               int64 source line of each pair (non-decreasing)
+        steps.npy               int64 `step` of each pair's line
+        neg_embeddings.npy      float32 (pairs x dim), with --embedding-model
+        pos_features.npy        float32 (pairs x features), with --features
+        neg_features.npy        float32 (pairs x features), with --features
+        neg_codes.npy           float16 / int8 quantised negative embeddings and
+        neg_scales.npy          their int8 scales (embedding_index.py quantize)
+
+    python compiled_pool.py build data/examples.jsonl --out data/examples.pool \\
+        --embedding-model text-embedding-3-small --features
+    python compiled_pool.py info data/examples.pool
+
+`CompiledPool` memory-maps every file, so opening a pool of 4k or 4M pairs
+costs the same and creates no Python object per pair; the pairs of the first N
+source lines are a prefix, found by a binary search over `lines`. The scoring
+scripts accept the directory wherever they take `examples.jsonl`. Embeddings
+and features are stored as float32, so results computed from a compiled pool
+can differ from the JSONL path in the last digits.
+"""
+
+import argparse
+import json
+import os
+import shutil
+from array import array
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from jsonl_index import JsonlIndex
+from shared_arrays import StringArray
+
+POOL_VERSION = 1
+
+
+def is_compiled_pool(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+def _load_array(directory: str, name: str) -> Optional[np.ndarray]:
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return None
+    if name.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    # Zero-length files cannot be memory-mapped
+    return np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+
+
+class CompiledPool:
+    """
+    Read-only view of a compiled pool directory.
+
+    Args:
+        directory (str): Output directory of `build_pool`
+
+    Attributes:
+        positives, negatives: StringArray of the pair texts
+        neg_embeddings: float32 memmap (pairs x dim), or None
+        pos_features, neg_features: float32 memmaps (pairs x features), or None
+        lines, steps: int64 memmaps, source line and step of each pair
+        feature_names: Columns of the feature matrices
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != POOL_VERSION:
+            raise ValueError(f"{directory} is a version {self.meta.get('version')} pool, expected {POOL_VERSION}")
+        self.directory = directory
+        self.arrays = {}
+        for name in ('pos_blob.bin', 'pos_offsets.npy', 'neg_blob.bin', 'neg_offsets.npy', 'lines.npy', 'steps.npy',
+                     'neg_embeddings.npy', 'pos_features.npy', 'neg_features.npy', 'neg_codes.npy',
+                     'neg_scales.npy'):
+            array_ = _load_array(directory, name)
+            if array_ is not None:
+                self.arrays[name.split('.')[0]] = array_
+        self.positives = StringArray(self.arrays['pos_blob'], self.arrays['pos_offsets'])
+        self.negatives = StringArray(self.arrays['neg_blob'], self.arrays['neg_offsets'])
+        self.lines = self.arrays['lines']
+        self.steps = self.arrays['steps']
+        self.neg_embeddings = self.arrays.get('neg_embeddings')
+        self.pos_features = self.arrays.get('pos_features')
+        self.neg_features = self.arrays.get('neg_features')
+        self.feature_names = self.meta.get('feature_names')
+
+    def __len__(self) -> int:
+        return self.meta['pairs']
+
+    def pair_count(self, N: Optional[int] = None) -> int:
+        """Number of pairs in the first N source lines (all pairs if N is None)."""
+        if N is None:
+            return len(self)
+        return int(np.searchsorted(self.lines, N, side='left'))
+
+    def is_current(self) -> bool:
+        """Whether the source JSONL still has the size and mtime it was compiled from."""
+        source = self.meta['source']
+        return os.path.exists(source) and os.path.getsize(source) == self.meta['source_size'] and \
+            os.path.getmtime(source) == self.meta['source_mtime']
+
+
+def _batches(n: int, batch_size: int) -> Iterator[Tuple[int, int]]:
+    for start in range(0, n, batch_size):
+        yield start, min(start + batch_size, n)
+
+
+def openai_embedder(client, model_name: str) -> Callable[[List[str]], np.ndarray]:
+    """Batch embedding function over an OpenAI-compatible client."""
+    def embed(texts):
+        response = client.embeddings.create(input=texts, model=model_name)
+        return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)])
+    return embed
+
+
+def _compile_texts(examples_jsonl: str, out_dir: str) -> Tuple[int, int]:
+    """Write the string arenas and the source index; returns (pairs, lines)."""
+    pos_offsets, neg_offsets = array('q', [0]), array('q', [0])
+    lines, steps = array('q'), array('q')
+    with JsonlIndex(examples_jsonl) as records, \
+            open(os.path.join(out_dir, 'pos_blob.bin'), 'wb') as pos_blob, \
+            open(os.path.join(out_dir, 'neg_blob.bin'), 'wb') as neg_blob:
+        n_lines = len(records)
+        for line, exp in enumerate(tqdm(records.iter(), total=n_lines, desc="Compiling pool")):
+            for pair in exp.get('pair', []):
+                positive, negative = pair['positive'].encode('utf-8'), pair['negative'].encode('utf-8')
+                pos_blob.write(positive)
+                neg_blob.write(negative)
+                pos_offsets.append(pos_offsets[-1] + len(positive))
+                neg_offsets.append(neg_offsets[-1] + len(negative))
+                lines.append(line)
+                steps.append(exp.get('step', line))
+    for name, values in (('pos_offsets', pos_offsets), ('neg_offsets', neg_offsets), ('lines', lines),
+                         ('steps', steps)):
+        np.save(os.path.join(out_dir, name + '.npy'), np.frombuffer(values, dtype=np.int64))
+    return len(lines), n_lines
+
+
+def _compile_embeddings(texts: StringArray, out_dir: str, embed: Callable[[List[str]], np.ndarray],
+                        batch_size: int) -> int:
+    matrix = None
+    for start, stop in tqdm(list(_batches(len(texts), batch_size)), desc="Embedding negatives"):
+        vectors = embed([texts[i] for i in range(start, stop)])
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(os.path.join(out_dir, 'neg_embeddings.npy'), mode='w+',
+                                               dtype=np.float32, shape=(len(texts), vectors.shape[1]))
+        matrix[start:stop] = vectors
+    if matrix is None:
+        return 0
+    matrix.flush()
+    return matrix.shape[1]
+
+
+def _compile_features(positives: StringArray, negatives: StringArray, out_dir: str, batch_size: int,
+                      instrumentation=None, client=None) -> List[str]:
+    from objective_scoring import extract_features
+    from sharded_extraction import feature_row
+    feature_names, matrices = None, {}
+    for name, texts in (('pos_features', positives), ('neg_features', negatives)):
+        for start, stop in _batches(len(texts), batch_size):
+            features = extract_features([texts[i] for i in range(start, stop)], instrumentation, client,
+                                        [f"{name[:3]}:{i}" for i in range(start, stop)], f"Extracting {name[:3]}")
+            for i, feature_dicts in enumerate(features, start):
+                # Columns of the first document, as in sharded_extraction blocks
+                row, feature_names = feature_row(feature_dicts, feature_names)
+                if name not in matrices:
+                    matrices[name] = np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+',
+                                                               dtype=np.float32, shape=(len(texts), len(row)))
+                matrices[name][i] = row
+    for matrix in matrices.values():
+        matrix.flush()
+    return feature_names or []
+
+
+def build_pool(examples_jsonl: str, out_dir: str, embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+               embedding_model: Optional[str] = None, features: bool = False, batch_size: int = 256,
+               instrumentation=None, client=None) -> Dict:
+    """
+    Compile an experience pool JSONL into `out_dir`.
+
+    The pool is written to a temporary directory next to `out_dir` and moved
+    into place when complete.
+
+    Args:
+        examples_jsonl (str): Experience pool JSONL
+        out_dir (str): Pool directory; an existing one is replaced only if it
+            is empty or a compiled pool (anything else raises ValueError)
+        embed: Function mapping a list of texts to their embeddings; the
+            negatives are embedded when given
+        embedding_model (str): Name recorded in meta.json
+        features (bool): Extract the objective features of both sides
+        batch_size (int): Texts per embedding request / extraction batch
+        instrumentation: Feature extraction instrumentation
+        client: Extraction daemon client
+
+    Returns:
+        Dict: The pool's meta.json data
+    """
+    if os.path.lexists(out_dir) and not (os.path.isdir(out_dir) and
+                                         (not os.listdir(out_dir) or is_compiled_pool(out_dir))):
+        raise ValueError(f"{out_dir} exists and is not a compiled pool; refusing to replace it")
+    tmp_dir = f"{out_dir.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        n_pairs, n_lines = _compile_texts(examples_jsonl, tmp_dir)
+        positives = StringArray(_load_array(tmp_dir, 'pos_blob.bin'), _load_array(tmp_dir, 'pos_offsets.npy'))
+        negatives = StringArray(_load_array(tmp_dir, 'neg_blob.bin'), _load_array(tmp_dir, 'neg_offsets.npy'))
+        meta = {
+            "version": POOL_VERSION,
+            "source": os.path.abspath(examples_jsonl),
+            "source_size": os.path.getsize(examples_jsonl),
+            "source_mtime": os.path.getmtime(examples_jsonl),
+            "pairs": n_pairs,
+            "lines": n_lines,
+            "embedding_model": None,
+            "embedding_dim": None,
+            "feature_names": None,
+        }
+        if embed is not None:
+            meta["embedding_dim"] = _compile_embeddings(negatives, tmp_dir, embed, batch_size)
+            meta["embedding_model"] = embedding_model
+        if features:
+            meta["feature_names"] = _compile_features(positives, negatives, tmp_dir, batch_size, instrumentation,
+                                                      client)
+        del positives, negatives
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile experience pools into memory-mapped directories")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = commands.add_parser('build', help="Compile an examples.jsonl")
+    build_parser.add_argument('examples_jsonl')
+    build_parser.add_argument('--out', required=True, help="Pool directory")
+    build_parser.add_argument('--embedding-model', help="Embed the negatives with this model (EMBEDDING_* env)")
+    build_parser.add_argument('--features', action='store_true', help="Extract the objective features")
+    build_parser.add_argument('--batch-size', type=int, default=256)
+    build_parser.add_argument('--aspects', action='store_true',
+                              help="Tag the pairs with their judge aspects (aspect_tagging) after compiling")
+
+    info_parser = commands.add_parser('info', help="Describe a compiled pool")
+    info_parser.add_argument('pool')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        embed = None
+        if args.embedding_model:
+            from subjective_scoring import make_clients
+            _, embedding_client = make_clients()
+            embed = openai_embedder(embedding_client, args.embedding_model)
+        instrumentation = client = None
+        if args.features:
+            from extraction_daemon import daemon_client
+            from linguistic_features.instrumentation import instrumentation_from_env
+            instrumentation, client = instrumentation_from_env(), daemon_client()
+        try:
+            meta = build_pool(args.examples_jsonl, args.out, embed, args.embedding_model, args.features,
+                              args.batch_size, instrumentation, client)
+        finally:
+            if instrumentation is not None:
+                instrumentation.close()
+        print(f"{meta['pairs']} pairs from {meta['lines']} lines -> {args.out}")
+        if args.aspects:
+            from aspect_tagging import build_tags
+            build_tags(args.out)
+    else:
+        pool = CompiledPool(args.pool)
+        summary = {key: value for key, value in pool.meta.items() if key != 'feature_names'}
+        summary["features"] = len(pool.feature_names) if pool.feature_names else 0
+        summary["current"] = pool.is_current()
+        summary["bytes"] = sum(os.path.getsize(os.path.join(args.pool, f)) for f in os.listdir(args.pool))
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
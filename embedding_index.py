@@ -0,0 +1,198 @@
+"""
+Cosine retrieval over float16 or int8 scalar-quantised embedding matrices.
+
+Embeddings are normalised to unit length and stored either as float16 or as
+int8 codes with one float32 scale per vector (`v ≈ codes * scale`, scale =
+max|v| / 127), i.e. 2 or 1 bytes per dimension instead of the 8 of the
+float64 arrays the pool kept per experience. Search scores the quantised
+matrix block by block (memory: one block converted to float32), keeps the
+best `rerank` candidates and, when the float32 matrix is available (e.g. the
+memory-mapped one of a compiled pool, of which only the shortlisted rows are
+read), re-scores them exactly before taking the top k.
+
+    python embedding_index.py quantize data/examples.pool --dtype int8
+
+writes `neg_codes.npy` (and `neg_scales.npy` for int8) into a compiled pool;
+subjective_scoring then retrieves through the quantised matrix, re-ranking
+the best CLASE_EMBEDDING_RERANK (default 0: off) candidates in float32.
+`python -m benchmarks.embedding_quantization` compares recall and memory with
+the float path.
+"""
+
+import argparse
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+BLOCK_ROWS = 4096
+DTYPES = ('float16', 'int8')
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """float32 rows scaled to unit length (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms > 0, norms, 1.0)
+
+
+def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantise the normalised rows of a (block of an) embedding matrix.
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: float16 rows and None, or
+            int8 codes and float32 per-row scales
+    """
+    unit = normalize_rows(matrix)
+    if dtype == 'float16':
+        return unit.astype(np.float16), None
+    if dtype != 'int8':
+        raise ValueError(f"Unknown quantisation {dtype}, expected one of {DTYPES}")
+    peak = np.abs(unit).max(axis=1)
+    scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+class EmbeddingIndex:
+    """
+    Top-k cosine search over a quantised embedding matrix.
+
+    Args:
+        codes (np.ndarray): float16 unit rows or int8 codes (may be memory-mapped)
+        scales (np.ndarray): float32 per-row scales of int8 codes, None for float16
+        full (np.ndarray): Unquantised matrix for re-ranking (rows need not be
+            normalised), or None
+        rerank (int): Shortlist size re-scored with `full`; 0 disables re-ranking
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None, full: Optional[np.ndarray] = None,
+                 rerank: int = 0):
+        if codes.dtype == np.int8 and scales is None:
+            raise ValueError("int8 codes need their per-vector scales")
+        self.codes = codes
+        self.scales = scales
+        self.full = full
+        self.rerank = rerank if full is not None else 0
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, dtype: str = 'int8', rerank: int = 0,
+              keep_full: bool = False) -> 'EmbeddingIndex':
+        """Quantise an in-memory embedding matrix."""
+        codes, scales = quantize(embeddings, dtype)
+        return cls(codes, scales, embeddings if keep_full else None, rerank)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the quantised matrix and scales (the float matrix is not counted)."""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query: np.ndarray, limit: Optional[int] = None) -> np.ndarray:
+        """Approximate cosine similarity of the query with the first `limit` rows."""
+        q = normalize_rows(query)
+        n = len(self.codes) if limit is None else min(limit, len(self.codes))
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, n)
+            out[start:stop] = self.codes[start:stop].astype(np.float32) @ q
+            if self.scales is not None:
+                out[start:stop] *= self.scales[start:stop]
+        return out
+
+    def search(self, query: np.ndarray, k: int, limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows most similar to the query, best first.
+
+        Args:
+            query (np.ndarray): Query embedding
+            k (int): Number of results
+            limit (int): Only search the first `limit` rows (an N-line pool prefix)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Row indices and their similarities
+        """
+        return self.rank(self.scores(query, limit), query, k)
+
+    def rank(self, scores: np.ndarray, query: np.ndarray, k: int,
+             rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Best k rows by precomputed `scores` (of the first len(scores) rows),
+        re-ranked as in `search`; with `rows`, only among those row ids (a
+        sub-index), so one scoring pass serves several sub-indices.
+        """
+        if rows is not None:
+            rows = rows[rows < len(scores)]
+        k = min(k, len(scores) if rows is None else len(rows))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if rows is None:
+            shortlist = _top(scores, max(k, self.rerank))
+        else:
+            shortlist = rows[_top(scores[rows], max(k, self.rerank))]
+        if self.rerank:
+            # Exact float32 scores for the shortlist only; other rows of `full` are never read
+            ordered = np.sort(shortlist)
+            exact = normalize_rows(self.full[ordered]) @ normalize_rows(query)
+            best = _top(exact, k)
+            return ordered[best], exact[best]
+        best = shortlist[:k]
+        return best, scores[best]
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first."""
+    k = min(k, len(scores))
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def quantize_pool(pool_dir: str, dtype: str, block_rows: int = 65536) -> int:
+    """
+    Write quantised negative embeddings into a compiled pool.
+
+    The float32 matrix is read block by block, so pools larger than memory can
+    be quantised. Returns the size in bytes of the quantised files.
+    """
+    from compiled_pool import CompiledPool
+    pool = CompiledPool(pool_dir)
+    if pool.neg_embeddings is None:
+        raise ValueError(f"{pool_dir} was compiled without embeddings (build --embedding-model)")
+    n, dim = pool.neg_embeddings.shape
+    codes_path, scales_path = os.path.join(pool_dir, 'neg_codes.npy'), os.path.join(pool_dir, 'neg_scales.npy')
+    tmp_codes = f"{codes_path}.{os.getpid()}.tmp.npy"
+    codes = np.lib.format.open_memmap(tmp_codes, mode='w+', dtype=np.float16 if dtype == 'float16' else np.int8,
+                                      shape=(n, dim))
+    scales = np.zeros(n, dtype=np.float32) if dtype == 'int8' else None
+    for start in range(0, n, block_rows):
+        block_codes, block_scales = quantize(pool.neg_embeddings[start:start + block_rows], dtype)
+        codes[start:start + len(block_codes)] = block_codes
+        if scales is not None:
+            scales[start:start + len(block_scales)] = block_scales
+    codes.flush()
+    del codes
+    if scales is not None:
+        np.save(scales_path, scales)
+    elif os.path.exists(scales_path):
+        os.remove(scales_path)
+    os.replace(tmp_codes, codes_path)
+    return os.path.getsize(codes_path) + (os.path.getsize(scales_path) if scales is not None else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantise the negative embeddings of a compiled pool")
+    commands = parser.add_subparsers(dest='command', required=True)
+    quantize_parser = commands.add_parser('quantize')
+    quantize_parser.add_argument('pool')
+    quantize_parser.add_argument('--dtype', choices=DTYPES, default='int8')
+    args = parser.parse_args()
+
+    size = quantize_pool(args.pool, args.dtype)
+    print(f"{args.dtype} embeddings of {args.pool}: {size / 2 ** 20:.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
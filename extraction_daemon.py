@@ -0,0 +1,358 @@
+"""
+Long-running local feature extraction daemon and its client.
+
+Keeps the jieba dictionary, the lexicons, the segmentation cache and the
+trained objective models loaded, and serves over localhost HTTP:
+
+    GET  /health        {"ok": true, "fingerprint": ..., "documents": ..., "batches": ..., "models": [...]}
+    POST /v1/features   {"texts": [...]}                  -> {"features": [[{"1": ...}, ...], ...]}
+    POST /v1/scores     {"texts": [...], "model": path}   -> {"scores": [...]}
+
+Concurrent requests are micro-batched: a single extraction thread owning a warm
+ExtractionContext collects the texts of every request that arrives within
+`--max-wait-ms` (up to `--max-batch` texts), extracts each distinct text once
+(the chunker stage in one pass over the batch) and answers all of them.
+
+    python extraction_daemon.py --port 8766 --model output/objective_scores/model_N1000_k20.json
+
+Using the daemon is opt-in: `daemon_client()` returns a client only when
+CLASE_DAEMON_URL is set, the daemon answers, and its extraction fingerprint
+(feature code, resources and jieba version) matches this process's, so a
+daemon started from older code is never used. Otherwise it returns None and
+callers extract in process.
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jieba
+import numpy as np
+
+from feature_scaling import model_normalization, standardize
+from linguistic_features.context import default_context
+from linguistic_features.feature_extractor import extract_features_batch, extraction_fingerprint
+from linguistic_features.instrumentation import instrumentation_from_env
+
+DEFAULT_URL = "http://127.0.0.1:8766"
+
+
+def flatten_features(features):
+    """Merge the per-feature dictionaries returned by extract_all_features."""
+    flat = {}
+    for feature_dict in features:
+        flat.update(feature_dict)
+    return flat
+
+
+class ObjectiveModel:
+    """
+    Logistic regression saved by objective_scoring (feature_names, coefficients,
+    intercept and, for z-scored models, normalization).
+
+    Args:
+        path (str): model_N{N}_k{k}.json file
+    """
+
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.feature_names = data['feature_names']
+        self.coefficients = np.array(data['coefficients'])
+        self.intercept = data['intercept']
+        self.mean, self.scale = model_normalization(data)
+
+    def score(self, features):
+        """Sigmoid score of one document, computed as in objective_scoring.process."""
+        flat = flatten_features(features)
+        x = np.zeros(len(self.feature_names))
+        for j, name in enumerate(self.feature_names):
+            x[j] = flat.get(name, 0.0)
+        linear_pred = self.intercept + np.dot(self.coefficients, standardize(x, self.mean, self.scale))
+        return float(1 / (1 + np.exp(-linear_pred)))
+
+
+class MicroBatcher:
+    """
+    Collects texts from concurrent callers and extracts them in one thread.
+
+    Args:
+        extract (callable): Function mapping a list of distinct texts to their
+            features, with an exception in place of the features of a failed text
+        max_batch (int): Maximum number of texts per batch
+        max_wait (float): Seconds to wait for further requests after the first one
+    """
+
+    def __init__(self, extract, max_batch=64, max_wait=0.005):
+        self.extract = extract
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.documents = 0
+        self.batches = 0
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts):
+        """Features of `texts`, blocking until their batch has been extracted."""
+        future = Future()
+        self.requests.put((list(texts), future))
+        return future.result()
+
+    def _collect(self):
+        pending = [self.requests.get()]
+        size = len(pending[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            size += len(request[0])
+        return pending
+
+    def _loop(self):
+        while True:
+            pending = self._collect()
+            unique = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+            try:
+                results = dict(zip(unique, self.extract(unique)))
+            except Exception as e:
+                results = dict.fromkeys(unique, e)
+            self.documents += len(unique)
+            self.batches += 1
+            for texts, future in pending:
+                features = [results[text] for text in texts]
+                error = next((f for f in features if isinstance(f, Exception)), None)
+                if error is None:
+                    future.set_result(features)
+                else:
+                    future.set_exception(error)
+
+
+class ExtractionDaemon:
+    """
+    Feature extraction and objective scoring server.
+
+    Args:
+        host (str): Bind address
+        port (int): Bind port, 0 picks a free port
+        models (list): Model files to load at start-up (others load on first use)
+        max_batch (int): Maximum texts per extraction batch
+        max_wait_ms (float): Micro-batching window in milliseconds
+    """
+
+    def __init__(self, host='127.0.0.1', port=8766, models=(), max_batch=64, max_wait_ms=5.0):
+        jieba.initialize()
+        self.ctx = default_context().fork().warm()
+        self.instrumentation = instrumentation_from_env()
+        self.batcher = MicroBatcher(self._extract, max_batch, max_wait_ms / 1000)
+        self.models = {}
+        self.models_lock = threading.Lock()
+        for path in models:
+            self.model(path)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _extract(self, texts):
+        # A text that fails comes back as its exception: only the requests containing it fail
+        return extract_features_batch(texts, self.instrumentation, ctx=self.ctx)
+
+    def model(self, path):
+        """Loaded model for `path`, reloaded when the file has changed."""
+        path = os.path.abspath(path)
+        with self.models_lock:
+            model = self.models.get(path)
+            if model is None or os.path.getmtime(path) != model.mtime:
+                model = self.models[path] = ObjectiveModel(path)
+            return model
+
+    def features(self, request):
+        return {"features": self.batcher.submit(request['texts'])}
+
+    def scores(self, request):
+        model = self.model(request['model'])
+        features = self.batcher.submit(request['texts'])
+        return {"scores": [model.score(f) for f in features]}
+
+    def health(self):
+        return {"ok": True, "fingerprint": extraction_fingerprint(), "documents": self.batcher.documents, "batches": self.batcher.batches,
+                "models": sorted(self.models)}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/health':
+                    self._send(200, server.health())
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "invalid JSON"}})
+                    return
+                if self.path == '/v1/features':
+                    handler = server.features
+                elif self.path == '/v1/scores':
+                    handler = server.scores
+                else:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                try:
+                    self._send(200, handler(request))
+                except (KeyError, TypeError, OSError) as e:
+                    self._send(400, {"error": {"message": f"{type(e).__name__}: {e}"}})
+                except Exception as e:
+                    self._send(500, {"error": {"message": f"{type(e).__name__}: {e}"}})
+
+        return Handler
+
+    def start(self):
+        """Serve in a background daemon thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.instrumentation is not None:
+            self.instrumentation.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class DaemonClient:
+    """
+    Thin client for a running ExtractionDaemon.
+
+    Args:
+        url (str): Daemon base URL
+        timeout (float): Seconds to wait for a response
+        batch_size (int): Texts sent per request
+    """
+
+    def __init__(self, url=None, timeout=300.0, batch_size=32):
+        self.url = (url or os.getenv('CLASE_DAEMON_URL', DEFAULT_URL)).rstrip('/')
+        self.timeout = timeout
+        self.batch_size = batch_size
+
+    def _post(self, path, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read() or b'{}').get('error', {}).get('message', e.reason)
+            raise RuntimeError(f"Extraction daemon error {e.code}: {message}") from None
+
+    def health(self, timeout=None):
+        with urllib.request.urlopen(self.url + '/health', timeout=timeout or self.timeout) as response:
+            return json.loads(response.read())
+
+    def features(self, texts):
+        """extract_all_features output for each text."""
+        texts = list(texts)
+        results = []
+        for i in range(0, len(texts), self.batch_size):
+            results.extend(self._post('/v1/features', {"texts": texts[i:i + self.batch_size]})['features'])
+        return results
+
+    def scores(self, texts, model_path):
+        """Objective scores of each text under a model file readable by the daemon."""
+        texts = list(texts)
+        model_path = os.path.abspath(model_path)
+        results = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = {"texts": texts[i:i + self.batch_size], "model": model_path}
+            results.extend(self._post('/v1/scores', batch)['scores'])
+        return results
+
+
+def daemon_client(url=None, timeout=0.5):
+    """
+    Client for the daemon at `url` (CLASE_DAEMON_URL by default) if one is
+    configured, answering and extracting with the same code as this process,
+    otherwise None.
+    """
+    url = url or os.getenv('CLASE_DAEMON_URL')
+    if not url:
+        return None
+    client = DaemonClient(url)
+    try:
+        health = client.health(timeout)
+    except (OSError, ValueError):
+        return None
+    if health.get('fingerprint') != extraction_fingerprint():
+        print(f"Extraction daemon at {client.url} runs different feature code "
+              f"({health.get('fingerprint')} != {extraction_fingerprint()}); extracting in process", file=sys.stderr)
+        return None
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm CLASE feature extraction daemon")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--model', action='append', default=[], help="Objective model file to preload (repeatable)")
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    daemon = ExtractionDaemon(args.host, args.port, args.model, args.max_batch, args.max_wait_ms)
+    print(f"Extraction daemon listening on {daemon.url}")
+    try:
+        daemon.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.httpd.server_close()
+        if daemon.instrumentation is not None:
+            daemon.instrumentation.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Z-score normalisation of objective features with streaming, mergeable statistics.
+
+`RunningMoments` accumulates the per-column count, mean and sum of squared
+deviations block by block (Welford's update generalised to blocks by Chan et
+al.'s pairwise formula), so its memory is one value per column however many
+rows go through it, and the moments of separate shards merge exactly into the
+moments of their union:
+
+    moments = RunningMoments(n_features)
+    for X in blocks:
+        moments.update(X)
+    total = RunningMoments.from_dict(shard_a).merge(RunningMoments.from_dict(shard_b))
+
+Models store the statistics of their features next to the coefficients, so a
+model JSON is scored as
+
+    z = (x - normalization.mean) / normalization.scale
+    score = sigmoid(intercept + coefficients . z)
+
+Model files without `normalization` are scored on raw values.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class RunningMoments:
+    """
+    Per-column count, mean and sum of squared deviations (M2).
+
+    Args:
+        n_columns (int): Number of feature columns
+    """
+
+    def __init__(self, n_columns: int):
+        self.n = 0
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+
+    @classmethod
+    def from_array(cls, X: np.ndarray) -> 'RunningMoments':
+        moments = cls(X.shape[1])
+        moments.update(X)
+        return moments
+
+    def _combine(self, n: int, mean: np.ndarray, m2: np.ndarray) -> None:
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + np.square(delta) * (self.n * n / total)
+        self.n = total
+
+    def update(self, X: np.ndarray) -> None:
+        """Add the rows of a block."""
+        if len(X) == 0:
+            return
+        block_mean = X.mean(axis=0)
+        centered = X - block_mean
+        self._combine(len(X), block_mean, np.einsum('ij,ij->j', centered, centered))
+
+    def merge(self, other: 'RunningMoments') -> 'RunningMoments':
+        """Add the rows summarised by `other` (e.g. another shard); returns self."""
+        self._combine(other.n, other.mean, other.m2)
+        return self
+
+    @property
+    def variance(self) -> np.ndarray:
+        """Population variance (as sklearn's StandardScaler)."""
+        return self.m2 / max(self.n, 1)
+
+    @property
+    def scale(self) -> np.ndarray:
+        """Standard deviation, 1 for constant columns."""
+        std = np.sqrt(self.variance)
+        return np.where(std > 0, std, 1.0)
+
+    def to_dict(self) -> Dict:
+        return {"n": self.n, "mean": self.mean.tolist(), "m2": self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'RunningMoments':
+        moments = cls(len(data['mean']))
+        moments.n = data['n']
+        moments.mean = np.array(data['mean'], dtype=np.float64)
+        moments.m2 = np.array(data['m2'], dtype=np.float64)
+        return moments
+
+
+def standardize(X: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> np.ndarray:
+    """Z-scores of the rows (or a single row) of X."""
+    return (X - mean) / scale
+
+
+def normalization_entry(mean: np.ndarray, scale: np.ndarray, columns: Optional[np.ndarray] = None) -> Dict:
+    """`normalization` field of a model JSON for the given (top-k) columns."""
+    if columns is not None:
+        mean, scale = mean[columns], scale[columns]
+    return {"mean": np.asarray(mean).tolist(), "scale": np.asarray(scale).tolist()}
+
+
+def model_normalization(model_data: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean and scale of a model JSON's features; identity for models saved without them."""
+    n = len(model_data['feature_names'])
+    normalization = model_data.get('normalization')
+    if normalization is None:
+        return np.zeros(n), np.ones(n)
+    return np.array(normalization['mean'], dtype=np.float64), np.array(normalization['scale'], dtype=np.float64)
+
+
+def merge_moments(entries: List[Optional[Dict]]) -> Optional[RunningMoments]:
+    """Merged moments of several `RunningMoments.to_dict()` entries, None if any is missing."""
+    merged = None
+    for entry in entries:
+        if entry is None:
+            return None
+        moments = RunningMoments.from_dict(entry)
+        merged = moments if merged is None else merged.merge(moments)
+    return merged
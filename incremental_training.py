@@ -0,0 +1,340 @@
+"""
+Incremental refresh of the objective model as the experience pool grows.
+
+A state directory remembers which pool pairs have been featurised, keeps their
+features as blocks (the sharded_extraction block format, so streaming_training
+can also refit from them) and keeps the two models of streaming_training:
+
+    state/
+        state.json          pool watermark, feature columns, standardisation,
+                            current top-k columns (written last: commit marker)
+        block-NNNNN.npz     X, y, doc_ids of the pairs featurised by one run
+        pairs.txt           `block hash` of every featurised pair
+        models-NNNNN.pkl    L1 ranking model over all columns and the model
+                            over the top-k columns, after NNNNN blocks
+
+    python incremental_training.py --pool data/examples.jsonl --state state/ --k 20 --output model.json
+
+The first run (or `--full`) featurises the whole pool and fits both models.
+Later runs only read the pool past the watermark (line count, byte offset and
+hash of the last consumed line), featurise the pairs whose content hash is not
+known yet, and re-solve both models over all cached blocks starting from their
+previous coefficients, which costs a few passes over stored features but no
+extraction. The features are re-ranked; if the top-k set changed, the refit
+model starts from zero instead. If the pool was
+rewritten rather than appended to, every pair is hashed again and only unknown
+pairs are featurised; pairs that left the pool stay in the model until `--full`.
+
+The standardisation (column mean and scale) is fixed by the full fit so the
+warm starts stay comparable; `scale_drift` in the report shows
+how far the pool has moved from it since, and a `--full` run re-centres.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from jsonl_index import JsonlIndex
+from objective_scoring import extract_features
+from sharded_extraction import feature_row
+from feature_scaling import RunningMoments
+from streaming_training import fit_logistic, model_json, top_k_columns
+from linguistic_features.instrumentation import instrumentation_from_env
+from extraction_daemon import daemon_client
+
+STATE_VERSION = 3
+# Files of a state directory written by this module (and their in-progress tmp files)
+_STATE_FILES = re.compile(r'^(?:state\.json|pairs\.txt|model\.json|block-\d{5}\.npz|models-\d{5}\.pkl)(?:\.\d+\.tmp)?$')
+
+
+def pair_hash(pair: Dict) -> str:
+    """Content hash of a positive/negative pair."""
+    data = json.dumps([pair['positive'], pair['negative']], ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _line_hash(line: bytes) -> str:
+    return hashlib.blake2b(line, digest_size=16).hexdigest()
+
+
+def _state_file(state_dir: str, name: str) -> str:
+    return os.path.join(state_dir, name)
+
+
+def _block_path(state_dir: str, block: int) -> str:
+    return _state_file(state_dir, f"block-{block:05d}.npz")
+
+
+def _dump_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_state(state_dir: str) -> Optional[Dict]:
+    """state.json of a state directory, or None if there is no committed state."""
+    try:
+        with open(_state_file(state_dir, 'state.json'), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get('version') == STATE_VERSION else None
+
+
+def reset_state_dir(state_dir: str) -> None:
+    """
+    Create an empty state directory, or remove the state files of an existing
+    one. Other files are left alone, and a directory that holds neither
+    state.json nor only state files is not a state directory: ValueError.
+    """
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+        return
+    names = os.listdir(state_dir)
+    foreign = [name for name in names if not _STATE_FILES.match(name)]
+    if foreign and 'state.json' not in names:
+        raise ValueError(f"{state_dir} is not empty and holds no state.json (e.g. {foreign[0]}); "
+                         f"pass a new or existing state directory")
+    for name in names:
+        if _STATE_FILES.match(name):
+            os.remove(_state_file(state_dir, name))
+
+
+def known_pairs(state_dir: str, n_blocks: int) -> Set[str]:
+    """
+    Hashes of the pairs in the committed blocks.
+
+    Lines left by a run that failed before committing its state are dropped
+    from pairs.txt, since their block numbers will be reused.
+    """
+    path = _state_file(state_dir, 'pairs.txt')
+    known, committed, stale = set(), [], False
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                block, digest = line.split()
+                if int(block) < n_blocks:
+                    known.add(digest)
+                    committed.append(line)
+                else:
+                    stale = True
+    except OSError:
+        pass
+    if stale:
+        _dump_atomic(path, ''.join(committed).encode('utf-8'))
+    return known
+
+
+def new_pairs(pool: str, state: Optional[Dict], known: Set[str]) -> Tuple[List[Tuple[str, Dict]], Dict, int]:
+    """
+    Pairs of the pool that have not been featurised yet.
+
+    Args:
+        pool (str): Experience pool JSONL (lines with a `pair` list)
+        state: Current state, None for a full run
+        known: Hashes of featurised pairs
+
+    Returns:
+        Tuple[list, dict, int]: (hash, pair) of every new pair in pool order,
+            the new watermark and the number of already known pairs skipped
+    """
+    with JsonlIndex(pool) as records:
+        start = 0
+        mark = state['watermark'] if state else None
+        if mark and mark['lines'] <= len(records) and mark['lines'] > 0:
+            # Appended pool: the consumed prefix ends where it used to, with the same last line
+            if int(records.offsets[mark['lines']]) == mark['bytes'] and \
+                    _line_hash(records.raw(mark['lines'] - 1)) == mark['last_line']:
+                start = mark['lines']
+        pairs, skipped, seen = [], 0, set()
+        for exp in records.iter(start):
+            for pair in exp.get('pair', []):
+                digest = pair_hash(pair)
+                if digest in known or digest in seen:
+                    skipped += 1
+                    continue
+                seen.add(digest)
+                pairs.append((digest, pair))
+        n = len(records)
+        watermark = {
+            "lines": n,
+            "bytes": int(records.offsets[-1]),
+            "last_line": _line_hash(records.raw(n - 1)) if n else None,
+        }
+    return pairs, watermark, skipped
+
+
+def featurise_pairs(pairs: List[Tuple[str, Dict]], feature_names: Optional[List[str]], instrumentation=None,
+                    client=None) -> Tuple[np.ndarray, np.ndarray, List[str], List[str]]:
+    """
+    Feature rows of the positive and negative text of each pair.
+
+    Returns:
+        Tuple: X, y (1 positive, 0 negative), doc ids (`hash:+` / `hash:-`)
+            and the feature columns (those given, or all extracted sorted)
+    """
+    texts = [pair['positive'] for _, pair in pairs] + [pair['negative'] for _, pair in pairs]
+    doc_ids = [f"{digest}:+" for digest, _ in pairs] + [f"{digest}:-" for digest, _ in pairs]
+    features = extract_features(texts, instrumentation, client, doc_ids)
+    if feature_names is None:
+        names = set()
+        for feature_dicts in features:
+            for feature_dict in feature_dicts:
+                names.update(feature_dict)
+        feature_names = sorted(names)
+    rows = [feature_row(f, feature_names)[0] for f in features]
+    X = np.vstack(rows) if rows else np.zeros((0, len(feature_names)))
+    y = np.array([1] * len(pairs) + [0] * len(pairs), dtype=np.int64)
+    return X, y, doc_ids, feature_names
+
+
+def _write_block(state_dir: str, block: int, X: np.ndarray, y: np.ndarray, doc_ids: List[str],
+                 pairs: List[Tuple[str, Dict]]) -> str:
+    path = _block_path(state_dir, block)
+    tmp_block = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_block, X=X, y=y, doc_ids=np.array(doc_ids, dtype=str))
+    os.replace(tmp_block, path)
+    with open(_state_file(state_dir, 'pairs.txt'), 'a', encoding='utf-8') as f:
+        f.writelines(f"{block} {digest}\n" for digest, _ in pairs)
+    return path
+
+
+def _models_file(state_dir: str, n_blocks: int) -> str:
+    return _state_file(state_dir, f"models-{n_blocks:05d}.pkl")
+
+
+def refresh(pool: str, state_dir: str, k: int, C: float = 1.0, tol: float = 1e-6, max_iter: int = 100,
+            full: bool = False, block_pairs: int = 5000, instrumentation=None,
+            client=None) -> Tuple[Dict, Dict]:
+    """
+    Bring the model of a state directory up to date with the pool.
+
+    Args:
+        pool (str): Experience pool JSONL
+        state_dir (str): State directory (created on the first run; only the
+            files this module writes are ever removed from it)
+        k (int): Number of features of the model
+        C (float): Inverse L1 regularisation strength of the ranking model
+        tol (float): Subgradient tolerance of both fits (see streaming_training.fit_logistic)
+        max_iter (int): Maximum Newton iterations of each fit
+        full (bool): Discard the state and featurise and fit the whole pool
+        block_pairs (int): Maximum number of pairs per feature block
+
+    Returns:
+        Tuple[dict, dict]: Model JSON data and a report of the run
+    """
+    started = time.time()
+    state = None if full else load_state(state_dir)
+    if state is not None and (state['k'] != k or state['pool'] != os.path.abspath(pool)):
+        raise ValueError(f"{state_dir} holds a k={state['k']} model of {state['pool']}; use --full to rebuild")
+    if state is None:
+        reset_state_dir(state_dir)
+
+    n_blocks = state['n_blocks'] if state else 0
+    pairs, watermark, skipped = new_pairs(pool, state, known_pairs(state_dir, n_blocks))
+    report = {"new_pairs": len(pairs), "skipped_pairs": skipped, "full": state is None}
+    if state is None and not pairs:
+        raise ValueError(f"No pairs in {pool}")
+
+    feature_names = state['feature_names'] if state else None
+    moments = RunningMoments.from_dict(state['moments']) if state else None
+    new_paths = []
+    # Bounded blocks, so a full run never holds the whole pool's features
+    for start in range(0, len(pairs), block_pairs):
+        chunk = pairs[start:start + block_pairs]
+        X, y, doc_ids, feature_names = featurise_pairs(chunk, feature_names, instrumentation, client)
+        if moments is None:
+            moments = RunningMoments(len(feature_names))
+        moments.update(X)
+        new_paths.append(_write_block(state_dir, n_blocks + len(new_paths), X, y, doc_ids, chunk))
+        del X
+    report["extract_seconds"] = time.time() - started
+    all_paths = [_block_path(state_dir, block) for block in range(n_blocks + len(new_paths))]
+    all_columns = np.arange(len(feature_names))
+
+    if state is None:
+        mean, scale = moments.mean, moments.scale
+        ranker = fit_logistic(all_paths, all_columns, mean, scale, C, tol, max_iter)
+        top_indices = top_k_columns(ranker, k)
+        refit = fit_logistic(all_paths, top_indices, mean[top_indices], scale[top_indices], None, tol, max_iter)
+        report["top_k_changed"] = True
+    else:
+        mean, scale = np.array(state['mean']), np.array(state['scale'])
+        with open(_models_file(state_dir, n_blocks), 'rb') as f:
+            ranker, refit = pickle.load(f)
+        old_top = np.array(state['top_indices'])
+        top_indices = old_top
+        report["top_k_changed"] = False
+        if new_paths:
+            ranker = fit_logistic(all_paths, all_columns, mean, scale, C, tol, max_iter, init=ranker)
+            top_indices = top_k_columns(ranker, k)
+            report["top_k_changed"] = set(top_indices.tolist()) != set(old_top.tolist())
+            if not report["top_k_changed"]:
+                top_indices = old_top
+            # Coefficients of other columns do not carry over: a changed top-k is refitted from zero
+            refit = fit_logistic(all_paths, top_indices, mean[top_indices], scale[top_indices], None, tol, max_iter,
+                                 init=None if report["top_k_changed"] else refit)
+
+    model = model_json(refit, feature_names, top_indices, mean, scale)
+    # Named by block count: the committed state keeps pointing at models that saw exactly its blocks
+    _dump_atomic(_models_file(state_dir, len(all_paths)), pickle.dumps((ranker, refit)))
+    state = {
+        "version": STATE_VERSION,
+        "pool": os.path.abspath(pool),
+        "k": k,
+        "n_blocks": len(all_paths),
+        "watermark": watermark,
+        "feature_names": feature_names,
+        "mean": mean.tolist(),
+        "scale": scale.tolist(),
+        "moments": moments.to_dict(),
+        "top_indices": top_indices.tolist(),
+    }
+    _dump_atomic(_state_file(state_dir, 'state.json'), json.dumps(state, indent=2).encode('utf-8'))
+    if not report["full"] and n_blocks != len(all_paths):
+        os.remove(_models_file(state_dir, n_blocks))
+    report["solver_passes"] = [ranker.passes, refit.passes] if report["full"] or new_paths else [0, 0]
+    report["converged"] = bool(ranker.converged and refit.converged)
+    report["rows"] = moments.n
+    report["scale_drift"] = float(np.max(np.abs(moments.mean - mean) / scale))
+    report["seconds"] = time.time() - started
+    return model, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally refresh the objective model from a growing pool")
+    parser.add_argument('--pool', required=True, help="Experience pool JSONL")
+    parser.add_argument('--state', required=True, help="State directory")
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--C', type=float, default=1.0, help="Inverse L1 regularisation strength of the ranking model")
+    parser.add_argument('--tol', type=float, default=1e-6, help="Subgradient tolerance of the fits")
+    parser.add_argument('--max-iter', type=int, default=100, help="Maximum Newton iterations of each fit")
+    parser.add_argument('--block-pairs', type=int, default=5000, help="Maximum pairs per feature block")
+    parser.add_argument('--full', action='store_true', help="Discard the state and retrain on the whole pool")
+    parser.add_argument('--output', help="Model JSON file (default: <state>/model.json)")
+    args = parser.parse_args()
+
+    instrumentation = instrumentation_from_env()
+    try:
+        model, report = refresh(args.pool, args.state, args.k, args.C, args.tol, args.max_iter, args.full,
+                                args.block_pairs, instrumentation, daemon_client())
+    finally:
+        if instrumentation is not None:
+            instrumentation.close()
+    output = args.output or _state_file(args.state, 'model.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Model -> {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Memory-mapped line index for random access into JSONL files.
+
+The index of `data.jsonl` is stored next to it as `data.jsonl.idx`: a flat
+little-endian int64 array of the start offset of every line followed by the
+file size, so line i is bytes [idx[i], idx[i + 1]). It is built once with a
+newline scan over the memory-mapped file and rebuilt automatically when the
+JSONL file has changed since (different size, or newer than the index).
+
+    with JsonlIndex("data/examples.jsonl") as records:
+        first = records[0]                    # O(1) random access
+        prefix = list(records.iter(0, 1000))  # parse only the first 1000 lines
+        mine = records.shard_range(2, 8)      # byte-range shard 2 of 8
+
+Byte-range shards split the file into `n` equal byte ranges and assign each
+line to the range containing its first byte, so independent workers agree on
+the split without coordinating.
+
+    python jsonl_index.py data/examples.jsonl --shards 8
+"""
+
+import argparse
+import json
+import mmap
+import os
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+BLOCK_SIZE = 1 << 26
+
+
+def index_path(path: str) -> str:
+    return path + '.idx'
+
+
+def scan_offsets(path: str) -> np.ndarray:
+    """
+    Line start offsets of a file followed by its size, from a blockwise scan.
+
+    Returns:
+        np.ndarray: int64 array of length (number of lines + 1)
+    """
+    size = os.path.getsize(path)
+    parts = [np.zeros(1, dtype=np.int64)]
+    if size:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, size, BLOCK_SIZE):
+                block = np.frombuffer(mm, dtype=np.uint8, count=min(BLOCK_SIZE, size - start), offset=start)
+                parts.append(np.flatnonzero(block == 10).astype(np.int64) + (start + 1))
+                del block
+    offsets = np.concatenate(parts)
+    if offsets[-1] != size:
+        # Last line without a trailing newline
+        offsets = np.append(offsets, size)
+    return offsets
+
+
+def build_index(path: str, idx_path: Optional[str] = None) -> np.ndarray:
+    """
+    Scan `path` and write its index; returns the offsets.
+
+    The index is written to a temporary file and renamed, so concurrent
+    builders of the same index never expose a partial file.
+    """
+    idx_path = idx_path or index_path(path)
+    offsets = scan_offsets(path)
+    tmp_path = f"{idx_path}.{os.getpid()}.tmp"
+    try:
+        offsets.astype('<i8').tofile(tmp_path)
+        os.replace(tmp_path, idx_path)
+    except OSError:
+        # Read-only location: use the offsets without persisting them
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return offsets
+
+
+def _is_current(path: str, idx_path: str) -> bool:
+    if not os.path.exists(idx_path) or os.path.getmtime(idx_path) < os.path.getmtime(path):
+        return False
+    size = os.path.getsize(idx_path)
+    if size < 8 or size % 8:
+        return False
+    with open(idx_path, 'rb') as f:
+        f.seek(-8, os.SEEK_END)
+        return int.from_bytes(f.read(8), 'little') == os.path.getsize(path)
+
+
+def load_offsets(path: str, rebuild: bool = False) -> np.ndarray:
+    """Offsets of `path` from its memory-mapped index, building it if missing or stale."""
+    idx_path = index_path(path)
+    if rebuild or not _is_current(path, idx_path):
+        return build_index(path, idx_path)
+    return np.memmap(idx_path, dtype='<i8', mode='r')
+
+
+class JsonlIndex:
+    """
+    Random access to the lines of a JSONL file through its offset index.
+
+    Args:
+        path (str): JSONL file
+        rebuild (bool): Rebuild the index even if it looks current
+    """
+
+    def __init__(self, path: str, rebuild: bool = False):
+        self.path = path
+        self.offsets = load_offsets(path, rebuild)
+        self._file = open(path, 'rb')
+        size = int(self.offsets[-1])
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        """Bytes of line i, including its newline."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"line {i} out of range for {self.path} ({len(self)} lines)")
+        return self._mm[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i: int) -> Dict:
+        return json.loads(self.raw(i))
+
+    def iter(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict]:
+        """Parsed records of lines [start, stop), like islice over the file."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop):
+            yield json.loads(self._mm[self.offsets[i]:self.offsets[i + 1]])
+
+    def __iter__(self) -> Iterator[Dict]:
+        return self.iter()
+
+    def shard_range(self, shard: int, n_shards: int) -> range:
+        """
+        Lines of byte-range shard `shard` of `n_shards`: the lines whose first
+        byte falls in [shard * size / n_shards, (shard + 1) * size / n_shards).
+        """
+        if not 0 <= shard < n_shards:
+            raise ValueError(f"shard {shard} out of range for {n_shards} shards")
+        size = int(self.offsets[-1])
+        starts = self.offsets[:-1]
+        lo = int(np.searchsorted(starts, size * shard // n_shards, side='left'))
+        hi = int(np.searchsorted(starts, size * (shard + 1) // n_shards, side='left'))
+        return range(lo, hi)
+
+    def close(self) -> None:
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_jsonl(path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[Dict]:
+    """Parsed records of lines [start, stop) of a JSONL file, through its index."""
+    with JsonlIndex(path) as records:
+        yield from records.iter(start, stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the line index of JSONL files")
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--shards', type=int, default=0, help="Print the line ranges of N byte-range shards")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        with JsonlIndex(path, args.rebuild) as records:
+            print(f"{path}: {len(records)} lines, {int(records.offsets[-1])} bytes -> {index_path(path)}")
+            # Check the index against a plain line-by-line read
+            with open(path, 'rb') as f:
+                lines = f.readlines()
+            assert len(lines) == len(records) and all(line == records.raw(i) for i, line in enumerate(lines))
+            for shard in range(args.shards):
+                shard_lines = records.shard_range(shard, args.shards)
+                print(f"  shard {shard}/{args.shards}: lines [{shard_lines.start}, {shard_lines.stop})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+Local BM25 retrieval over character n-grams, with compressed postings.
+
+An alternative to embedding retrieval that needs no API: the negative
+examples are indexed once by their character n-grams (bigrams by default,
+which suit Chinese without a word segmenter) and queries are scored with
+Okapi BM25. The index is persisted as a directory of memory-mapped arrays:
+
+    examples.jsonl.bm25/  (or bm25/ inside a compiled pool)
+        meta.json         source size/mtime, n, k1, b, document count
+        vocab.json        n-gram -> term id
+        term_offsets.npy  int64, postings of term t are postings.bin[offsets[t]:offsets[t + 1]]
+        postings.bin      document id gaps as LEB128 varints
+        tf_offsets.npy    int64, start of each term's term frequencies
+        tfs.npy           uint8 term frequency of each posting (saturating at 255)
+        doc_len.npy       float32 number of n-grams of each document
+
+Postings are decoded with vectorised NumPy, scores are accumulated per term
+and the top y are taken with argpartition. Restricting a search to the first
+`limit` documents (an N-line pool prefix) also restricts the document count,
+the document frequencies and the average length, so the result equals that of
+an index built on the prefix alone.
+
+    python lexical_index.py build data/examples.jsonl
+    python lexical_index.py search data/examples.jsonl "判决书中使用口语化动词" --top 5
+"""
+
+import argparse
+import json
+import os
+import shutil
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+INDEX_VERSION = 1
+
+
+def char_ngrams(text: str, n: int = 2) -> List[str]:
+    """Character n-grams of the text with whitespace removed (the text itself if shorter)."""
+    chars = ''.join(text.split())
+    if len(chars) <= n:
+        return [chars] if chars else []
+    return [chars[i:i + n] for i in range(len(chars) - n + 1)]
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """LEB128 encoding of non-negative integers."""
+    out = bytearray()
+    for value in values.tolist():
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Vectorised LEB128 decoding of a uint8 array into int64 values."""
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = data < 0x80
+    group = np.concatenate(([0], np.cumsum(ends[:-1])))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shift = 7 * (np.arange(len(data)) - starts[group])
+    parts = (data & 0x7F).astype(np.int64) << shift
+    return np.bincount(group, weights=parts, minlength=int(group[-1]) + 1).astype(np.int64)
+
+
+def index_dir(exp_library: str) -> str:
+    """Where the BM25 index of examples.jsonl or of a compiled pool directory lives."""
+    if os.path.isdir(exp_library):
+        return os.path.join(exp_library, 'bm25')
+    return exp_library + '.bm25'
+
+
+def _source_stat(exp_library: str) -> Dict:
+    path = os.path.join(exp_library, 'meta.json') if os.path.isdir(exp_library) else exp_library
+    return {"size": os.path.getsize(path), "mtime": os.path.getmtime(path)}
+
+
+def build_index(texts: Iterable[str], out_dir: str, n: int = 2, k1: float = 1.5, b: float = 0.75,
+                source: Optional[Dict] = None, total: Optional[int] = None) -> Dict:
+    """
+    Index the texts (document i = i-th text) and write the index to `out_dir`.
+
+    Args:
+        texts: Documents, in pool order
+        out_dir (str): Index directory (replaced if it exists)
+        n (int): Character n-gram length
+        k1 (float), b (float): BM25 parameters
+        source (dict): Size/mtime of the indexed pool, for staleness checks
+        total (int): Number of texts, for the progress bar
+
+    Returns:
+        Dict: The index's meta.json data
+    """
+    vocab: Dict[str, int] = {}
+    terms, docs, tfs, doc_len = [], [], [], []
+    for doc, text in enumerate(tqdm(texts, total=total, desc="Indexing negatives")):
+        grams = char_ngrams(text, n)
+        counts = Counter(grams)
+        doc_len.append(len(grams))
+        for gram, tf in counts.items():
+            terms.append(vocab.setdefault(gram, len(vocab)))
+            docs.append(doc)
+            tfs.append(min(tf, 255))
+    terms, docs, tfs = np.array(terms, dtype=np.int64), np.array(docs, dtype=np.int64), np.array(tfs, dtype=np.uint8)
+    order = np.lexsort((docs, terms))
+    terms, docs, tfs = terms[order], docs[order], tfs[order]
+    tf_offsets = np.searchsorted(terms, np.arange(len(vocab) + 1)).astype(np.int64)
+
+    tmp_dir = f"{out_dir.rstrip(os.sep)}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    with open(os.path.join(tmp_dir, 'postings.bin'), 'wb') as f:
+        for term in range(len(vocab)):
+            term_docs = docs[tf_offsets[term]:tf_offsets[term + 1]]
+            # Gaps between sorted document ids: the first is the id itself
+            data = encode_varints(np.diff(term_docs, prepend=0))
+            f.write(data)
+            term_offsets[term + 1] = term_offsets[term] + len(data)
+    np.save(os.path.join(tmp_dir, 'term_offsets.npy'), term_offsets)
+    np.save(os.path.join(tmp_dir, 'tf_offsets.npy'), tf_offsets)
+    np.save(os.path.join(tmp_dir, 'tfs.npy'), tfs)
+    np.save(os.path.join(tmp_dir, 'doc_len.npy'), np.array(doc_len, dtype=np.float32))
+    with open(os.path.join(tmp_dir, 'vocab.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    meta = {"version": INDEX_VERSION, "n": n, "k1": k1, "b": b, "documents": len(doc_len), "terms": len(vocab),
+            "postings": len(docs), "source": source}
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return meta
+
+
+class BM25Index:
+    """
+    Memory-mapped BM25 index written by `build_index`.
+
+    Args:
+        directory (str): Index directory
+    """
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"{directory} is a version {self.meta.get('version')} index, expected {INDEX_VERSION}")
+        with open(os.path.join(directory, 'vocab.json'), 'r', encoding='utf-8') as f:
+            self.vocab = json.load(f)
+        self.directory = directory
+        self.n, self.k1, self.b = self.meta['n'], self.meta['k1'], self.meta['b']
+        self.term_offsets = np.load(os.path.join(directory, 'term_offsets.npy'), mmap_mode='r')
+        self.tf_offsets = np.load(os.path.join(directory, 'tf_offsets.npy'), mmap_mode='r')
+        self.tfs = np.load(os.path.join(directory, 'tfs.npy'), mmap_mode='r')
+        self.doc_len = np.load(os.path.join(directory, 'doc_len.npy'))
+        self.cum_len = np.concatenate(([0.0], np.cumsum(self.doc_len, dtype=np.float64)))
+        postings_path = os.path.join(directory, 'postings.bin')
+        self.postings = np.memmap(postings_path, dtype=np.uint8, mode='r') if os.path.getsize(postings_path) \
+            else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def postings_of(self, term: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Document ids and term frequencies of a term."""
+        data = self.postings[self.term_offsets[term]:self.term_offsets[term + 1]]
+        docs = np.cumsum(decode_varints(np.asarray(data)))
+        return docs, np.asarray(self.tfs[self.tf_offsets[term]:self.tf_offsets[term + 1]], dtype=np.float32)
+
+    def scores(self, query: str, limit: Optional[int] = None) -> np.ndarray:
+        """BM25 score of every document among the first `limit` for the query."""
+        n_docs = len(self) if limit is None else min(limit, len(self))
+        scores = np.zeros(n_docs, dtype=np.float32)
+        if n_docs == 0:
+            return scores
+        avgdl = max(self.cum_len[n_docs] / n_docs, 1e-9)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[:n_docs] / avgdl)
+        for gram, qtf in Counter(char_ngrams(query, self.n)).items():
+            term = self.vocab.get(gram)
+            if term is None:
+                continue
+            docs, tfs = self.postings_of(term)
+            cut = int(np.searchsorted(docs, n_docs))
+            if cut == 0:
+                continue
+            docs, tfs = docs[:cut], tfs[:cut]
+            idf = np.log(1 + (n_docs - cut + 0.5) / (cut + 0.5))
+            scores[docs] += qtf * idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+        return scores
+
+    def search(self, query: str, k: int, limit: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k documents for the query, best first (ties: lower document id).
+
+        Documents without any query n-gram are never returned, so fewer than
+        k results are possible.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Document ids and scores
+        """
+        return self.rank(self.scores(query, limit), k)
+
+    def rank(self, scores: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k documents by precomputed `scores`, as in `search`; with `rows`,
+        only among those document ids (a sub-index).
+        """
+        if rows is None:
+            matched = np.flatnonzero(scores > 0)
+        else:
+            rows = rows[rows < len(scores)]
+            matched = rows[scores[rows] > 0]
+        k = min(k, len(matched))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        candidates = matched[np.argpartition(-scores[matched], k - 1)[:k]] if k < len(matched) else matched
+        best = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return best, scores[best]
+
+
+def pool_negatives(exp_library: str) -> Tuple[Iterable[str], int]:
+    """Negative texts of examples.jsonl or a compiled pool, in pool order, and their number."""
+    from compiled_pool import CompiledPool, is_compiled_pool
+    if is_compiled_pool(exp_library):
+        pool = CompiledPool(exp_library)
+        return (pool.negatives[i] for i in range(len(pool))), len(pool)
+    from jsonl_index import iter_jsonl
+    negatives = [pair['negative'] for exp in iter_jsonl(exp_library) for pair in exp.get('pair', [])]
+    return negatives, len(negatives)
+
+
+def load_index(exp_library: str, n: int = 2, rebuild: bool = False) -> BM25Index:
+    """
+    BM25 index of a pool's negatives, built and persisted on first use and
+    rebuilt when the pool has changed since.
+    """
+    directory = index_dir(exp_library)
+    source = _source_stat(exp_library)
+    if not rebuild:
+        try:
+            index = BM25Index(directory)
+            if index.meta['source'] == source and index.n == n:
+                return index
+        except (OSError, ValueError):
+            pass
+    texts, total = pool_negatives(exp_library)
+    build_index(texts, directory, n, source=source, total=total)
+    return BM25Index(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the BM25 index of an experience pool")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build')
+    build_parser.add_argument('pool', help="examples.jsonl or a compiled pool directory")
+    build_parser.add_argument('--ngram', type=int, default=2)
+    search_parser = commands.add_parser('search')
+    search_parser.add_argument('pool')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--top', type=int, default=5)
+    search_parser.add_argument('--ngram', type=int, default=2)
+    args = parser.parse_args()
+
+    index = load_index(args.pool, args.ngram, rebuild=args.command == 'build')
+    if args.command == 'build':
+        size = sum(os.path.getsize(os.path.join(index.directory, f)) for f in os.listdir(index.directory))
+        print(f"{len(index)} negatives, {index.meta['terms']} n-grams, {index.meta['postings']} postings, "
+              f"{size / 2 ** 20:.1f} MiB -> {index.directory}")
+    else:
+        texts, _ = pool_negatives(args.pool)
+        texts = list(texts) if not isinstance(texts, list) else texts
+        for doc, score in zip(*index.search(args.query, args.top)):
+            print(f"{score:8.3f}  {texts[doc]}")
+
+
+if __name__ == '__main__':
+    main()
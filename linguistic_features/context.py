@@ -0,0 +1,177 @@
+'''Extraction contexts: the tokenizers, lexicons and caches used by the extractors.
+
+Every `feature_*` function accepts an optional `ctx`. Without one, the default
+context wraps jieba's module-global tokenizers and the process-wide
+segmentation cache, which is what the extractors have always used. For
+concurrent extraction inside one process, give each thread its own
+`ExtractionContext`: it owns a `jieba.Tokenizer`, a `POSTokenizer` and an
+in-memory segmentation cache, so threads share no mutable state.
+
+`ExtractionContext.fork()` builds a further context that reuses the loaded
+dictionary and lexicons of an existing one. They are only read during
+extraction; do not add user words to a context that has been forked.'''
+
+import os
+import threading
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import jieba
+import jieba.posseg as pseg
+
+from .segmentation_cache import SegmentationCache, get_cache
+
+# Lexicon files of the extractors
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_resources')
+
+def load_lexicons() -> Dict:
+    """Load the character, stroke and idiom lexicons used by features 1-7 and 54-59."""
+    from .shallow.feature_1_to_3 import load_common_characters
+    from .shallow.feature_4_to_7 import load_stroke_data
+    from .pos.feature_54_to_59 import load_idioms
+
+    json_path = os.path.join(RESOURCES_DIR, 'characters.json')
+    return {
+        'chars_3500': load_common_characters(json_path, 0, 3500),
+        'chars_3500_6500': load_common_characters(json_path, 3500, 6500),
+        'chars_6500': load_common_characters(json_path, 0, 6500),
+        'strokes': load_stroke_data(os.path.join(RESOURCES_DIR, 'char_strokes.json')),
+        'idioms': load_idioms(),
+    }
+
+# jieba has no API for sharing a loaded dictionary; fork() copies these attributes
+_TOKENIZER_STATE = ('dictionary', 'FREQ', 'total', 'user_word_tag_tab', 'initialized')
+_POS_TOKENIZER_STATE = ('tokenizer', 'word_tag_tab')
+_PROBE = '本院认为被告应当承担连带责任。'
+
+def share_tokenizers(tokenizer: jieba.Tokenizer,
+                     pos_tokenizer: pseg.POSTokenizer) -> Tuple[jieba.Tokenizer, pseg.POSTokenizer]:
+    """
+    New jieba.Tokenizer and POSTokenizer sharing the loaded dictionary of an
+    initialised pair, without loading it again.
+
+    Raises:
+        RuntimeError: jieba's internals are not the ones this relies on (a
+            jieba release other than 0.42.x changed them), or the copies do
+            not segment like the originals
+    """
+    missing = [name for name in _TOKENIZER_STATE if name not in vars(tokenizer)]
+    missing += [f"posseg.{name}" for name in _POS_TOKENIZER_STATE if name not in vars(pos_tokenizer)]
+    if missing or not tokenizer.initialized:
+        raise RuntimeError(f"Cannot fork jieba {jieba.__version__} tokenizers: "
+                           f"{'missing ' + ', '.join(missing) if missing else 'tokenizer not initialised'}")
+    forked = jieba.Tokenizer(tokenizer.dictionary)
+    for name in _TOKENIZER_STATE[1:]:
+        setattr(forked, name, getattr(tokenizer, name))
+    forked_pos = pseg.POSTokenizer.__new__(pseg.POSTokenizer)
+    forked_pos.tokenizer = forked
+    forked_pos.word_tag_tab = pos_tokenizer.word_tag_tab
+    try:
+        same = list(forked_pos.cut(_PROBE)) == list(pos_tokenizer.cut(_PROBE))
+    except Exception as e:
+        raise RuntimeError(f"Cannot fork jieba {jieba.__version__} tokenizers: {e!r}") from e
+    if not same:
+        raise RuntimeError(f"Forked jieba {jieba.__version__} tokenizers segment differently from the originals")
+    return forked, forked_pos
+
+class ExtractionContext:
+    """
+    Tokenizers, lexicons and segmentation cache used by one extraction thread.
+
+    Args:
+        dictionary (str): jieba dictionary file (jieba's default if None)
+        cache_size (int): Entries of the context's own segmentation cache
+        tokenizer: Existing jieba.Tokenizer to use instead of creating one
+        pos_tokenizer: Existing POSTokenizer wrapping `tokenizer`
+        cache (SegmentationCache): Cache to use instead of a private one
+        lexicons (dict): Already loaded lexicons (see load_lexicons)
+    """
+
+    def __init__(self, dictionary: Optional[str] = None, cache_size: int = 100000,
+                 tokenizer: Optional[jieba.Tokenizer] = None, pos_tokenizer: Optional[pseg.POSTokenizer] = None,
+                 cache: Optional[SegmentationCache] = None, lexicons: Optional[Dict] = None):
+        self.tokenizer = tokenizer or jieba.Tokenizer(dictionary or jieba.DEFAULT_DICT)
+        self.tokenizer.initialize()
+        self.pos_tokenizer = pos_tokenizer or pseg.POSTokenizer(self.tokenizer)
+        self._cache = cache if cache is not None else SegmentationCache(cache_size, segmenter=self.pos_tokenizer.cut)
+        self._lexicons = lexicons
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> SegmentationCache:
+        return self._cache
+
+    @property
+    def lexicons(self) -> Dict:
+        if self._lexicons is None:
+            with self._lock:
+                if self._lexicons is None:
+                    self._lexicons = load_lexicons()
+        return self._lexicons
+
+    def warm(self) -> 'ExtractionContext':
+        """Load the lexicons now instead of on the first extraction."""
+        self.lexicons
+        return self
+
+    def cut(self, text: str) -> List[str]:
+        """Word segmentation (`jieba.cut`) with the context's tokenizer."""
+        return list(self.tokenizer.cut(text))
+
+    def fork(self, cache_size: Optional[int] = None) -> 'ExtractionContext':
+        """
+        New context sharing this context's loaded dictionary and lexicons.
+
+        The fork has its own tokenizer objects and segmentation cache, so it can
+        run in another thread without loading the dictionary again.
+        """
+        tokenizer, pos_tokenizer = share_tokenizers(self.tokenizer, self.pos_tokenizer)
+        return ExtractionContext(
+            cache_size=cache_size or self.cache.maxsize,
+            tokenizer=tokenizer,
+            pos_tokenizer=pos_tokenizer,
+            lexicons=self.lexicons,
+        )
+
+class _DefaultContext(ExtractionContext):
+    """jieba's global tokenizers and the process-wide segmentation cache."""
+
+    def __init__(self):
+        super().__init__(tokenizer=jieba.dt, pos_tokenizer=pseg.dt, cache=get_cache())
+
+    @property
+    def cache(self) -> SegmentationCache:
+        # Follow set_cache() replacements of the process-wide cache
+        return get_cache()
+
+_default_context: Optional[ExtractionContext] = None
+_default_lock = threading.Lock()
+
+def default_context() -> ExtractionContext:
+    """Context used by the extractors when none is passed."""
+    global _default_context
+    if _default_context is None:
+        with _default_lock:
+            if _default_context is None:
+                _default_context = _DefaultContext()
+    return _default_context
+
+_local = threading.local()
+
+def thread_context(base: Optional[ExtractionContext] = None) -> ExtractionContext:
+    """
+    Context owned by the calling thread for `base`, forked from it on the
+    thread's first use of that base (each base gets its own fork).
+
+    Args:
+        base: Context whose dictionary and lexicons are shared (the default
+            context if None)
+    """
+    base = base or default_context()
+    forks = getattr(_local, 'forks', None)
+    if forks is None:
+        forks = _local.forks = weakref.WeakKeyDictionary()
+    ctx = forks.get(base)
+    if ctx is None:
+        ctx = forks[base] = base.fork()
+    return ctx
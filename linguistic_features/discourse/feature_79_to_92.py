@@ -13,11 +13,26 @@
 91	Average number of Not-NE nouns per sentence（文档中每句平均非命名实体名词数量）	篇章特征	统计文档中每句的非命名实体名词数量，求平均值
 92	Average number of Not-Entity nouns per sentence（文档中每句平均非实体名词数量）	篇章特征	统计文档中每句的非实体名词数量，求平均值'''
 
-import jieba
-import jieba.posseg as pseg
 from typing import List, Dict
+import numpy as np
+from ..context import default_context
+from ..segmentation_cache import cut_text
+from ..sentence_index import sentence_spans
+from ..token_arrays import TagCategory, encode_documents, count_unique
 
-def feature_79_to_92(text: str) -> List[Dict[str, float]]:
+def _is_entity(flag: str) -> bool:
+    return flag.startswith('nr') or flag.startswith('ns') or flag.startswith('nt')
+
+ENTITIES = TagCategory(_is_entity)
+NAMED_ENTITIES = TagCategory(lambda flag: flag.startswith('nr'))
+# Nouns that are not entities; Not-NE nouns are nouns that are not named entities (nr, ns, nt)
+NOUNS = TagCategory(lambda flag: flag.startswith('n') and not _is_entity(flag))
+NOT_NE_NOUNS = NOUNS
+# Not-Entity nouns are nouns that are not any type of entity (nr, ns, nt, nz, nl)
+NOT_ENTITY_NOUNS = TagCategory(lambda flag: (flag.startswith('n') and not _is_entity(flag)
+                                             and not flag.startswith('nz') and not flag.startswith('nl')))
+
+def feature_79_to_92(text: str, ctx=None) -> List[Dict[str, float]]:
     """
     Calculate features 79-92 for a given Chinese text.
     
@@ -39,55 +54,27 @@ def feature_79_to_92(text: str) -> List[Dict[str, float]]:
     
     Args:
         text (str): Input Chinese text
+        ctx: Extraction context providing tokenizers, caches and lexicons
+            (the process-wide default if None)
         
     Returns:
         List[Dict[str, float]]: List of dictionaries containing feature values
     """
-    # Split text into sentences
-    sentences = [s.strip() for s in text.split('。') if s.strip()]
-    
-    # Initialize counters
-    total_words = 0
-    total_entities = 0
-    unique_entities = set()
-    total_named_entities = 0
-    total_nouns = 0
-    total_not_ne_nouns = 0
-    total_not_entity_nouns = 0
-    
-    # Process each sentence
-    for sentence in sentences:
-        # Get words and their POS tags
-        words = list(pseg.cut(sentence))
-        total_words += len(words)
-        
-        # Count entities and nouns
-        sentence_entities = set()
-        sentence_named_entities = 0
-        sentence_nouns = 0
-        sentence_not_ne_nouns = 0
-        sentence_not_entity_nouns = 0
-        
-        for word, flag in words:
-            if flag.startswith('nr') or flag.startswith('ns') or flag.startswith('nt'):
-                total_entities += 1
-                sentence_entities.add(word)
-                unique_entities.add(word)
-                if flag.startswith('nr'):
-                    total_named_entities += 1
-                    sentence_named_entities += 1
-            elif flag.startswith('n'):
-                total_nouns += 1
-                sentence_nouns += 1
-                # Not-NE nouns are nouns that are not named entities (nr, ns, nt)
-                if not (flag.startswith('nr') or flag.startswith('ns') or flag.startswith('nt')):
-                    total_not_ne_nouns += 1
-                    sentence_not_ne_nouns += 1
-                # Not-Entity nouns are nouns that are not any type of entity (nr, ns, nt, nz, nl)
-                if not (flag.startswith('nr') or flag.startswith('ns') or flag.startswith('nt') or 
-                       flag.startswith('nz') or flag.startswith('nl')):
-                    total_not_entity_nouns += 1
-                    sentence_not_entity_nouns += 1
+    ctx = ctx or default_context()
+    
+    # Split text into sentences and encode the tokens inside them once
+    arrays = encode_documents([(cut_text(text, ctx.cache), sentence_spans(text, 'period'))])
+    num_sentences = arrays.n_sentences
+    total_words = len(arrays)
+    
+    # Count entities and nouns
+    entities = ENTITIES.mask(arrays.tag_ids)
+    total_entities = int(np.count_nonzero(entities))
+    unique_entities = count_unique(arrays, entities)
+    total_named_entities = int(np.count_nonzero(NAMED_ENTITIES.mask(arrays.tag_ids)))
+    total_nouns = int(np.count_nonzero(NOUNS.mask(arrays.tag_ids)))
+    total_not_ne_nouns = int(np.count_nonzero(NOT_NE_NOUNS.mask(arrays.tag_ids)))
+    total_not_entity_nouns = int(np.count_nonzero(NOT_ENTITY_NOUNS.mask(arrays.tag_ids)))
     
     # Calculate features
     features = []
@@ -96,25 +83,25 @@ def feature_79_to_92(text: str) -> List[Dict[str, float]]:
     features.append({'79': float(total_entities)})
     
     # Feature 80: Total number of unique entities
-    features.append({'80': float(len(unique_entities))})
+    features.append({'80': float(unique_entities)})
     
     # Feature 81: Percentage of entities
     features.append({'81': float(total_entities) / total_words if total_words > 0 else 0.0})
     
     # Feature 82: Percentage of unique entities
-    features.append({'82': float(len(unique_entities)) / total_words if total_words > 0 else 0.0})
+    features.append({'82': float(unique_entities) / total_words if total_words > 0 else 0.0})
     
     # Feature 83: Average number of entities per sentence
-    features.append({'83': float(total_entities) / len(sentences) if sentences else 0.0})
+    features.append({'83': float(total_entities) / num_sentences if num_sentences else 0.0})
     
     # Feature 84: Average number of unique entities per sentence
-    features.append({'84': float(len(unique_entities)) / len(sentences) if sentences else 0.0})
+    features.append({'84': float(unique_entities) / num_sentences if num_sentences else 0.0})
     
     # Feature 85: Percentage of named entities
     features.append({'85': float(total_named_entities) / total_words if total_words > 0 else 0.0})
     
     # Feature 86: Average number of named entities per sentence
-    features.append({'86': float(total_named_entities) / len(sentences) if sentences else 0.0})
+    features.append({'86': float(total_named_entities) / num_sentences if num_sentences else 0.0})
     
     # Feature 87: Percentage of named entities against total entities
     features.append({'87': float(total_named_entities) / total_entities if total_entities > 0 else 0.0})
@@ -126,13 +113,13 @@ def feature_79_to_92(text: str) -> List[Dict[str, float]]:
     features.append({'89': float(total_not_ne_nouns) / total_words if total_words > 0 else 0.0})
     
     # Feature 90: Average number of nouns per sentence
-    features.append({'90': float(total_nouns) / len(sentences) if sentences else 0.0})
+    features.append({'90': float(total_nouns) / num_sentences if num_sentences else 0.0})
     
     # Feature 91: Average number of Not-NE nouns per sentence
-    features.append({'91': float(total_not_ne_nouns) / len(sentences) if sentences else 0.0})
+    features.append({'91': float(total_not_ne_nouns) / num_sentences if num_sentences else 0.0})
     
     # Feature 92: Average number of Not-Entity nouns per sentence
-    features.append({'92': float(total_not_entity_nouns) / len(sentences) if sentences else 0.0})
+    features.append({'92': float(total_not_entity_nouns) / num_sentences if num_sentences else 0.0})
     
     return features
 
@@ -7,82 +7,70 @@
 99	Number of unique pronouns per document（文档中唯一代词数量）	篇章特征	统计文档中不重复的代词数量
 100	Percentage of unique pronouns per document（文档中唯一代词占比）	篇章特征	计算唯一代词数量占总词数的比例'''
 
-import jieba
-import jieba.posseg as pseg
-import re
 from typing import List, Dict
+from ..context import default_context
+from ..segmentation_cache import cut_text
+from ..sentence_index import sentence_spans
+from ..token_arrays import TagCategory, encode_documents, category_stats
 
-def feature_93_to_100(text: str) -> List[Dict[str, float]]:
+# Conjunctions: c (连词)
+CONJUNCTIONS = TagCategory.of(['c'])
+# Pronouns: r (代词)
+PRONOUNS = TagCategory.of(['r'])
+
+def feature_93_to_100(text: str, ctx=None) -> List[Dict[str, float]]:
     """
     Calculate features 93-100 for a given text.
     
     Args:
         text: Input text string
+        ctx: Extraction context providing tokenizers, caches and lexicons
+            (the process-wide default if None)
         
     Returns:
         List of dictionaries containing feature values
     """
+    ctx = ctx or default_context()
+    
     # Tokenize text into words with POS tags
-    words_with_tags = list(pseg.cut(text))
+    words_with_tags = cut_text(text, ctx.cache)
     total_words = len(words_with_tags)
     
-    # Split into sentences
-    sentences = re.split(r'[。！？]', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    
-    # Initialize counters
-    conjunctions = []
-    unique_conjunctions = set()
-    pronouns = []
-    unique_pronouns = set()
-    
-    # Count conjunctions and pronouns using POS tags
-    for word, tag in words_with_tags:
-        # Conjunctions: c (连词)
-        if tag == 'c':
-            conjunctions.append(word)
-            unique_conjunctions.add(word)
-        # Pronouns: r (代词)
-        if tag == 'r':
-            pronouns.append(word)
-            unique_pronouns.add(word)
+    # Split into sentences and group the tokens by sentence
+    arrays = encode_documents([(words_with_tags, sentence_spans(text, 'terminal'))])
+    num_sentences = arrays.n_sentences
+    
+    # Count conjunctions and pronouns using POS tags; only delimiter and
+    # whitespace tokens fall outside the sentences
+    conjunctions = category_stats(arrays, CONJUNCTIONS)
+    pronouns = category_stats(arrays, PRONOUNS)
     
     # Calculate features
     features = []
     
     # Feature 93: Percentage of conjunctions per document
-    features.append({'93': len(conjunctions) / total_words if total_words > 0 else 0})
+    features.append({'93': conjunctions['total'] / total_words if total_words > 0 else 0})
     
     # Feature 94: Number of unique conjunctions per document
-    features.append({'94': len(unique_conjunctions)})
+    features.append({'94': conjunctions['unique']})
     
     # Feature 95: Percentage of unique conjunctions per document
-    features.append({'95': len(unique_conjunctions) / total_words if total_words > 0 else 0})
+    features.append({'95': conjunctions['unique'] / total_words if total_words > 0 else 0})
     
     # Feature 96: Average number of conjunctions per sentence
-    conj_per_sentence = []
-    for sentence in sentences:
-        words = list(pseg.cut(sentence))
-        conj_count = sum(1 for word, tag in words if tag == 'c')
-        conj_per_sentence.append(conj_count)
-    features.append({'96': sum(conj_per_sentence) / len(sentences) if sentences else 0})
+    features.append({'96': conjunctions['total'] / num_sentences if num_sentences else 0})
     
     # Feature 97: Average number of unique conjunctions per sentence
-    unique_conj_per_sentence = []
-    for sentence in sentences:
-        words = list(pseg.cut(sentence))
-        unique_conj = set(word for word, tag in words if tag == 'c')
-        unique_conj_per_sentence.append(len(unique_conj))
-    features.append({'97': sum(unique_conj_per_sentence) / len(sentences) if sentences else 0})
+    features.append({'97': conjunctions['sentence_unique'] / num_sentences if num_sentences else 0})
     
     # Feature 98: Percentage of pronouns per document
-    features.append({'98': len(pronouns) / total_words if total_words > 0 else 0})
+    features.append({'98': pronouns['total'] / total_words if total_words > 0 else 0})
     
     # Feature 99: Number of unique pronouns per document
-    features.append({'99': len(unique_pronouns)})
+    features.append({'99': pronouns['unique']})
     
     # Feature 100: Percentage of unique pronouns per document
-    features.append({'100': len(unique_pronouns) / total_words if total_words > 0 else 0})
+    features.append({'100': pronouns['unique'] / total_words if total_words > 0 else 0})
     
     return features
 
@@ -4,12 +4,22 @@ import pandas as pd
 from sklearn.linear_model import LogisticRegression
 from sklearn.feature_selection import SelectFromModel
 from feature_extractor import extract_all_features
+from instrumentation import instrumentation_from_env
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
 from functools import partial
 import json
 import hashlib
 
+_instrumentation = None
+
+def get_instrumentation():
+    """Per-process profiler configured through CLASE_PROFILE_* variables"""
+    global _instrumentation
+    if _instrumentation is None:
+        _instrumentation = instrumentation_from_env() or False
+    return _instrumentation or None
+
 def get_file_hash(file_path):
     """Calculate hash of file content"""
     with open(file_path, 'r', encoding='utf-8') as f:
@@ -33,7 +43,7 @@ def process_single_file(file_path, label):
             print(f"Computing features for {file_path}")
             with open(file_path, 'r', encoding='utf-8') as f:
                 text = f.read().strip()
-                features = extract_all_features(text)
+                features = extract_all_features(text, get_instrumentation(), doc_id=file_path)
             # Save to cache
             with open(cache_file, 'w', encoding='utf-8') as f:
                 json.dump(features, f, ensure_ascii=False, indent=2)
@@ -1,5 +1,10 @@
+import hashlib
 import json
-from typing import List, Dict
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Optional
 import jieba
 import jieba.posseg as pseg
 from collections import Counter
@@ -11,45 +16,164 @@ from .shallow.feature_19_to_24 import feature_19_to_24
 from .pos.feature_25_to_53 import feature_25_to_53
 from .pos.feature_54_to_59 import feature_54_to_59
 from .pos.feature_60_to_65 import feature_60_to_65
-from .syntactic.feature_66_to_78 import feature_66_to_78
+from .syntactic.feature_66_to_78 import feature_66_to_78, feature_66_to_78_batch
 from .discourse.feature_79_to_92 import feature_79_to_92
 from .discourse.feature_93_to_100 import feature_93_to_100
+from .instrumentation import Instrumentation
+from .context import ExtractionContext, default_context, thread_context
 
-def extract_all_features(text: str) -> List[Dict[str, float]]:
+# Extraction stages in feature order: shallow (1-24), POS (25-65),
+# syntactic (66-78) and discourse (79-100)
+FEATURE_STAGES = [
+    ('feature_1_to_3', feature_1_to_3),
+    ('feature_4_to_7', feature_4_to_7),
+    ('feature_8_to_18', feature_8_to_18),
+    ('feature_19_to_24', feature_19_to_24),
+    ('feature_25_to_53', feature_25_to_53),
+    ('feature_54_to_59', feature_54_to_59),
+    ('feature_60_to_65', feature_60_to_65),
+    ('feature_66_to_78', feature_66_to_78),
+    ('feature_79_to_92', feature_79_to_92),
+    ('feature_93_to_100', feature_93_to_100),
+]
+
+# Stages with a form that processes several texts in one pass
+BATCH_STAGES = {
+    'feature_66_to_78': feature_66_to_78_batch,
+}
+
+_fingerprint = None
+
+def extraction_fingerprint() -> str:
+    """
+    Digest of the feature extraction code and resources (every file of this
+    package) and of the jieba version: two processes with the same
+    fingerprint extract the same features.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.blake2b(f"jieba {jieba.__version__}\n".encode(), digest_size=16)
+        for directory, subdirs, files in sorted(os.walk(root)):
+            subdirs[:] = sorted(d for d in subdirs if d != '__pycache__')
+            for name in sorted(files):
+                if name.endswith(('.pyc', '.pyo')):
+                    continue
+                path = os.path.join(directory, name)
+                digest.update(os.path.relpath(path, root).encode() + b'\0')
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+def extract_all_features(text: str, instrumentation: Optional[Instrumentation] = None, doc_id=None,
+                         ctx: Optional[ExtractionContext] = None) -> List[Dict[str, float]]:
     """
     Extract all 100 features from the input text.
     
     Args:
         text (str): Input Chinese text
+        instrumentation (Instrumentation): Optional profiler recording per-stage
+            timings and counters for this document; disabled when None
+        doc_id: Identifier attached to the recorded profile
+        ctx (ExtractionContext): Tokenizers, caches and lexicons to use; the
+            process-wide default (jieba's global tokenizer) when None
         
     Returns:
         List[Dict[str, float]]: List of dictionaries containing feature values
     """
     # Initialize Jieba
-    jieba.initialize()
+    if ctx is None:
+        jieba.initialize()
+        stages = FEATURE_STAGES
+    else:
+        stages = [(name, partial(stage, ctx=ctx)) for name, stage in FEATURE_STAGES]
+    
+    if instrumentation is not None:
+        return instrumentation.run(text, stages, doc_id)
     
     # Extract features from each category
     features = []
+    for _, stage in stages:
+        features.extend(stage(text))
     
-    # Shallow features (1-24)
-    features.extend(feature_1_to_3(text))
-    features.extend(feature_4_to_7(text))
-    features.extend(feature_8_to_18(text))
-    features.extend(feature_19_to_24(text))
+    return features
+
+def extract_features_batch(texts: List[str], instrumentation: Optional[Instrumentation] = None, doc_ids=None,
+                           ctx: Optional[ExtractionContext] = None) -> List:
+    """
+    Extract all 100 features of several texts, running the stages of
+    BATCH_STAGES once over all of them and the others text by text.
     
-    # POS features (25-65)
-    features.extend(feature_25_to_53(text))
-    features.extend(feature_54_to_59(text))
-    features.extend(feature_60_to_65(text))
+    Args:
+        texts (List[str]): Input Chinese texts
+        instrumentation (Instrumentation): Optional profiler; each document is
+            charged an equal share of the batched stages' time
+        doc_ids (list): Identifiers attached to the recorded profiles
+        ctx (ExtractionContext): Tokenizers, caches and lexicons to use; the
+            process-wide default when None
+        
+    Returns:
+        list: Features of each text as extract_all_features returns them, or
+        the exception raised while extracting that text
+    """
+    texts = list(texts)
+    if ctx is None:
+        jieba.initialize()
+    batched, shares = {}, {}
+    for name, batch_stage in BATCH_STAGES.items():
+        start = time.perf_counter()
+        try:
+            batched[name] = batch_stage(texts, ctx=ctx)
+        except Exception:
+            # Run that stage text by text, so only the texts it fails on fail
+            continue
+        shares[name] = (time.perf_counter() - start) / max(len(texts), 1)
     
-    # Syntactic features (66-78)
-    features.extend(feature_66_to_78(text))
+    results = []
+    for i, text in enumerate(texts):
+        stages = []
+        for name, stage in FEATURE_STAGES:
+            if name in batched:
+                stages.append((name, lambda _, features=batched[name][i]: features))
+            else:
+                stages.append((name, partial(stage, ctx=ctx) if ctx is not None else stage))
+        try:
+            if instrumentation is not None:
+                doc_id = doc_ids[i] if doc_ids is not None else None
+                results.append(instrumentation.run(text, stages, doc_id, shares))
+            else:
+                results.append([feature for _, stage in stages for feature in stage(text)])
+        except Exception as e:
+            results.append(e)
+    return results
+
+def extract_features_threaded(texts: List[str], workers: int = 4, base: Optional[ExtractionContext] = None,
+                              instrumentation: Optional[Instrumentation] = None) -> List[List[Dict[str, float]]]:
+    """
+    Extract features of several texts in a thread pool.
     
-    # Discourse features (79-100)
-    features.extend(feature_79_to_92(text))
-    features.extend(feature_93_to_100(text))
+    Each worker thread gets its own ExtractionContext forked from `base`
+    (tokenizers and segmentation cache are per thread, the loaded dictionary
+    and lexicons are shared read-only), so threads share no mutable state.
     
-    return features
+    Args:
+        texts (List[str]): Input Chinese texts
+        workers (int): Number of threads
+        base (ExtractionContext): Context to fork (the default context if None)
+        instrumentation (Instrumentation): Optional profiler shared by the threads
+        
+    Returns:
+        List[List[Dict[str, float]]]: Features of each text, in input order
+    """
+    base = base or default_context()
+    
+    def extract(item):
+        doc_id, text = item
+        return extract_all_features(text, instrumentation, doc_id, ctx=thread_context(base))
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(extract, enumerate(texts)))
 
 def main():
     # Read example text
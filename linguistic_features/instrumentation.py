@@ -0,0 +1,225 @@
+'''Optional profiling hooks for feature extraction.
+
+Disabled by default: `extract_all_features(text)` runs the stages directly and
+the extractors' `count()` calls reduce to a single context-variable lookup.
+Passing an `Instrumentation` records, per document, the wall time of every
+stage and counters such as tokens, sentences and idioms scanned, and hands the
+resulting `DocumentProfile` to each exporter (JSON lines, Prometheus text file
+or any callable).'''
+
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+_active_profile: ContextVar = ContextVar('clase_active_profile', default=None)
+
+def count(name: str, value: int = 1) -> None:
+    """Add `value` to counter `name` of the document being profiled, if any."""
+    profile = _active_profile.get()
+    if profile is not None:
+        profile.counters[name] = profile.counters.get(name, 0) + value
+
+class DocumentProfile:
+    """Timings (seconds) and counters recorded for one document."""
+
+    def __init__(self, doc_id=None, chars: int = 0):
+        self.doc_id = doc_id
+        self.chars = chars
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.total = 0.0
+        self.timestamp = time.time()
+
+    @property
+    def slowest_stage(self) -> Optional[str]:
+        return max(self.stages, key=self.stages.get) if self.stages else None
+
+    def to_dict(self) -> Dict:
+        return {
+            'doc_id': self.doc_id,
+            'timestamp': self.timestamp,
+            'chars': self.chars,
+            'total': self.total,
+            'slowest_stage': self.slowest_stage,
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+
+class Instrumentation:
+    """
+    Collects per-document stage timings and forwards them to exporters.
+
+    Args:
+        exporters: Callables receiving each finished DocumentProfile
+            (e.g. JsonLinesExporter, PrometheusTextExporter or a plain function)
+    """
+
+    def __init__(self, exporters: Optional[List[Callable[[DocumentProfile], None]]] = None):
+        self.exporters = list(exporters or [])
+        self.documents = 0
+        self.stage_totals: Dict[str, float] = {}
+        self.counter_totals: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def run(self, text: str, stages, doc_id=None, batched: Optional[Dict[str, float]] = None) -> List[Dict[str, float]]:
+        """
+        Run `stages` ([(name, fn)]) on `text`, timing each one. `batched` maps
+        the stages already run over a whole batch to this document's share of
+        their time, which is added to theirs.
+        """
+        batched = batched or {}
+        profile = DocumentProfile(doc_id, len(text))
+        token = _active_profile.set(profile)
+        features = []
+        try:
+            start = time.perf_counter()
+            for name, stage in stages:
+                stage_start = time.perf_counter()
+                features.extend(stage(text))
+                profile.stages[name] = time.perf_counter() - stage_start + batched.get(name, 0.0)
+            profile.total = time.perf_counter() - start + sum(batched.values())
+        finally:
+            _active_profile.reset(token)
+        self.record(profile)
+        return features
+
+    def record(self, profile: DocumentProfile) -> None:
+        # Documents may finish concurrently when extraction runs in threads
+        with self.lock:
+            self.documents += 1
+            for name, seconds in profile.stages.items():
+                self.stage_totals[name] = self.stage_totals.get(name, 0.0) + seconds
+            for name, value in profile.counters.items():
+                self.counter_totals[name] = self.counter_totals.get(name, 0) + value
+            for exporter in self.exporters:
+                exporter(profile)
+
+    def summary(self) -> Dict:
+        """Aggregate totals over all documents seen so far."""
+        return {
+            'documents': self.documents,
+            'stage_seconds': dict(self.stage_totals),
+            'counters': dict(self.counter_totals),
+        }
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            close = getattr(exporter, 'close', None)
+            if close is not None:
+                close()
+
+class JsonLinesExporter:
+    """Append one JSON object per document to a file."""
+
+    def __init__(self, path: str):
+        self.path = path.format(pid=os.getpid())
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.f = open(self.path, 'a', encoding='utf-8')
+
+    def __call__(self, profile: DocumentProfile) -> None:
+        self.f.write(json.dumps(profile.to_dict(), ensure_ascii=False, default=str) + '\n')
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+class PrometheusTextExporter:
+    """
+    Maintain cumulative metrics in the Prometheus text exposition format.
+
+    The file is rewritten atomically every `flush_every` documents and on
+    close, so it can be scraped by node_exporter's textfile collector. Use a
+    `{pid}` placeholder in `path` when several processes export.
+    """
+
+    def __init__(self, path: str, flush_every: int = 1):
+        self.path = path.format(pid=os.getpid())
+        self.flush_every = flush_every
+        self.documents = 0
+        self.seconds_total = 0.0
+        self.chars_total = 0
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_max: Dict[str, float] = {}
+        self.slowest: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    def __call__(self, profile: DocumentProfile) -> None:
+        self.documents += 1
+        self.seconds_total += profile.total
+        self.chars_total += profile.chars
+        for name, seconds in profile.stages.items():
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_max[name] = max(self.stage_max.get(name, 0.0), seconds)
+        if profile.slowest_stage is not None:
+            self.slowest[profile.slowest_stage] = self.slowest.get(profile.slowest_stage, 0) + 1
+        for name, value in profile.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self.documents % self.flush_every == 0:
+            self.flush()
+
+    def render(self) -> str:
+        lines = [
+            '# HELP clase_extraction_documents_total Documents processed by extract_all_features.',
+            '# TYPE clase_extraction_documents_total counter',
+            f'clase_extraction_documents_total {self.documents}',
+            '# HELP clase_extraction_seconds_total Wall time spent extracting features.',
+            '# TYPE clase_extraction_seconds_total counter',
+            f'clase_extraction_seconds_total {self.seconds_total!r}',
+            '# HELP clase_extraction_chars_total Characters of input text processed.',
+            '# TYPE clase_extraction_chars_total counter',
+            f'clase_extraction_chars_total {self.chars_total}',
+            '# HELP clase_extraction_stage_seconds_total Wall time per extraction stage.',
+            '# TYPE clase_extraction_stage_seconds_total counter',
+        ]
+        lines += [f'clase_extraction_stage_seconds_total{{stage="{name}"}} {value!r}'
+                  for name, value in sorted(self.stage_seconds.items())]
+        lines += [
+            '# HELP clase_extraction_stage_seconds_max Slowest single document per extraction stage.',
+            '# TYPE clase_extraction_stage_seconds_max gauge',
+        ]
+        lines += [f'clase_extraction_stage_seconds_max{{stage="{name}"}} {value!r}'
+                  for name, value in sorted(self.stage_max.items())]
+        lines += [
+            '# HELP clase_extraction_slowest_stage_total Documents for which the stage was the slowest.',
+            '# TYPE clase_extraction_slowest_stage_total counter',
+        ]
+        lines += [f'clase_extraction_slowest_stage_total{{stage="{name}"}} {value}'
+                  for name, value in sorted(self.slowest.items())]
+        lines += [
+            '# HELP clase_extraction_items_total Items counted by the extractors (tokens, sentences, idioms scanned, ...).',
+            '# TYPE clase_extraction_items_total counter',
+        ]
+        lines += [f'clase_extraction_items_total{{kind="{name}"}} {value}'
+                  for name, value in sorted(self.counters.items())]
+        return '\n'.join(lines) + '\n'
+
+    def flush(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        self.flush()
+
+def instrumentation_from_env() -> Optional[Instrumentation]:
+    """
+    Build an Instrumentation from environment variables, or None if disabled.
+
+    CLASE_PROFILE_JSONL: path of a JSON lines file receiving one record per document
+    CLASE_PROFILE_PROM: path of a Prometheus text file with cumulative metrics
+    """
+    exporters = []
+    if os.getenv('CLASE_PROFILE_JSONL'):
+        exporters.append(JsonLinesExporter(os.environ['CLASE_PROFILE_JSONL']))
+    if os.getenv('CLASE_PROFILE_PROM'):
+        exporters.append(PrometheusTextExporter(os.environ['CLASE_PROFILE_PROM']))
+    return Instrumentation(exporters) if exporters else None
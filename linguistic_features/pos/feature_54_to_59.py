@@ -9,13 +9,18 @@
 '''
 
 import json
-import re
+import os
 from typing import List, Dict
+from ..context import RESOURCES_DIR, default_context
+from ..instrumentation import count
+from ..sentence_index import sentences
+
+IDIOMS_PATH = os.path.join(RESOURCES_DIR, 'idioms.json')
 
 def load_idioms() -> set:
     """Load idioms from idioms.json file."""
     try:
-        with open('/root/mayiran/CLASE/linguistic_features/_resources/idioms.json', 'r', encoding='utf-8') as f:
+        with open(IDIOMS_PATH, 'r', encoding='utf-8') as f:
             idioms_list = json.load(f)
             return set(idioms_list)
     except FileNotFoundError:
@@ -27,10 +32,8 @@ def load_idioms() -> set:
 
 def split_into_sentences(text: str) -> List[str]:
     """Split text into sentences using Chinese punctuation."""
-    # Split by common Chinese sentence endings
-    sentences = re.split('[。！？]', text)
-    # Remove empty sentences and strip whitespace
-    return [s.strip() for s in sentences if s.strip()]
+    # Split by common Chinese sentence endings, strip whitespace and drop empty sentences
+    return sentences(text, 'terminal')
 
 def count_words(text: str) -> int:
     """Count the number of Chinese characters in the text."""
@@ -75,13 +78,13 @@ def find_idioms_in_text(text: str, idioms: set) -> List[str]:
     
     return found_idioms
 
-def feature_54_to_59(text: str) -> List[Dict[str, float]]:
+def feature_54_to_59(text: str, ctx=None) -> List[Dict[str, float]]:
     """
     Calculate idiom-related features (54-59) for the given text.
     Returns a list of dictionaries containing the feature values.
     """
-    # Load idioms
-    idioms = load_idioms()
+    # Load idioms (once per extraction context)
+    idioms = (ctx or default_context()).lexicons['idioms']
     
     # Split text into sentences
     sentences = split_into_sentences(text)
@@ -108,6 +111,9 @@ def feature_54_to_59(text: str) -> List[Dict[str, float]]:
         idioms_per_sentence.append(len(sentence_idioms))
         unique_idioms_per_sentence.append(len(sentence_unique_idioms))
     
+    count('idioms_scanned', len(idioms) * num_sentences)
+    count('idioms_found', total_idioms)
+    
     # Calculate features
     features = [
         {'54': float(total_idioms)},  # Total number of idioms
@@ -5,47 +5,39 @@
 64	Average number of adverbs per sentence（文档中每句平均副词数量）	词性特征	统计文档中每句的副词数量，求平均值
 65	Average number of unique adverbs per sentence（文档中每句平均唯一副词数量）	词性特征	统计文档中每句不重复的副词数量，求平均值'''
 
-import jieba
-import jieba.posseg as pseg
 from typing import List, Dict
+from ..context import default_context
+from ..segmentation_cache import cut_text
+from ..sentence_index import sentence_spans
+from ..token_arrays import TagCategory, encode_documents, category_stats
 
-def feature_60_to_65(text: str) -> List[Dict[str, float]]:
+ADVERBS = TagCategory(lambda tag: tag.startswith('d'))
+
+def feature_60_to_65(text: str, ctx=None) -> List[Dict[str, float]]:
     """
     Extract features 60-65 related to adverbs in the text.
     
     Args:
         text: Input text string
+        ctx: Extraction context providing tokenizers, caches and lexicons
+            (the process-wide default if None)
         
     Returns:
         List of dictionaries containing feature values
     """
-    # Segment text into sentences
-    sentences = [s.strip() for s in text.split('。') if s.strip()]
-    
-    # Get all words and their POS tags
-    words_with_pos = pseg.cut(text)
-    words = []
-    pos_tags = []
-    for word, pos in words_with_pos:
-        words.append(word)
-        pos_tags.append(pos)
+    ctx = ctx or default_context()
     
-    # Count total words and adverbs
-    total_words = len(words)
-    adverbs = [word for word, pos in zip(words, pos_tags) if pos.startswith('d')]
-    unique_adverbs = list(set(adverbs))
-    total_adverbs = len(adverbs)
-    total_unique_adverbs = len(unique_adverbs)
+    # Segment text into sentences split on 。 and encode their tokens
+    words_with_pos = cut_text(text, ctx.cache)
+    arrays = encode_documents([(words_with_pos, sentence_spans(text, 'period'))])
+    num_sentences = arrays.n_sentences
     
-    # Calculate adverbs per sentence
-    adverbs_per_sentence = []
-    unique_adverbs_per_sentence = []
-    for sentence in sentences:
-        sent_words = list(pseg.cut(sentence))
-        sent_adverbs = [word for word, pos in sent_words if pos.startswith('d')]
-        sent_unique_adverbs = list(set(sent_adverbs))
-        adverbs_per_sentence.append(len(sent_adverbs))
-        unique_adverbs_per_sentence.append(len(sent_unique_adverbs))
+    # Count total words and adverbs; only 。 and whitespace tokens fall outside
+    # the sentences, so document and sentence adverb counts agree
+    total_words = len(words_with_pos)
+    adverbs = category_stats(arrays, ADVERBS)
+    total_adverbs = adverbs['total']
+    total_unique_adverbs = adverbs['unique']
     
     # Calculate features
     features = [
@@ -53,8 +45,8 @@ def feature_60_to_65(text: str) -> List[Dict[str, float]]:
         {'61': float(total_unique_adverbs)},  # Total number of unique adverbs
         {'62': float(total_adverbs / total_words) if total_words > 0 else 0.0},  # Percentage of adverbs
         {'63': float(total_unique_adverbs / total_words) if total_words > 0 else 0.0},  # Percentage of unique adverbs
-        {'64': float(sum(adverbs_per_sentence) / len(sentences)) if sentences else 0.0},  # Average adverbs per sentence
-        {'65': float(sum(unique_adverbs_per_sentence) / len(sentences)) if sentences else 0.0}  # Average unique adverbs per sentence
+        {'64': float(adverbs['total'] / num_sentences) if num_sentences else 0.0},  # Average adverbs per sentence
+        {'65': float(adverbs['sentence_unique'] / num_sentences) if num_sentences else 0.0}  # Average unique adverbs per sentence
     ]
     
     return features
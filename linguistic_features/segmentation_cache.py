@@ -0,0 +1,186 @@
+'''Corpus-wide cache of POS segmentations keyed by sentence hash.
+
+Legal judgments repeat sentences verbatim across documents (statutory
+citations, "本院认为" openings, cost clauses), so the POS extractors look up
+`(word, flag)` sequences here instead of calling `pseg.cut` on every copy.
+The in-memory tier is a bounded LRU; an optional SQLite file adds a second
+tier that several worker processes can share.
+
+Configuration of the default cache:
+    CLASE_SEGMENT_CACHE_SIZE: maximum number of in-memory entries (default 100000)
+    CLASE_SEGMENT_CACHE_PATH: SQLite file for the shared on-disk tier (disabled if unset)'''
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import jieba.posseg as pseg
+
+from .instrumentation import count
+from .sentence_index import sentence_spans
+
+Tokens = Tuple[Tuple[str, str], ...]
+
+class SegmentationCache:
+    """
+    Bounded LRU cache of `pseg.cut` results with an optional on-disk tier.
+
+    Args:
+        maxsize (int): Maximum number of sentences kept in memory
+        path (str): Optional SQLite file shared between processes
+        commit_every (int): Disk writes buffered before each commit
+        segmenter: POS segmentation function used on a miss (jieba's default
+            `pseg.cut` if None); the disk tier must only be shared between
+            caches using the same dictionary
+    """
+
+    def __init__(self, maxsize: int = 100000, path: Optional[str] = None, commit_every: int = 256,
+                 segmenter: Optional[Callable[[str], Iterable]] = None):
+        self.maxsize = maxsize
+        self.segmenter = segmenter
+        self.path = path
+        self.commit_every = commit_every
+        self.entries: 'OrderedDict[bytes, Tokens]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pending = 0
+        self._conn = None
+        self._conn_pid = None
+
+    @staticmethod
+    def key(sentence: str) -> bytes:
+        return hashlib.blake2b(sentence.encode('utf-8'), digest_size=16).digest()
+
+    def _connection(self):
+        # SQLite connections must not cross a fork; reopen in each process
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS segments (key BLOB PRIMARY KEY, tokens TEXT NOT NULL)')
+            self._conn_pid = os.getpid()
+            self._pending = 0
+        return self._conn
+
+    def _disk_get(self, key: bytes) -> Optional[Tokens]:
+        row = self._connection().execute('SELECT tokens FROM segments WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return tuple((word, flag) for word, flag in json.loads(row[0]))
+
+    def _disk_put(self, key: bytes, tokens: Tokens) -> None:
+        conn = self._connection()
+        conn.execute('INSERT OR IGNORE INTO segments (key, tokens) VALUES (?, ?)',
+                     (key, json.dumps(tokens, ensure_ascii=False)))
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            conn.commit()
+            self._pending = 0
+
+    def _remember(self, key: bytes, tokens: Tokens) -> None:
+        self.entries[key] = tokens
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def cut(self, sentence: str) -> Tokens:
+        """Return the `(word, flag)` sequence of `sentence`, segmenting it on a miss."""
+        key = self.key(sentence)
+        with self.lock:
+            tokens = self.entries.get(key)
+            if tokens is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                count('segment_cache_hits')
+                return tokens
+            if self.path:
+                tokens = self._disk_get(key)
+                if tokens is not None:
+                    self._remember(key, tokens)
+                    self.disk_hits += 1
+                    count('segment_cache_disk_hits')
+                    return tokens
+
+        tokens = tuple((word, flag) for word, flag in (self.segmenter or pseg.cut)(sentence))
+
+        with self.lock:
+            self.misses += 1
+            count('segment_cache_misses')
+            self._remember(key, tokens)
+            if self.path:
+                self._disk_put(key, tokens)
+        return tokens
+
+    def flush(self) -> None:
+        """Commit buffered disk writes."""
+        with self.lock:
+            if self._conn is not None and self._conn_pid == os.getpid():
+                self._conn.commit()
+                self._pending = 0
+
+    def clear(self) -> None:
+        """Drop the in-memory tier and reset the statistics."""
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+_default_cache: Optional[SegmentationCache] = None
+
+def get_cache() -> SegmentationCache:
+    """Process-wide cache configured from CLASE_SEGMENT_CACHE_* variables."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SegmentationCache(
+            maxsize=int(os.getenv('CLASE_SEGMENT_CACHE_SIZE', '100000')),
+            path=os.getenv('CLASE_SEGMENT_CACHE_PATH') or None,
+        )
+        if _default_cache.path:
+            atexit.register(_default_cache.flush)
+    return _default_cache
+
+def set_cache(cache: SegmentationCache) -> None:
+    """Replace the process-wide cache."""
+    global _default_cache
+    _default_cache = cache
+
+def cut_sentence(sentence: str, cache: Optional[SegmentationCache] = None) -> Tokens:
+    """Cached `pseg.cut` of one sentence (through the process-wide cache unless `cache` is given)."""
+    return (cache or get_cache()).cut(sentence)
+
+def cut_text(text: str, cache: Optional[SegmentationCache] = None) -> List[Tuple[str, str]]:
+    """
+    Cached `pseg.cut` of a whole document.
+
+    The text is cut sentence by sentence (keeping 。！？ with the sentence before
+    them); jieba never segments across punctuation, so the concatenation equals
+    `list(pseg.cut(text))`.
+    """
+    cache = cache or get_cache()
+    tokens = []
+    for start, end in sentence_spans(text, 'terminal_keep').tolist():
+        if end > start:
+            tokens.extend(cache.cut(text[start:end]))
+    return tokens
@@ -5,64 +5,44 @@
 23	Total number of characters per document（文档中的汉字总数）	浅层特征	统计文档中所有汉字的数量
 24	Total number of punctuation marks per document（文档中的标点符号总数）	浅层特征	统计文档中所有标点符号的数量'''
 
-import re
+import numpy as np
+from ..instrumentation import count
+from ..sentence_index import codepoints, sentence_spans, sentences, span_sums, span_word_counts
+
+# Punctuation marks counted by feature 22 and 24
+PUNCTUATION = np.array([ord(c) for c in '，。！？；：、'], dtype=np.uint32)
 
 def split_chinese_sentences(text):
     """
     Split Chinese text into sentences based on punctuation marks.
     """
-    # Define sentence-ending punctuation marks in Chinese
-    sentence_endings = r'[。！？]'
-    
-    # Split text into sentences
-    sentences = re.split(sentence_endings, text)
-    
-    # Remove empty sentences and strip whitespace
-    sentences = [s.strip() for s in sentences if s.strip()]
-    
-    return sentences
+    # Sentences end with 。！？, are stripped of whitespace and never empty
+    return sentences(text, 'terminal')
 
-def feature_19_to_24(text):
+def feature_19_to_24(text, ctx=None):
     """
     Extract features 19-24 from the input text.
     
     Args:
         text (str): Input text document
+        ctx: Extraction context, accepted for a uniform signature (unused)
         
     Returns:
         list: List of dictionaries containing feature values
     """
-    # Split text into sentences
-    sentences = split_chinese_sentences(text)
+    # Sentence boundaries of the text
+    spans = sentence_spans(text, 'terminal')
     
     # Calculate features
-    num_sentences = len(sentences)
+    num_sentences = len(spans)
+    count('sentences', num_sentences)
     
-    # Initialize counters
-    total_words = 0
-    total_chars = 0
-    total_punctuation = 0
-    sentence_word_counts = []
-    sentence_char_counts = []
-    sentence_punctuation_counts = []
-    
-    # Process each sentence
-    for sentence in sentences:
-        # Count words (split by whitespace)
-        words = sentence.split()
-        word_count = len(words)
-        sentence_word_counts.append(word_count)
-        total_words += word_count
-        
-        # Count Chinese characters
-        char_count = len(re.findall(r'[\u4e00-\u9fff]', sentence))
-        sentence_char_counts.append(char_count)
-        total_chars += char_count
-        
-        # Count punctuation marks
-        punctuation_count = len(re.findall(r'[，。！？；：、]', sentence))
-        sentence_punctuation_counts.append(punctuation_count)
-        total_punctuation += punctuation_count
+    # Count words (split by whitespace), Chinese characters and punctuation
+    # marks of every sentence on the code points of the whole text
+    chars = codepoints(text)
+    total_words = int(span_word_counts(chars, spans).sum())
+    total_chars = int(span_sums((chars >= 0x4e00) & (chars <= 0x9fff), spans).sum())
+    total_punctuation = int(span_sums(np.isin(chars, PUNCTUATION), spans).sum())
     
     # Calculate averages
     avg_words_per_sentence = total_words / num_sentences if num_sentences > 0 else 0
@@ -8,6 +8,7 @@ from collections import Counter
 from typing import Dict, List, Set
 import os
 from pathlib import Path
+from ..context import RESOURCES_DIR, default_context
 
 def load_common_characters(json_path: str, start_idx: int = 0, end_idx: int = 3500) -> Set[str]:
     """Load Chinese characters from character.json file within specified range.
@@ -69,26 +70,37 @@ def calculate_second_most_common_percentage(text: str, character_set: Set[str])
     
     return second_most_common_count / total_chars
 
-def feature_1_to_3(text: str, json_path: str = "/root/mayiran/CLASE/linguistic_features/_resources/characters.json") -> List[Dict[str, float]]:
+CHARACTERS_PATH = os.path.join(RESOURCES_DIR, 'characters.json')
+
+def feature_1_to_3(text: str, json_path: str = CHARACTERS_PATH, ctx=None) -> List[Dict[str, float]]:
     """Calculate all three character frequency features.
     
     Args:
         text: Input text to analyze
         json_path: Path to the characters.json file
+        ctx: Extraction context whose loaded lexicons are used when json_path
+            is the bundled file (the process-wide default if None)
         
     Returns:
         List of dictionaries containing the three feature values
     """
+    if json_path == CHARACTERS_PATH:
+        lexicons = (ctx or default_context()).lexicons
+        common_chars_3500 = lexicons['chars_3500']
+        chars_3500_6500 = lexicons['chars_3500_6500']
+        common_chars_6500 = lexicons['chars_6500']
+    else:
+        common_chars_3500 = load_common_characters(json_path, 0, 3500)
+        chars_3500_6500 = load_common_characters(json_path, 3500, 6500)
+        common_chars_6500 = load_common_characters(json_path, 0, 6500)
+    
     # Feature 1: Most common characters (top 3500)
-    common_chars_3500 = load_common_characters(json_path, 0, 3500)
     feature1 = calculate_character_percentage(text, common_chars_3500)
     
     # Feature 2: Second most common characters (3500-6500)
-    chars_3500_6500 = load_common_characters(json_path, 3500, 6500)
     feature2 = calculate_second_most_common_percentage(text, chars_3500_6500)
     
     # Feature 3: All common characters (top 6500)
-    common_chars_6500 = load_common_characters(json_path, 0, 6500)
     feature3 = calculate_character_percentage(text, common_chars_6500)
     
     return [
@@ -6,7 +6,9 @@ Features:
 7. Average number of strokes per character'''
 
 import json
+import os
 from typing import Dict, List, Tuple
+from ..context import RESOURCES_DIR, default_context
 
 def load_stroke_data(stroke_file: str) -> Dict[str, int]:
     """Load character stroke data from JSON file.
@@ -59,19 +61,26 @@ def calculate_stroke_ratios(text: str, stroke_data: Dict[str, int]) -> Tuple[flo
     
     return low_ratio, medium_ratio, high_ratio, avg_strokes
 
-def feature_4_to_7(text: str, stroke_file: str = '/root/mayiran/CLASE/linguistic_features/_resources/char_strokes.json') -> List[Dict[str, float]]:
+STROKES_PATH = os.path.join(RESOURCES_DIR, 'char_strokes.json')
+
+def feature_4_to_7(text: str, stroke_file: str = STROKES_PATH, ctx=None) -> List[Dict[str, float]]:
     """Calculate all stroke-related features (4-7) for the given text.
     
     Args:
         text: Input text to analyze
         stroke_file: Path to the JSON file containing character stroke data
+        ctx: Extraction context whose loaded lexicons are used when stroke_file
+            is the bundled file (the process-wide default if None)
         
     Returns:
         List of dictionaries containing the features:
         [{'4': low_stroke_ratio}, {'5': medium_stroke_ratio}, 
          {'6': high_stroke_ratio}, {'7': avg_strokes}]
     """
-    stroke_data = load_stroke_data(stroke_file)
+    if stroke_file == STROKES_PATH:
+        stroke_data = (ctx or default_context()).lexicons['strokes']
+    else:
+        stroke_data = load_stroke_data(stroke_file)
     low_ratio, medium_ratio, high_ratio, avg_strokes = calculate_stroke_ratios(text, stroke_data)
     
     return [
@@ -10,26 +10,32 @@
 17	Number of unique four-character words per document（文档中唯一四字词的数量）	浅层特征	统计文档中不重复的四字词的数量
 18	Number of unique words longer than four characters per document（文档中唯一超过四字的词的数量）	浅层特征	统计文档中不重复的长度超过四个字符的词的数量'''
 
-import jieba
 from typing import List, Dict
 import os
+from ..context import default_context
+from ..instrumentation import count
 
-def feature_8_to_18(text: str) -> List[Dict[str, float]]:
+def feature_8_to_18(text: str, ctx=None) -> List[Dict[str, float]]:
     """
     Calculate features 8-18 for a given Chinese text.
     
     Args:
         text (str): Input Chinese text
+        ctx: Extraction context providing tokenizers, caches and lexicons
+            (the process-wide default if None)
         
     Returns:
         List[Dict[str, float]]: List of dictionaries containing feature values
     """
+    ctx = ctx or default_context()
+    
     # Segment the text using jieba
-    words = list(jieba.cut(text))
+    words = ctx.cut(text)
     
     # Calculate total characters and words
     total_chars = sum(len(word) for word in words)
     total_words = len(words)
+    count('tokens', total_words)
     unique_words = set(words)
     unique_words_count = len(unique_words)
     
@@ -0,0 +1,606 @@
+'''Mergeable per-sentence sufficient statistics for features 1-100.
+
+Every feature is a count, a unique-set size or a ratio of such quantities, so a
+document can be described by additive statistics: integer counters plus
+multisets (Counters) of the words behind each unique count. Statistics are
+collected per unit, a piece of text ending with "。" (the coarsest sentence
+boundary used by any extractor, so every extractor's sentences nest inside
+one unit), merged with `+` and turned into the 100 features by `finalize`.
+Because statistics can also be subtracted, `IncrementalExtractor` re-analyses
+only the units that changed between two versions of a document, and
+`extract_features_parallel` splits very long documents across processes.
+
+`finalize(document_stats(text))` returns exactly `extract_all_features(text)`.
+Like the extractors, every function takes an optional `ctx` (ExtractionContext)
+whose tokenizers, segmentation cache and lexicons it uses.'''
+
+import re
+from collections import Counter
+from multiprocessing import Pool
+from typing import Dict, Iterable, List, Optional, Union
+
+from .context import ExtractionContext, default_context
+from .pos.feature_25_to_53 import FUNCTIONAL_WORDS, ADJECTIVES, VERBS, NOUNS, CONTENT_WORDS
+from .pos.feature_54_to_59 import find_idioms_in_text
+from .syntactic.feature_66_to_78 import analyze_phrases
+from .segmentation_cache import cut_sentence
+from .sentence_index import sentence_spans, span_ids, token_offsets
+
+POS_CATEGORIES = [
+    ('functional', FUNCTIONAL_WORDS),
+    ('adjectives', ADJECTIVES),
+    ('verbs', VERBS),
+    ('nouns', NOUNS),
+    ('content', CONTENT_WORDS),
+]
+
+def get_resources() -> Dict:
+    """Character, stroke and idiom lexicons, loaded once per process."""
+    return default_context().lexicons
+
+class FeatureStats:
+    """
+    Additive statistics for a sequence of whole units.
+
+    Values are ints or Counters; `+` and `-` combine them field by field, so
+    statistics of disjoint parts of a document can be merged in any order.
+    """
+
+    __slots__ = ('values',)
+
+    def __init__(self, values: Optional[Dict] = None):
+        self.values = values if values is not None else {}
+
+    def __getitem__(self, name):
+        value = self.values.get(name)
+        return value if value is not None else 0
+
+    def counter(self, name) -> Counter:
+        return self.values.get(name) or Counter()
+
+    def __iadd__(self, other: 'FeatureStats') -> 'FeatureStats':
+        for name, value in other.values.items():
+            current = self.values.get(name)
+            if current is None:
+                self.values[name] = value.copy() if isinstance(value, Counter) else value
+            elif isinstance(value, Counter):
+                current.update(value)
+            else:
+                self.values[name] = current + value
+        return self
+
+    def __isub__(self, other: 'FeatureStats') -> 'FeatureStats':
+        for name, value in other.values.items():
+            current = self.values.get(name)
+            if isinstance(value, Counter):
+                current = current if current is not None else Counter()
+                current.subtract(value)
+                self.values[name] = +current
+            else:
+                self.values[name] = (current or 0) - value
+        return self
+
+    def __add__(self, other: 'FeatureStats') -> 'FeatureStats':
+        result = FeatureStats()
+        result += self
+        result += other
+        return result
+
+    def __sub__(self, other: 'FeatureStats') -> 'FeatureStats':
+        result = FeatureStats()
+        result += self
+        result -= other
+        return result
+
+    @classmethod
+    def merge(cls, parts: Iterable['FeatureStats']) -> 'FeatureStats':
+        total = cls()
+        for part in parts:
+            total += part
+        return total
+
+def split_units(text: str) -> List[str]:
+    """Split text into units ending with "。" (the last one may not)."""
+    return [unit for unit in re.split('(?<=。)', text) if unit]
+
+def _group(tokens, offsets, spans) -> List[list]:
+    """Assign tokens to the spans that contain them; tokens outside every span are dropped."""
+    groups = [[] for _ in spans]
+    for token, i in zip(tokens, span_ids(offsets, spans).tolist()):
+        if i >= 0:
+            groups[i].append(token)
+    return groups
+
+def sentence_stats(unit: str, ctx: Optional[ExtractionContext] = None) -> FeatureStats:
+    """
+    Compute the sufficient statistics of one unit.
+
+    Args:
+        unit (str): Text ending with "。" (or the tail of a document)
+        ctx (ExtractionContext): Tokenizers, caches and lexicons to use (the
+            process-wide default if None)
+
+    Returns:
+        FeatureStats: Additive statistics for all 100 features
+    """
+    ctx = ctx or default_context()
+    res = ctx.lexicons
+    v = {}
+
+    # Features 1-3: character frequency
+    char_count = Counter(unit)
+    v['chars'] = len(unit)
+    v['chars_3500'] = sum(n for char, n in char_count.items() if char in res['chars_3500'])
+    v['chars_6500'] = sum(n for char, n in char_count.items() if char in res['chars_6500'])
+    v['chars_3500_6500'] = Counter({char: n for char, n in char_count.items() if char in res['chars_3500_6500']})
+
+    # Features 4-7: stroke counts
+    strokes = [res['strokes'][char] for char in unit if char in res['strokes']]
+    v['stroke_chars'] = len(strokes)
+    v['stroke_total'] = sum(strokes)
+    v['stroke_low'] = sum(1 for s in strokes if s <= 5)
+    v['stroke_medium'] = sum(1 for s in strokes if 6 <= s <= 15)
+    v['stroke_high'] = sum(1 for s in strokes if s > 15)
+
+    # Features 8-18: jieba words
+    words = ctx.cut(unit)
+    v['words'] = len(words)
+    v['word_chars'] = sum(len(w) for w in words)
+    v['words_2'] = sum(1 for w in words if len(w) == 2)
+    v['words_3'] = sum(1 for w in words if len(w) == 3)
+    v['words_4'] = sum(1 for w in words if len(w) == 4)
+    v['words_5plus'] = sum(1 for w in words if len(w) > 4)
+    v['word_set'] = Counter(words)
+
+    # Features 19-24, 54-59 and 93-100 share sentences split on 。！？
+    v['han_chars'] = sum(1 for c in unit if '\u4e00' <= c <= '\u9fff')
+    sentences = sentence_spans(unit, 'terminal')
+    v['sentences'] = len(sentences)
+    v['space_words'] = sum(len(unit[s:e].split()) for s, e in sentences.tolist())
+    v['punctuation'] = sum(len(re.findall(r'[，。！？；：、]', unit[s:e])) for s, e in sentences.tolist())
+
+    # Features 54-59: idioms per sentence
+    idiom_set = Counter()
+    idiom_total = 0
+    idiom_sentence_unique = 0
+    for s, e in sentences.tolist():
+        found = find_idioms_in_text(unit[s:e], res['idioms'])
+        idiom_total += len(found)
+        idiom_set.update(found)
+        idiom_sentence_unique += len(set(found))
+    v['idioms'] = idiom_total
+    v['idiom_set'] = idiom_set
+    v['idiom_sentence_unique'] = idiom_sentence_unique
+
+    # POS tokens of the unit with character offsets; jieba never segments across
+    # punctuation or whitespace, so any sentence of the unit is a token slice
+    tokens = cut_sentence(unit, ctx.cache)
+    offsets = token_offsets(tokens)
+    v['pos_tokens'] = len(tokens)
+
+    # Features 25-53: sentences keep their delimiter, the trailing piece counts
+    v['delimiters'] = sum(1 for c in unit if c in '。！？')
+    pieces = sentence_spans(unit, 'terminal_keep')
+    for category, tags in POS_CATEGORIES:
+        in_category = [word for word, flag in tokens if flag in tags]
+        v[f'{category}_total'] = len(in_category)
+        v[f'{category}_set'] = Counter(in_category)
+        v[f'{category}_sentence_unique'] = sum(
+            len({word for word, flag in piece if flag in tags}) for piece in _group(tokens, offsets, pieces))
+
+    # Features 60-65 and 79-92: sentences split on 。 only, i.e. the unit itself
+    unit_sentence = sentence_spans(unit, 'period')
+    unit_tokens = _group(tokens, offsets, unit_sentence)[0] if len(unit_sentence) else []
+    v['unit_sentences'] = len(unit_sentence)
+    adverbs = [word for word, flag in tokens if flag.startswith('d')]
+    v['adverbs'] = len(adverbs)
+    v['adverb_set'] = Counter(adverbs)
+    v['adverb_sentence_unique'] = len({word for word, flag in unit_tokens if flag.startswith('d')})
+
+    v['entity_words'] = len(unit_tokens)
+    entities = []
+    for word, flag in unit_tokens:
+        if flag.startswith('nr') or flag.startswith('ns') or flag.startswith('nt'):
+            entities.append(word)
+            if flag.startswith('nr'):
+                v['named_entities'] = v.get('named_entities', 0) + 1
+        elif flag.startswith('n'):
+            v['entity_nouns'] = v.get('entity_nouns', 0) + 1
+            if not (flag.startswith('nz') or flag.startswith('nl')):
+                v['not_entity_nouns'] = v.get('not_entity_nouns', 0) + 1
+    v['entities'] = len(entities)
+    v['entity_set'] = Counter(entities)
+
+    # Features 66-78: sentences split on 。！？!?
+    for sentence_tokens in _group(tokens, offsets, sentence_spans(unit, 'terminal_ascii')):
+        np_count, vp_count, pp_count, np_length, vp_length, pp_length, clause_count = analyze_phrases(sentence_tokens)
+        v['syntax_sentences'] = v.get('syntax_sentences', 0) + 1
+        v['np'] = v.get('np', 0) + np_count
+        v['vp'] = v.get('vp', 0) + vp_count
+        v['pp'] = v.get('pp', 0) + pp_count
+        v['np_length'] = v.get('np_length', 0) + np_length
+        v['vp_length'] = v.get('vp_length', 0) + vp_length
+        v['pp_length'] = v.get('pp_length', 0) + pp_length
+        v['clauses'] = v.get('clauses', 0) + clause_count
+        v['clause_sentences'] = v.get('clause_sentences', 0) + (1 if clause_count > 0 else 0)
+
+    # Features 93-100: conjunctions and pronouns
+    conjunctions = [word for word, flag in tokens if flag == 'c']
+    pronouns = [word for word, flag in tokens if flag == 'r']
+    v['conjunctions'] = len(conjunctions)
+    v['conjunction_set'] = Counter(conjunctions)
+    v['pronouns'] = len(pronouns)
+    v['pronoun_set'] = Counter(pronouns)
+    v['conjunction_sentence_unique'] = sum(
+        len({word for word, flag in sentence_tokens if flag == 'c'})
+        for sentence_tokens in _group(tokens, offsets, sentences))
+
+    return FeatureStats(v)
+
+def document_stats(text: str, ctx: Optional[ExtractionContext] = None) -> FeatureStats:
+    """Sum of the unit statistics of `text`."""
+    return FeatureStats.merge(sentence_stats(unit, ctx) for unit in split_units(text))
+
+def finalize(stats: FeatureStats) -> List[Dict[str, float]]:
+    """
+    Turn merged statistics into the 100 features, matching extract_all_features.
+
+    Args:
+        stats (FeatureStats): Statistics of a whole document
+
+    Returns:
+        List[Dict[str, float]]: List of dictionaries containing feature values
+    """
+    s = stats
+    features = []
+
+    # Features 1-3
+    chars = s['chars']
+    mid = s.counter('chars_3500_6500')
+    mid_total = sum(mid.values())
+    second = sorted(mid.values(), reverse=True)[1] / mid_total if len(mid) >= 2 else 0.0
+    features += [
+        {'1': s['chars_3500'] / chars if chars > 0 else 0.0},
+        {'2': second},
+        {'3': s['chars_6500'] / chars if chars > 0 else 0.0},
+    ]
+
+    # Features 4-7
+    n = s['stroke_chars']
+    if n == 0:
+        features += [{'4': 0.0}, {'5': 0.0}, {'6': 0.0}, {'7': 0.0}]
+    else:
+        features += [{'4': s['stroke_low'] / n}, {'5': s['stroke_medium'] / n},
+                     {'6': s['stroke_high'] / n}, {'7': s['stroke_total'] / n}]
+
+    # Features 8-18
+    words = s['words']
+    unique = s.counter('word_set')
+    features += [
+        {'8': s['word_chars'] / words if words > 0 else 0},
+        {'9': sum(len(w) for w in unique) / len(unique) if len(unique) > 0 else 0},
+        {'10': s['words_2']},
+        {'11': s['words_3']},
+        {'12': s['words_4']},
+        {'13': s['words_5plus']},
+        {'14': len(unique)},
+        {'15': sum(1 for w in unique if len(w) == 2)},
+        {'16': sum(1 for w in unique if len(w) == 3)},
+        {'17': sum(1 for w in unique if len(w) == 4)},
+        {'18': sum(1 for w in unique if len(w) > 4)},
+    ]
+
+    # Features 19-24
+    sentences = s['sentences']
+    features += [
+        {'19': sentences},
+        {'20': s['space_words'] / sentences if sentences > 0 else 0},
+        {'21': s['han_chars'] / sentences if sentences > 0 else 0},
+        {'22': s['punctuation'] / sentences if sentences > 0 else 0},
+        {'23': s['han_chars']},
+        {'24': s['punctuation']},
+    ]
+
+    # Features 25-53
+    total_words = s['pos_tokens']
+    total_sentences = s['delimiters'] + 1
+    functional = len(s.counter('functional_set'))
+    features += [
+        {'25': s['functional_total'] / total_sentences},
+        {'26': s['functional_sentence_unique'] / total_sentences},
+        {'27': s['functional_total'] / total_words},
+        {'28': functional / total_words},
+        {'29': functional},
+    ]
+    for category, start in (('adjectives', 30), ('verbs', 36), ('nouns', 42), ('content', 48)):
+        unique_count = len(s.counter(f'{category}_set'))
+        values = [
+            s[f'{category}_total'],
+            unique_count,
+            s[f'{category}_total'] / total_words,
+            unique_count / total_words,
+            s[f'{category}_total'] / total_sentences,
+            s[f'{category}_sentence_unique'] / total_sentences,
+        ]
+        features += [{str(start + i): value} for i, value in enumerate(values)]
+
+    # Features 54-59
+    idioms = s['idioms']
+    unique_idioms = len(s.counter('idiom_set'))
+    han = s['han_chars']
+    features += [
+        {'54': float(idioms)},
+        {'55': float(unique_idioms)},
+        {'56': float(idioms / han) if han > 0 else 0.0},
+        {'57': float(unique_idioms / han) if han > 0 else 0.0},
+        {'58': float(idioms / sentences) if sentences > 0 else 0.0},
+        {'59': float(s['idiom_sentence_unique'] / sentences) if sentences > 0 else 0.0},
+    ]
+
+    # Features 60-65
+    adverbs = s['adverbs']
+    unique_adverbs = len(s.counter('adverb_set'))
+    unit_sentences = s['unit_sentences']
+    features += [
+        {'60': float(adverbs)},
+        {'61': float(unique_adverbs)},
+        {'62': float(adverbs / total_words) if total_words > 0 else 0.0},
+        {'63': float(unique_adverbs / total_words) if total_words > 0 else 0.0},
+        {'64': float(adverbs / unit_sentences) if unit_sentences else 0.0},
+        {'65': float(s['adverb_sentence_unique'] / unit_sentences) if unit_sentences else 0.0},
+    ]
+
+    # Features 66-78
+    n = s['syntax_sentences']
+    np_count, vp_count, pp_count = s['np'], s['vp'], s['pp']
+    features += [
+        {'66': np_count / n if n > 0 else 0},
+        {'67': vp_count / n if n > 0 else 0},
+        {'68': float(np_count)},
+        {'69': float(vp_count)},
+        {'70': float(pp_count)},
+        {'71': s['np_length'] / np_count if np_count > 0 else 0},
+        {'72': s['vp_length'] / vp_count if vp_count > 0 else 0},
+        {'73': s['pp_length'] / pp_count if pp_count > 0 else 0},
+        {'74': s['clause_sentences'] / n if n > 0 else 0},
+        {'75': (n - s['clause_sentences']) / n if n > 0 else 0},
+        {'76': s['clauses'] / n if n > 0 else 0},
+        {'77': float(n)},
+        {'78': (s['clauses'] + n) / n if n > 0 else 0},
+    ]
+
+    # Features 79-92
+    words_79 = s['entity_words']
+    entities = s['entities']
+    unique_entities = len(s.counter('entity_set'))
+    named = s['named_entities']
+    nouns = s['entity_nouns']
+    not_entity_nouns = s['not_entity_nouns']
+    features += [
+        {'79': float(entities)},
+        {'80': float(unique_entities)},
+        {'81': float(entities) / words_79 if words_79 > 0 else 0.0},
+        {'82': float(unique_entities) / words_79 if words_79 > 0 else 0.0},
+        {'83': float(entities) / unit_sentences if unit_sentences else 0.0},
+        {'84': float(unique_entities) / unit_sentences if unit_sentences else 0.0},
+        {'85': float(named) / words_79 if words_79 > 0 else 0.0},
+        {'86': float(named) / unit_sentences if unit_sentences else 0.0},
+        {'87': float(named) / entities if entities > 0 else 0.0},
+        {'88': float(nouns) / words_79 if words_79 > 0 else 0.0},
+        {'89': float(nouns) / words_79 if words_79 > 0 else 0.0},
+        {'90': float(nouns) / unit_sentences if unit_sentences else 0.0},
+        {'91': float(nouns) / unit_sentences if unit_sentences else 0.0},
+        {'92': float(not_entity_nouns) / unit_sentences if unit_sentences else 0.0},
+    ]
+
+    # Features 93-100
+    conjunctions = s['conjunctions']
+    unique_conjunctions = len(s.counter('conjunction_set'))
+    pronouns = s['pronouns']
+    unique_pronouns = len(s.counter('pronoun_set'))
+    features += [
+        {'93': conjunctions / total_words if total_words > 0 else 0},
+        {'94': unique_conjunctions},
+        {'95': unique_conjunctions / total_words if total_words > 0 else 0},
+        {'96': conjunctions / sentences if sentences else 0},
+        {'97': s['conjunction_sentence_unique'] / sentences if sentences else 0},
+        {'98': pronouns / total_words if total_words > 0 else 0},
+        {'99': unique_pronouns},
+        {'100': unique_pronouns / total_words if total_words > 0 else 0},
+    ]
+
+    return features
+
+class IncrementalExtractor:
+    """
+    Keep the statistics of a document and update them after edits.
+
+    Only units whose text changed are re-analysed; the document total is
+    adjusted by subtracting the statistics of removed units and adding those
+    of new ones.
+
+    Example:
+        extractor = IncrementalExtractor(text)
+        features = extractor.update(edited_text)
+    """
+
+    def __init__(self, text: str = '', ctx: Optional[ExtractionContext] = None):
+        self.ctx = ctx
+        self.units: Counter = Counter()
+        self.unit_stats: Dict[str, FeatureStats] = {}
+        self.total = FeatureStats()
+        self.analysed = 0
+        self.update(text)
+
+    def update(self, text: str) -> List[Dict[str, float]]:
+        """Replace the document text and return its features."""
+        new_units = Counter(split_units(text))
+        removed = self.units - new_units
+        added = new_units - self.units
+        for unit, times in removed.items():
+            for _ in range(times):
+                self.total -= self.unit_stats[unit]
+            if unit not in new_units:
+                del self.unit_stats[unit]
+        for unit, times in added.items():
+            if unit not in self.unit_stats:
+                self.unit_stats[unit] = sentence_stats(unit, self.ctx)
+                self.analysed += 1
+            for _ in range(times):
+                self.total += self.unit_stats[unit]
+        self.units = new_units
+        return self.features()
+
+    def features(self) -> List[Dict[str, float]]:
+        return finalize(self.total)
+
+def _chunk_stats(units: List[str]) -> FeatureStats:
+    return FeatureStats.merge(sentence_stats(unit) for unit in units)
+
+def extract_features_parallel(text: str, processes: int = 4, chunks_per_process: int = 4) -> List[Dict[str, float]]:
+    """
+    Extract features of a long document by analysing chunks of units in parallel.
+
+    Args:
+        text (str): Input Chinese text
+        processes (int): Number of worker processes
+        chunks_per_process (int): Chunks handed to each worker, for load balancing
+
+    Returns:
+        List[Dict[str, float]]: Same features as extract_all_features(text)
+    """
+    units = split_units(text)
+    n_chunks = max(1, min(len(units), processes * chunks_per_process))
+    size = -(-len(units) // n_chunks) if units else 1
+    chunks = [units[i:i + size] for i in range(0, len(units), size)]
+    with Pool(processes) as pool:
+        parts = pool.map(_chunk_stats, chunks)
+    return finalize(FeatureStats.merge(parts))
+
+class StreamingExtractor:
+    """
+    Accumulate the statistics of a document fed in arbitrary pieces.
+
+    Text is buffered only up to the last "。" seen; once `chunk_size`
+    characters are pending, everything before that "。" is analysed and merged
+    into the running total. Memory is therefore bounded by the chunk size (plus
+    the longest unit and the distinct-word multisets), not by the document.
+
+    Example:
+        extractor = StreamingExtractor()
+        for piece in pieces:
+            extractor.feed(piece)
+        features = extractor.close()
+    """
+
+    def __init__(self, chunk_size: int = 65536, ctx: Optional[ExtractionContext] = None):
+        self.chunk_size = chunk_size
+        self.ctx = ctx
+        self.total = FeatureStats()
+        self.pending: List[str] = []
+        self.pending_chars = 0
+        self.flush_at = chunk_size
+        self.analysed_chars = 0
+
+    def feed(self, piece: str) -> None:
+        """Append the next piece of the document."""
+        if not piece:
+            return
+        self.pending.append(piece)
+        self.pending_chars += len(piece)
+        if self.pending_chars >= self.flush_at:
+            self._flush(final=False)
+
+    def _flush(self, final: bool) -> None:
+        buffer = ''.join(self.pending)
+        cut = len(buffer) if final else buffer.rfind('。') + 1
+        if cut > 0:
+            self.total += document_stats(buffer[:cut], self.ctx)
+            self.analysed_chars += cut
+            buffer = buffer[cut:]
+        self.pending = [buffer] if buffer else []
+        self.pending_chars = len(buffer)
+        # A unit longer than the chunk keeps growing; wait for another chunk
+        # before looking for its end again
+        self.flush_at = self.pending_chars + self.chunk_size
+
+    def features(self) -> List[Dict[str, float]]:
+        """Features of the text analysed so far (pending text excluded)."""
+        return finalize(self.total)
+
+    def close(self) -> List[Dict[str, float]]:
+        """Analyse the remaining text and return the features of the whole document."""
+        self._flush(final=True)
+        return self.features()
+
+def iter_text_chunks(text: str, chunk_size: int = 65536) -> Iterable[str]:
+    """Yield consecutive slices of `text` of at most `chunk_size` characters."""
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size]
+
+def iter_file_chunks(path: str, chunk_size: int = 65536, encoding: str = 'utf-8') -> Iterable[str]:
+    """Yield a text file in pieces of at most `chunk_size` characters."""
+    with open(path, 'r', encoding=encoding) as f:
+        for piece in iter(lambda: f.read(chunk_size), ''):
+            yield piece
+
+def extract_features_streaming(pieces: Union[str, Iterable[str]], chunk_size: int = 65536,
+                               ctx: Optional[ExtractionContext] = None) -> List[Dict[str, float]]:
+    """
+    Extract features of a document with memory bounded by `chunk_size`.
+
+    Args:
+        pieces: The document as a string, or an iterable of its consecutive
+            pieces (e.g. `iter_file_chunks(path)`)
+        chunk_size (int): Characters analysed at a time
+        ctx (ExtractionContext): Tokenizers, caches and lexicons to use
+
+    Returns:
+        List[Dict[str, float]]: Same features as the in-memory path
+    """
+    if isinstance(pieces, str):
+        pieces = iter_text_chunks(pieces, chunk_size)
+    extractor = StreamingExtractor(chunk_size, ctx)
+    for piece in pieces:
+        extractor.feed(piece)
+    return extractor.close()
+
+def main():
+    import argparse
+    import json
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description="Extract features of a long plain-text document in chunks")
+    parser.add_argument('path', help="UTF-8 text file")
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    parser.add_argument('--check', action='store_true',
+                        help="Also run the in-memory path and compare the features")
+    args = parser.parse_args()
+
+    # Load the dictionaries and lexicons before tracing so that only the
+    # extraction itself is measured
+    from .feature_extractor import extract_all_features
+    warm_up = '本院认为，被告人的行为构成盗窃罪。'
+    extract_all_features(warm_up)
+    extract_features_streaming(warm_up)
+
+    tracemalloc.start()
+    features = extract_features_streaming(iter_file_chunks(args.path, args.chunk_size), args.chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps(features, ensure_ascii=False))
+    print(f"Peak traced memory (streaming): {peak / 2 ** 20:.1f} MiB")
+
+    if args.check:
+        with open(args.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        tracemalloc.start()
+        expected = extract_all_features(text)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"Peak traced memory (in memory): {peak / 2 ** 20:.1f} MiB")
+        same = json.dumps(features) == json.dumps(expected)
+        print("Features match the in-memory path" if same else "Features differ from the in-memory path")
+
+if __name__ == "__main__":
+    main()
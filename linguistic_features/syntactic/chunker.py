@@ -0,0 +1,256 @@
+'''Table-driven phrase chunker over integer POS tag ids.
+
+Every token is mapped to a class through a lookup table indexed by tag id
+(NP, VP or PP material, a clause marker, or other). The chunker is a finite
+state machine whose state is the type of the phrase being built:
+
+    class      next state   effect
+    NP/VP/PP   that type    starts a new phrase unless it equals the state
+    OTHER      unchanged    extends the current phrase, if any
+    CLAUSE     unchanged    counts a clause marker, does not touch the phrase
+
+The state only ever changes to the class of the last phrase token, so the
+whole machine reduces to a forward fill of phrase classes within each
+sentence; phrases are the maximal runs of equal filled state. `chunk` does this
+with numpy over a whole batch of sentences at once, and `run_transitions` steps
+the same table one token at a time as a reference.'''
+
+from typing import Iterable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from ..token_arrays import TAGS, TokenArrays, encode_sentences
+
+# Token classes; the phrase classes double as FSM states, NONE is the start state
+NONE, NP, VP, PP, CLAUSE, OTHER = range(6)
+PHRASE_TYPES = (NP, VP, PP)
+PHRASE_NAMES = {NP: 'np', VP: 'vp', PP: 'pp'}
+
+# Nouns and their modifiers
+NP_TAGS = ['a', 'b', 'f', 'm', 'q', 'r', 's', 't', 'z']
+# Conjunctions and particles mark clauses
+CLAUSE_TAGS = ['c', 'u']
+
+def token_class(flag: str) -> int:
+    """Chunker class of a jieba POS tag."""
+    if flag.startswith('n') or flag in NP_TAGS:
+        return NP
+    if flag.startswith('v'):
+        return VP
+    if flag == 'p':
+        return PP
+    if flag in CLAUSE_TAGS:
+        return CLAUSE
+    return OTHER
+
+class ClassTable:
+    """Lookup table from tag id to token class, grown with the tag table."""
+
+    def __init__(self, classify=token_class):
+        self.classify = classify
+        self.table = np.zeros(0, dtype=np.int8)
+
+    def classes(self, tag_ids: np.ndarray) -> np.ndarray:
+        if len(self.table) < len(TAGS):
+            self.table = np.fromiter((self.classify(tag) for tag in list(TAGS)), dtype=np.int8)
+        return self.table[tag_ids]
+
+CLASS_TABLE = ClassTable()
+
+# TRANSITIONS[state, class] -> next state; STARTS[state, class] -> whether a phrase starts
+TRANSITIONS = np.empty((4, 6), dtype=np.int8)
+STARTS = np.zeros((4, 6), dtype=bool)
+for _state in (NONE, NP, VP, PP):
+    for _cls in range(6):
+        if _cls in PHRASE_TYPES:
+            TRANSITIONS[_state, _cls] = _cls
+            STARTS[_state, _cls] = _cls != _state
+        else:
+            TRANSITIONS[_state, _cls] = _state
+
+class Chunks(NamedTuple):
+    """
+    Phrases found in a batch of sentences.
+
+    types, starts, ends, lengths and sent_ids have one entry per phrase;
+    [start, end) are token offsets into the encoded arrays and length counts
+    the phrase's tokens (clause markers inside the span are not counted).
+    clauses has one entry per sentence.
+    """
+    types: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    lengths: np.ndarray
+    sent_ids: np.ndarray
+    clauses: np.ndarray
+
+def chunk(arrays: TokenArrays) -> Chunks:
+    """
+    Chunk every sentence of `arrays` into NP/VP/PP spans.
+
+    Args:
+        arrays: Encoded tokens of one or more sentences
+
+    Returns:
+        Chunks: phrase spans and per-sentence clause marker counts
+    """
+    classes = CLASS_TABLE.classes(arrays.tag_ids)
+    is_clause = classes == CLAUSE
+    clauses = np.bincount(arrays.sent_ids[is_clause], minlength=arrays.n_sentences)
+
+    # Clause markers neither extend nor break phrases, so drop them
+    positions = np.flatnonzero(~is_clause)
+    classes = classes[positions]
+    sent_ids = arrays.sent_ids[positions]
+    n = len(positions)
+
+    # Forward-fill the last phrase class within each sentence
+    first = np.ones(n, dtype=bool)
+    first[1:] = sent_ids[1:] != sent_ids[:-1]
+    is_phrase = (classes >= NP) & (classes <= PP)
+    anchor = np.where(is_phrase | first, np.arange(n), 0)
+    np.maximum.accumulate(anchor, out=anchor)
+    state = np.where(is_phrase[anchor], classes[anchor], NONE)
+
+    # A phrase starts where the state changes within a sentence; OTHER tokens
+    # before the first phrase of a sentence stay in the NONE state
+    previous = np.empty(n, dtype=state.dtype)
+    previous[:1] = NONE
+    previous[1:] = np.where(first[1:], NONE, state[:-1])
+    starts = (state != NONE) & (state != previous)
+    member = state != NONE
+    run_ids = np.cumsum(starts) - 1
+
+    start_idx = np.flatnonzero(starts)
+    lengths = np.bincount(run_ids[member], minlength=len(start_idx))
+    ends = positions[start_idx + lengths - 1] + 1
+    return Chunks(
+        types=state[start_idx].astype(np.int8),
+        starts=positions[start_idx],
+        ends=ends,
+        lengths=lengths,
+        sent_ids=sent_ids[start_idx],
+        clauses=clauses,
+    )
+
+def run_transitions(classes: Sequence[int]) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    Step the transition table over the token classes of one sentence.
+
+    Returns:
+        Tuple of ([(phrase type, length)], clause marker count)
+    """
+    phrases = []
+    clauses = 0
+    state = NONE
+    for cls in classes:
+        if cls == CLAUSE:
+            clauses += 1
+            continue
+        if STARTS[state, cls]:
+            phrases.append([cls, 0])
+        state = TRANSITIONS[state, cls]
+        if state != NONE:
+            phrases[-1][1] += 1
+    return [(int(t), length) for t, length in phrases], clauses
+
+def phrase_counts(chunks: Chunks, groups: np.ndarray, n_groups: int) -> dict:
+    """
+    Phrase counts and lengths per group of sentences.
+
+    Args:
+        chunks: Output of `chunk`
+        groups: Group id (e.g. document) of every sentence
+        n_groups: Number of groups
+
+    Returns:
+        Dict with '<type>_count' and '<type>_length' arrays for np/vp/pp and
+        'clauses' / 'clause_sentences' arrays, each of length n_groups
+    """
+    phrase_groups = groups[chunks.sent_ids]
+    result = {}
+    for phrase_type, name in PHRASE_NAMES.items():
+        selected = chunks.types == phrase_type
+        result[f'{name}_count'] = np.bincount(phrase_groups[selected], minlength=n_groups)
+        result[f'{name}_length'] = np.bincount(phrase_groups[selected], weights=chunks.lengths[selected],
+                                               minlength=n_groups).astype(np.int64)
+    result['clauses'] = np.bincount(groups, weights=chunks.clauses, minlength=n_groups).astype(np.int64)
+    result['clause_sentences'] = np.bincount(groups, weights=chunks.clauses > 0, minlength=n_groups).astype(np.int64)
+    return result
+
+def chunk_sentences(sentences: Iterable[Sequence[Tuple[str, str]]]) -> Tuple[Chunks, TokenArrays]:
+    """Encode and chunk per-sentence `(word, flag)` sequences."""
+    arrays = encode_sentences(sentences, with_words=False)
+    return chunk(arrays), arrays
+
+# Hand-written cases: tokens, expected (type, length) phrases and clause markers
+CASES = [
+    ([], [], 0),
+    ([('的', 'uj')], [], 0),
+    ([('然后', 'c'), ('很', 'd')], [], 1),
+    # A plain 'v' starts a verb phrase; it used to be folded into the NP
+    ([('法院', 'n'), ('判决', 'v')], [(NP, 1), (VP, 1)], 0),
+    ([('被告', 'n'), ('的', 'uj'), ('行为', 'n'), ('构成', 'v'), ('犯罪', 'vn')], [(NP, 3), (VP, 2)], 0),
+    ([('在', 'p'), ('北京', 'ns'), ('和', 'c'), ('上海', 'ns'), ('了', 'ul'), ('审理', 'v')],
+     [(PP, 1), (NP, 3), (VP, 1)], 1),
+    ([('已', 'd'), ('判决', 'v'), ('，', 'x'), ('如下', 'v'), ('判决', 'v'), ('本院', 'r')], [(VP, 4), (NP, 1)], 0),
+    ([('x', 'eng'), ('新标签', 'unknown_tag'), ('认为', 'v')], [(VP, 1)], 0),
+]
+
+# Three sentences of the test corpus with features 66-78 before and after the
+# verb fix (jieba's default dictionary). Only 66-69, 71 and 72 may change.
+CORPUS_TEXT = ('本院认为，平安银行福州分行与胡鸿杰、黄雪云、胡寿昌签订的《个人担保贷款合同》系双方真实意思表示，合法有效。'
+               '平安银行福州分行依胡鸿杰、黄雪云、胡寿昌的申请，向其发放贷款，已履行出借义务。'
+               '胡鸿杰、黄雪云、胡寿昌未按约还款，已构成违约，应承担违约责任。')
+FEATURES_BEFORE = {'66': 2.0, '67': 0.0, '68': 6.0, '69': 0.0, '70': 3.0, '71': 31 / 3, '72': 0.0,
+                   '73': 4 / 3, '74': 0.0, '75': 1.0, '76': 0.0, '77': 3.0, '78': 1.0}
+FEATURES_AFTER = {'66': 11 / 3, '67': 3.0, '68': 11.0, '69': 9.0, '70': 3.0, '71': 39 / 11, '72': 23 / 9,
+                  '73': 4 / 3, '74': 0.0, '75': 1.0, '76': 0.0, '77': 3.0, '78': 1.0}
+
+def main():
+    # Self-check: pinned phrases and clause counts on hand-written cases, the
+    # vectorised chunker against the transition table stepped token by token on
+    # the test corpus, and pinned features 66-78 on a corpus excerpt
+    import json
+    import os
+    import re
+    from ..segmentation_cache import cut_sentence
+    from .feature_66_to_78 import feature_66_to_78
+
+    chunks, _ = chunk_sentences([tokens for tokens, _, _ in CASES])
+    for sent_id, (tokens, expected, expected_clauses) in enumerate(CASES):
+        selected = chunks.sent_ids == sent_id
+        got = list(zip(chunks.types[selected].tolist(), chunks.lengths[selected].tolist()))
+        assert got == expected, (tokens, got, expected)
+        assert chunks.clauses[sent_id] == expected_clauses, (tokens, chunks.clauses[sent_id], expected_clauses)
+        assert run_transitions([token_class(flag) for _, flag in tokens]) == (expected, expected_clauses), tokens
+
+    features = {key: value for feature in feature_66_to_78(CORPUS_TEXT) for key, value in feature.items()}
+    for key, expected in FEATURES_AFTER.items():
+        assert abs(features[key] - expected) < 1e-9, (key, features[key], expected)
+    changed = sorted(key for key in FEATURES_AFTER if FEATURES_AFTER[key] != FEATURES_BEFORE[key])
+    assert changed == ['66', '67', '68', '69', '71', '72'], changed
+
+    cases = [tokens for tokens, _, _ in CASES]
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'test', 'restored_4001-4200.jsonl')
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in list(f)[:50]:
+                text = json.loads(line)['gold']
+                cases.extend(list(cut_sentence(s.strip())) for s in re.split(r'[。！？!?]', text) if s.strip())
+
+    chunks, arrays = chunk_sentences(cases)
+    for sent_id, tokens in enumerate(cases):
+        expected, expected_clauses = run_transitions([token_class(flag) for _, flag in tokens])
+        selected = chunks.sent_ids == sent_id
+        got = list(zip(chunks.types[selected].tolist(), chunks.lengths[selected].tolist()))
+        assert got == expected, (tokens, got, expected)
+        assert chunks.clauses[sent_id] == expected_clauses, (tokens, chunks.clauses[sent_id], expected_clauses)
+        offsets = np.flatnonzero(arrays.sent_ids == sent_id)
+        for start, end in zip(chunks.starts[selected], chunks.ends[selected]):
+            assert offsets[0] <= start < end <= offsets[-1] + 1
+    print(f"{len(CASES)} pinned cases and features 66-78 match; chunker agrees with the transition table "
+          f"on {len(cases)} sentences ({len(chunks.types)} phrases)")
+
+if __name__ == "__main__":
+    main()
@@ -12,162 +12,106 @@
 77	Average number of sentences per document（文档中句子的平均数量）	句法特征	统计文档中所有句子的数量，计算平均值
 78	Average height of parse tree per document（文档中语法解析树的平均高度）	句法特征	统计文档中每个句子的语法树高度，计算平均值'''
 
-import jieba
-import jieba.posseg as pseg
 from nltk import Tree
 from nltk.parse import CoreNLPParser
-from typing import List, Dict
-import re
+from typing import List, Dict, Tuple
+import numpy as np
+from ..context import default_context
+from ..segmentation_cache import cut_text
+from ..sentence_index import sentence_spans, sentences
+from ..token_arrays import encode_documents
+from .chunker import NP, VP, PP, chunk, phrase_counts, run_transitions, token_class
 
-def feature_66_to_78(text: str) -> List[Dict[str, float]]:
+def analyze_phrases(words) -> Tuple[int, int, int, int, int, int, int]:
     """
-    Extract syntactic features 66-78 from Chinese text.
+    Detect noun, verb and prepositional phrases and clause markers in one sentence.
     
     Args:
-        text (str): Input Chinese text
+        words: Iterable of (word, flag) pairs for the sentence
         
     Returns:
-        List[Dict[str, float]]: List of feature dictionaries, where each dictionary
-        contains a single feature value with its corresponding number as key
+        Tuple of (np_count, vp_count, pp_count, np_length, vp_length, pp_length, clause_count)
     """
-    # Split text into sentences (simple Chinese sentence splitting)
-    sentences = re.split(r'[。！？!?]', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
-    
-    # Initialize counters
-    total_np_count = 0
-    total_vp_count = 0
-    total_pp_count = 0
-    total_np_length = 0
-    total_vp_length = 0
-    total_pp_length = 0
-    sentences_with_clauses = 0
-    total_clauses = 0
-    total_tree_height = 0
+    phrases, clause_count = run_transitions([token_class(flag) for _, flag in words])
+    counts = {NP: 0, VP: 0, PP: 0}
+    lengths = {NP: 0, VP: 0, PP: 0}
+    for phrase_type, length in phrases:
+        counts[phrase_type] += 1
+        lengths[phrase_type] += length
+    return counts[NP], counts[VP], counts[PP], lengths[NP], lengths[VP], lengths[PP], clause_count
+
+def split_into_sentences(text: str) -> List[str]:
+    """Split text into sentences (simple Chinese sentence splitting)."""
+    return sentences(text, 'terminal_ascii')
+
+def feature_66_to_78_batch(texts: List[str], ctx=None) -> List[List[Dict[str, float]]]:
+    """
+    Extract syntactic features 66-78 for several texts with one chunker pass.
     
-    for sentence in sentences:
-        # Use jieba for word segmentation and POS tagging
-        words = pseg.cut(sentence)
-        
-        # Count phrases
-        np_count = 0
-        vp_count = 0
-        pp_count = 0
-        np_length = 0
-        vp_length = 0
-        pp_length = 0
-        clause_count = 0
-        
-        # Simple phrase detection based on POS tags
-        current_phrase = []
-        current_phrase_type = None
-        
-        for word, flag in words:
-            # Noun phrases (nouns and their modifiers)
-            if flag.startswith('n') or flag in ['a', 'b', 'f', 'm', 'q', 'r', 's', 't', 'v', 'z']:
-                if current_phrase_type != 'np':
-                    if current_phrase:
-                        if current_phrase_type == 'np':
-                            np_count += 1
-                            np_length += len(current_phrase)
-                        elif current_phrase_type == 'vp':
-                            vp_count += 1
-                            vp_length += len(current_phrase)
-                        elif current_phrase_type == 'pp':
-                            pp_count += 1
-                            pp_length += len(current_phrase)
-                    current_phrase = []
-                current_phrase_type = 'np'
-                current_phrase.append(word)
-            
-            # Verb phrases (verbs and their auxiliaries)
-            elif flag.startswith('v'):
-                if current_phrase_type != 'vp':
-                    if current_phrase:
-                        if current_phrase_type == 'np':
-                            np_count += 1
-                            np_length += len(current_phrase)
-                        elif current_phrase_type == 'vp':
-                            vp_count += 1
-                            vp_length += len(current_phrase)
-                        elif current_phrase_type == 'pp':
-                            pp_count += 1
-                            pp_length += len(current_phrase)
-                    current_phrase = []
-                current_phrase_type = 'vp'
-                current_phrase.append(word)
-            
-            # Prepositional phrases (prepositions and their objects)
-            elif flag == 'p':
-                if current_phrase_type != 'pp':
-                    if current_phrase:
-                        if current_phrase_type == 'np':
-                            np_count += 1
-                            np_length += len(current_phrase)
-                        elif current_phrase_type == 'vp':
-                            vp_count += 1
-                            vp_length += len(current_phrase)
-                        elif current_phrase_type == 'pp':
-                            pp_count += 1
-                            pp_length += len(current_phrase)
-                    current_phrase = []
-                current_phrase_type = 'pp'
-                current_phrase.append(word)
-            
-            # Clause detection (based on conjunctions and certain particles)
-            elif flag in ['c', 'u']:
-                clause_count += 1
-            
-            else:
-                if current_phrase:
-                    current_phrase.append(word)
-        
-        # Handle the last phrase
-        if current_phrase:
-            if current_phrase_type == 'np':
-                np_count += 1
-                np_length += len(current_phrase)
-            elif current_phrase_type == 'vp':
-                vp_count += 1
-                vp_length += len(current_phrase)
-            elif current_phrase_type == 'pp':
-                pp_count += 1
-                pp_length += len(current_phrase)
-        
-        # Update totals
-        total_np_count += np_count
-        total_vp_count += vp_count
-        total_pp_count += pp_count
-        total_np_length += np_length
-        total_vp_length += vp_length
-        total_pp_length += pp_length
-        total_clauses += clause_count
-        if clause_count > 0:
-            sentences_with_clauses += 1
+    Args:
+        texts (List[str]): Input Chinese texts
+        ctx: Extraction context providing tokenizers, caches and lexicons
+            (the process-wide default if None)
         
-        # Simple tree height estimation based on clause count
-        total_tree_height += clause_count + 1
+    Returns:
+        List[List[Dict[str, float]]]: Feature dictionaries of each text, as
+        returned by feature_66_to_78
+    """
+    ctx = ctx or default_context()
+    spans_per_text = [sentence_spans(text, 'terminal_ascii') for text in texts]
     
-    # Calculate averages and percentages
-    num_sentences = len(sentences)
+    # Chunk the sentences of all texts together, then group the counts by text
+    arrays = encode_documents(zip((cut_text(text, ctx.cache) for text in texts), spans_per_text), with_words=False)
+    chunks = chunk(arrays)
+    sentence_counts = np.array([len(spans) for spans in spans_per_text], dtype=np.int64)
+    groups = np.repeat(np.arange(len(texts)), sentence_counts)
+    totals = phrase_counts(chunks, groups, len(texts))
+    
+    results = []
+    for i, num_sentences in enumerate(sentence_counts.tolist()):
+        total_np_count = int(totals['np_count'][i])
+        total_vp_count = int(totals['vp_count'][i])
+        total_pp_count = int(totals['pp_count'][i])
+        total_np_length = int(totals['np_length'][i])
+        total_vp_length = int(totals['vp_length'][i])
+        total_pp_length = int(totals['pp_length'][i])
+        sentences_with_clauses = int(totals['clause_sentences'][i])
+        total_clauses = int(totals['clauses'][i])
+        # Simple tree height estimation based on clause count: clauses + 1 per sentence
+        total_tree_height = total_clauses + num_sentences
+        
+        results.append([
+            {'66': total_np_count / num_sentences if num_sentences > 0 else 0},  # Average NP per sentence
+            {'67': total_vp_count / num_sentences if num_sentences > 0 else 0},  # Average VP per sentence
+            {'68': float(total_np_count)},  # Total NP count
+            {'69': float(total_vp_count)},  # Total VP count
+            {'70': float(total_pp_count)},  # Total PP count
+            {'71': total_np_length / total_np_count if total_np_count > 0 else 0},  # Average NP length
+            {'72': total_vp_length / total_vp_count if total_vp_count > 0 else 0},  # Average VP length
+            {'73': total_pp_length / total_pp_count if total_pp_count > 0 else 0},  # Average PP length
+            {'74': sentences_with_clauses / num_sentences if num_sentences > 0 else 0},  # Average sentences with clauses
+            {'75': (num_sentences - sentences_with_clauses) / num_sentences if num_sentences > 0 else 0},  # Percentage of sentences without clauses
+            {'76': total_clauses / num_sentences if num_sentences > 0 else 0},  # Average clauses per sentence
+            {'77': float(num_sentences)},  # Average sentences per document
+            {'78': total_tree_height / num_sentences if num_sentences > 0 else 0}  # Average parse tree height
+        ])
     
-    features = [
-        {'66': total_np_count / num_sentences if num_sentences > 0 else 0},  # Average NP per sentence
-        {'67': total_vp_count / num_sentences if num_sentences > 0 else 0},  # Average VP per sentence
-        {'68': float(total_np_count)},  # Total NP count
-        {'69': float(total_vp_count)},  # Total VP count
-        {'70': float(total_pp_count)},  # Total PP count
-        {'71': total_np_length / total_np_count if total_np_count > 0 else 0},  # Average NP length
-        {'72': total_vp_length / total_vp_count if total_vp_count > 0 else 0},  # Average VP length
-        {'73': total_pp_length / total_pp_count if total_pp_count > 0 else 0},  # Average PP length
-        {'74': sentences_with_clauses / num_sentences if num_sentences > 0 else 0},  # Average sentences with clauses
-        {'75': (num_sentences - sentences_with_clauses) / num_sentences if num_sentences > 0 else 0},  # Percentage of sentences without clauses
-        {'76': total_clauses / num_sentences if num_sentences > 0 else 0},  # Average clauses per sentence
-        {'77': float(num_sentences)},  # Average sentences per document
-        {'78': total_tree_height / num_sentences if num_sentences > 0 else 0}  # Average parse tree height
-    ]
+    return results
+
+def feature_66_to_78(text: str, ctx=None) -> List[Dict[str, float]]:
+    """
+    Extract syntactic features 66-78 from Chinese text.
     
-    return features
+    Args:
+        text (str): Input Chinese text
+        ctx: Extraction context providing tokenizers, caches and lexicons
+            (the process-wide default if None)
+        
+    Returns:
+        List[Dict[str, float]]: List of feature dictionaries, where each dictionary
+        contains a single feature value with its corresponding number as key
+    """
+    return feature_66_to_78_batch([text], ctx)[0]
 
 def main():
     # Read example text
@@ -0,0 +1,165 @@
+'''Integer-encoded token arrays for vectorised POS feature computation.
+
+Tokens are encoded once per document into three parallel arrays: a tag id from
+a process-wide tag table, a word id from a per-document vocabulary and a
+sentence id. Category membership is a boolean lookup table indexed by tag id,
+so totals, unique counts and per-sentence averages reduce to `np.bincount` /
+`np.unique` over the arrays instead of per-token branching.'''
+
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from .sentence_index import span_ids, token_offsets
+
+# jieba's POS tag set, registered first so tag ids are stable across processes
+JIEBA_TAGS = [
+    'a', 'ad', 'ag', 'an', 'b', 'c', 'd', 'df', 'dg', 'e', 'eng', 'f', 'g', 'h', 'i', 'j', 'k', 'l',
+    'm', 'mg', 'mq', 'n', 'ng', 'nr', 'nrfg', 'nrt', 'ns', 'nt', 'nz', 'o', 'p', 'q', 'r', 'rg', 'rr',
+    'rz', 's', 't', 'tg', 'u', 'ud', 'ug', 'uj', 'ul', 'uv', 'uz', 'v', 'vd', 'vg', 'vi', 'vn', 'vq',
+    'x', 'y', 'z', 'zg',
+]
+
+TAGS: List[str] = list(JIEBA_TAGS)
+TAG_IDS: Dict[str, int] = {tag: i for i, tag in enumerate(TAGS)}
+_tag_lock = threading.Lock()
+
+def tag_id(flag: str) -> int:
+    """Id of a POS tag, registering tags outside the jieba tag set on first use."""
+    i = TAG_IDS.get(flag)
+    if i is None:
+        with _tag_lock:
+            i = TAG_IDS.get(flag)
+            if i is None:
+                i = len(TAGS)
+                TAGS.append(flag)
+                TAG_IDS[flag] = i
+    return i
+
+class TagCategory:
+    """
+    Boolean lookup table over tag ids for a category of POS tags.
+
+    Args:
+        predicate: Function deciding whether a tag string belongs to the category
+    """
+
+    def __init__(self, predicate: Callable[[str], bool]):
+        self.predicate = predicate
+        self.table = np.zeros(0, dtype=bool)
+
+    @classmethod
+    def of(cls, tags: Iterable[str]) -> 'TagCategory':
+        tags = frozenset(tags)
+        return cls(lambda tag: tag in tags)
+
+    def mask(self, tag_ids: np.ndarray) -> np.ndarray:
+        """Boolean mask of the tokens whose tag belongs to the category."""
+        if len(self.table) < len(TAGS):
+            self.table = np.fromiter((self.predicate(tag) for tag in list(TAGS)), dtype=bool)
+        return self.table[tag_ids]
+
+class TokenArrays(NamedTuple):
+    tag_ids: np.ndarray
+    word_ids: np.ndarray
+    sent_ids: np.ndarray
+    vocab: List[str]
+    n_sentences: int
+
+    def __len__(self) -> int:
+        return len(self.tag_ids)
+
+def encode_sentences(sentences: Iterable[Sequence[Tuple[str, str]]], with_words: bool = True) -> TokenArrays:
+    """
+    Encode per-sentence `(word, flag)` sequences into integer arrays.
+
+    Args:
+        sentences: One sequence of (word, flag) pairs per sentence
+        with_words: Build the vocabulary and word ids; callers that only look
+            at tags can skip it, leaving word_ids empty
+
+    Returns:
+        TokenArrays: tag ids, word ids (per-document vocabulary) and sentence ids
+    """
+    vocab: Dict[str, int] = {}
+    tags: List[int] = []
+    words: List[int] = []
+    lengths: List[int] = []
+    for tokens in sentences:
+        lengths.append(len(tokens))
+        tags.extend([TAG_IDS[flag] if flag in TAG_IDS else tag_id(flag) for _, flag in tokens])
+        if with_words:
+            words.extend([vocab.setdefault(word, len(vocab)) for word, _ in tokens])
+    return TokenArrays(
+        tag_ids=np.array(tags, dtype=np.int32),
+        word_ids=np.array(words, dtype=np.int64),
+        sent_ids=np.repeat(np.arange(len(lengths), dtype=np.int64), lengths),
+        vocab=list(vocab),
+        n_sentences=len(lengths),
+    )
+
+def encode_documents(documents: Iterable[Tuple[Sequence[Tuple[str, str]], np.ndarray]],
+                     with_words: bool = True) -> TokenArrays:
+    """
+    Encode whole-document segmentations, grouping tokens by sentence spans.
+
+    Args:
+        documents: (tokens, spans) per document, where tokens cover the whole
+            text and spans come from `sentence_spans`; tokens outside every
+            span are dropped and sentences are numbered across documents
+        with_words: Build the vocabulary and word ids
+
+    Returns:
+        TokenArrays: tag ids, word ids and sentence ids of the kept tokens
+    """
+    vocab: Dict[str, int] = {}
+    tags: List[int] = []
+    words: List[int] = []
+    sent_ids = []
+    n_sentences = 0
+    for tokens, spans in documents:
+        tags.extend([TAG_IDS[flag] if flag in TAG_IDS else tag_id(flag) for _, flag in tokens])
+        if with_words:
+            words.extend([vocab.setdefault(word, len(vocab)) for word, _ in tokens])
+        ids = span_ids(token_offsets(tokens), spans)
+        sent_ids.append(np.where(ids >= 0, ids + n_sentences, -1))
+        n_sentences += len(spans)
+    sent_ids = np.concatenate(sent_ids) if sent_ids else np.zeros(0, dtype=np.int64)
+    keep = sent_ids >= 0
+    return TokenArrays(
+        tag_ids=np.array(tags, dtype=np.int32)[keep],
+        word_ids=np.array(words, dtype=np.int64)[keep] if with_words else np.zeros(0, dtype=np.int64),
+        sent_ids=sent_ids[keep],
+        vocab=list(vocab),
+        n_sentences=n_sentences,
+    )
+
+def count_unique(arrays: TokenArrays, mask: np.ndarray) -> int:
+    """Number of distinct words among the masked tokens."""
+    return int(np.unique(arrays.word_ids[mask]).size)
+
+def per_sentence_counts(arrays: TokenArrays, mask: np.ndarray) -> np.ndarray:
+    """Number of masked tokens in each sentence."""
+    return np.bincount(arrays.sent_ids[mask], minlength=arrays.n_sentences)
+
+def per_sentence_unique(arrays: TokenArrays, mask: np.ndarray) -> np.ndarray:
+    """Number of distinct masked words in each sentence."""
+    pairs = np.unique(arrays.sent_ids[mask] * max(1, len(arrays.vocab)) + arrays.word_ids[mask])
+    return np.bincount(pairs // max(1, len(arrays.vocab)), minlength=arrays.n_sentences)
+
+def category_stats(arrays: TokenArrays, category: TagCategory) -> Dict[str, int]:
+    """
+    Totals of one category over a document.
+
+    Returns:
+        Dict with 'total' (tokens, which is also the sum of the per-sentence
+        counts), 'unique' (distinct words) and 'sentence_unique' (sum of the
+        per-sentence distinct words)
+    """
+    mask = category.mask(arrays.tag_ids)
+    return {
+        'total': int(np.count_nonzero(mask)),
+        'unique': count_unique(arrays, mask),
+        'sentence_unique': int(per_sentence_unique(arrays, mask).sum()),
+    }
@@ -0,0 +1,322 @@
+"""
+Local OpenAI-compatible stand-in server for offline pipeline runs and benchmarks.
+
+Serves `/v1/chat/completions` and `/v1/embeddings` with deterministic responses
+in the formats expected by `exp_train_parallel` (extract_examples) and
+`subjective_scoring` (construct_queries, score_generated), with configurable
+latency distributions and injected 500 / 429 failures.
+
+    python mock_openai_server.py --port 8765 --chat-latency lognormal:-2.5,0.5 --error-rate 0.01 --rate-limit-rate 0.02
+
+Point the scripts at it with BASE_URL / GENERATION_BASE_URL / EMBEDDING_BASE_URL
+set to http://127.0.0.1:8765/v1 and any API key.
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EXAMPLES_MARKER = "Extract positive and negative stylistic examples"
+QUERIES_PATTERN = re.compile(r"Generate (\d+) concise queries")
+SCORE_MARKER = "严格输出为JSON"
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution spec into a sampling function (seconds).
+
+    Supported specs: "constant:S", "uniform:LO,HI", "normal:MEAN,STD",
+    "lognormal:MU,SIGMA" (of the underlying normal) and "exponential:MEAN".
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',')] if params else []
+    if kind == 'constant':
+        return lambda rng: values[0] if values else 0.0
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if kind == 'exponential':
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def _digest(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _fragments(text, limit):
+    """Split a document into short clause-level fragments."""
+    parts = [p.strip() for p in re.split(r'[。！？；\n]', text) if p.strip()]
+    return [p[:60] for p in parts[:limit]]
+
+
+def _section(prompt, start, end=None):
+    head = prompt.find(start)
+    if head == -1:
+        return ''
+    head += len(start)
+    tail = prompt.find(end, head) if end else -1
+    return prompt[head:tail if tail != -1 else len(prompt)].strip()
+
+
+def examples_response(prompt, n_pairs):
+    """Deterministic extract_examples reply: aligned fragments of both documents."""
+    gold = _section(prompt, "Original document (positive example source):", "Restored document")
+    restored = _section(prompt, "Restored document (negative example source):", "Extraction requirements:")
+    positives = _fragments(gold, n_pairs)
+    negatives = _fragments(restored, n_pairs)
+    examples = [{"positive": pos, "negative": neg} for pos, neg in zip(positives, negatives)]
+    return json.dumps({"examples": examples}, ensure_ascii=False)
+
+
+def queries_response(prompt, x):
+    """Deterministic construct_queries reply: one query per line."""
+    generated = prompt.split('\n\n', 1)[1] if '\n\n' in prompt else prompt
+    fragments = _fragments(generated, x) or [generated[:30]]
+    return '\n'.join(f"{i + 1}. 查找与“{fragments[i % len(fragments)][:20]}”相关的用词和句式问题" for i in range(x))
+
+
+def score_response(prompt):
+    """Deterministic score_generated reply in the strict JSON format."""
+    generated = _section(prompt, "生成的文本：", "严格输出为JSON")
+    score = _digest(prompt) % 11
+    sample = generated[:20]
+    return json.dumps({"score": score, "reason": f"缺陷1:模型表现为“{sample}”……；打分：{score}分"}, ensure_ascii=False)
+
+
+def chat_content(prompt, n_pairs):
+    if EXAMPLES_MARKER in prompt:
+        return examples_response(prompt, n_pairs)
+    match = QUERIES_PATTERN.search(prompt)
+    if match:
+        return queries_response(prompt, int(match.group(1)))
+    if SCORE_MARKER in prompt:
+        return score_response(prompt)
+    return json.dumps({"echo": prompt[:200]}, ensure_ascii=False)
+
+
+def embed_text(text, dim):
+    """Deterministic unit embedding from hashed character bigrams."""
+    vec = np.zeros(dim)
+    grams = [text[i:i + 2] for i in range(max(1, len(text) - 1))]
+    for gram in grams:
+        h = _digest(gram)
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        vec[0] = 1.0
+        norm = 1.0
+    return (vec / norm).tolist()
+
+
+class MockStats:
+    """Thread-safe request log used by the benchmarks."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.requests = []
+
+    def record(self, endpoint, status, body_hash, started, finished):
+        with self.lock:
+            key = f"{endpoint}:{status}"
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.requests.append({"endpoint": endpoint, "status": status, "body_hash": body_hash,
+                                  "started": started, "finished": finished})
+
+    def snapshot(self):
+        with self.lock:
+            return {"counts": dict(self.counts), "requests": list(self.requests)}
+
+
+class MockOpenAIServer:
+    """
+    OpenAI-compatible stand-in server.
+
+    Args:
+        host (str): Bind address
+        port (int): Bind port, 0 picks a free port
+        chat_latency (str): Latency spec for chat completions, see parse_latency
+        embedding_latency (str): Latency spec for embeddings
+        error_rate (float): Probability of answering with HTTP 500
+        rate_limit_rate (float): Probability of answering with HTTP 429
+        retry_after_ms (int): retry-after-ms header sent with 429 responses
+        embedding_dim (int): Embedding dimension
+        n_pairs (int): Example pairs returned per extract_examples call
+        seed (int): Seed for latency and failure sampling
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, chat_latency='constant:0', embedding_latency='constant:0',
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after_ms=50, embedding_dim=1536, n_pairs=5, seed=42):
+        self.chat_latency = parse_latency(chat_latency)
+        self.embedding_latency = parse_latency(embedding_latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.embedding_dim = embedding_dim
+        self.n_pairs = n_pairs
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats = MockStats()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _sample(self, latency):
+        with self.rng_lock:
+            delay = latency(self.rng)
+            fault = self.rng.random()
+        if fault < self.rate_limit_rate:
+            return delay, 429
+        if fault < self.rate_limit_rate + self.error_rate:
+            return delay, 500
+        return delay, 200
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/stats'):
+                    self._send(200, server.stats.snapshot())
+                elif self.path.rstrip('/').endswith('/models'):
+                    self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                started = time.time()
+                length = int(self.headers.get('Content-Length', 0))
+                raw = self.rfile.read(length)
+                if self.path.rstrip('/').endswith('/reset'):
+                    server.stats.reset()
+                    self._send(200, {"ok": True})
+                    return
+                try:
+                    request = json.loads(raw or b'{}')
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "invalid JSON"}})
+                    return
+                if self.path.endswith('/chat/completions'):
+                    endpoint, latency, handler = 'chat', server.chat_latency, server.chat_completion
+                elif self.path.endswith('/embeddings'):
+                    endpoint, latency, handler = 'embeddings', server.embedding_latency, server.embeddings
+                else:
+                    self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                delay, status = server._sample(latency)
+                time.sleep(delay)
+                if status == 429:
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                               {"retry-after-ms": str(server.retry_after_ms)})
+                elif status == 500:
+                    self._send(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                else:
+                    self._send(200, handler(request))
+                body_hash = hashlib.blake2b(raw, digest_size=8).hexdigest()
+                server.stats.record(endpoint, status, body_hash, started, time.time())
+
+        return Handler
+
+    def chat_completion(self, request):
+        prompt = request.get('messages', [{}])[-1].get('content', '')
+        content = chat_content(prompt, self.n_pairs)
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        return {
+            "id": f"chatcmpl-{_digest(prompt):016x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'mock'),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content),
+                      "total_tokens": prompt_tokens + len(content)},
+        }
+
+    def embeddings(self, request):
+        inputs = request.get('input', [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [{"object": "embedding", "index": i, "embedding": embed_text(text, self.embedding_dim)}
+                for i, text in enumerate(inputs)]
+        tokens = sum(len(text) for text in inputs)
+        return {"object": "list", "data": data, "model": request.get('model', 'mock'),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    def start(self):
+        """Serve in a background daemon thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chat-latency', default='constant:0')
+    parser.add_argument('--embedding-latency', default='constant:0')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after-ms', type=int, default=50)
+    parser.add_argument('--embedding-dim', type=int, default=1536)
+    parser.add_argument('--n-pairs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(args.host, args.port, args.chat_latency, args.embedding_latency, args.error_rate,
+                              args.rate_limit_rate, args.retry_after_ms, args.embedding_dim, args.n_pairs, args.seed)
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
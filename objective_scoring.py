@@ -2,21 +2,40 @@ import json
 import os
 import numpy as np
 from sklearn.linear_model import LogisticRegression
-from linguistic_features.feature_extractor import extract_all_features
+from linguistic_features.feature_extractor import extract_all_features, extraction_fingerprint
+from linguistic_features.instrumentation import instrumentation_from_env
+from extraction_daemon import daemon_client
+from jsonl_index import iter_jsonl
+from shared_arrays import SharedArrays, attach
+from compiled_pool import CompiledPool, is_compiled_pool
+from feature_scaling import RunningMoments, model_normalization, normalization_entry, standardize
+from retrieval_cache import pool_version
+from score_stream import ScoreStream, file_digest
 from tqdm import tqdm
 from multiprocessing import Pool
 
 def load_experiences(file_path, N=None):
     experiences = []
-    with open(file_path, 'r') as f:
-        for i, line in enumerate(f):
-            if N is not None and i >= N:
-                break
-            exp = json.loads(line.strip())
-            for pair in exp.get('pair', []):
-                experiences.append(pair)
+    # The offset index lets each N ablation parse only its first N lines
+    for exp in iter_jsonl(file_path, 0, N):
+        for pair in exp.get('pair', []):
+            experiences.append(pair)
     return experiences
 
+def pool_pairs(exp_library, N=None):
+    """Positive and negative texts of the pairs in the first N lines of examples.jsonl or a compiled pool."""
+    if is_compiled_pool(exp_library):
+        pool = CompiledPool(exp_library)
+        m = pool.pair_count(N)
+        return [pool.positives[i] for i in range(m)], [pool.negatives[i] for i in range(m)]
+    experiences = load_experiences(exp_library, N)
+    return [pair['positive'] for pair in experiences], [pair['negative'] for pair in experiences]
+
+def pair_count(exp_library, N=None):
+    if is_compiled_pool(exp_library):
+        return CompiledPool(exp_library).pair_count(N)
+    return len(load_experiences(exp_library, N))
+
 def dict_features_to_array(features_list):
     feature_names = set()
     for features in features_list:
@@ -35,64 +54,227 @@ def dict_features_to_array(features_list):
     
     return X, feature_names
 
-def process(input_jsonl, output_dir, exp_library, N, k):
-    experiences = load_experiences(exp_library, N)
-    
-    positives = [pair['positive'] for pair in experiences]
-    negatives = [pair['negative'] for pair in experiences]
-    
-    all_texts = positives + negatives
-    labels = [1] * len(positives) + [0] * len(negatives)
-    
-    all_features = []
-    for text in tqdm(all_texts, desc="Extracting features"):
-        features = extract_all_features(text)
-        all_features.append(features)
-    
-    X, feature_names = dict_features_to_array(all_features)
-    y = np.array(labels)
-    
+def extract_features(texts, instrumentation=None, client=None, doc_ids=None, desc="Extracting features"):
+    if client is not None:
+        return client.features(texts)
+    features = []
+    for i, text in enumerate(tqdm(texts, desc=desc)):
+        doc_id = doc_ids[i] if doc_ids is not None else i
+        features.append(extract_all_features(text, instrumentation, doc_id=doc_id))
+    return features
+
+def features_to_matrix(features_list, feature_names):
+    X = np.zeros((len(features_list), len(feature_names)))
+    for i, features in enumerate(features_list):
+        flat_dict = {}
+        for d in features:
+            flat_dict.update(d)
+        for j, name in enumerate(feature_names):
+            X[i, j] = flat_dict.get(name, 0.0)
+    return X
+
+def load_test_samples(input_jsonl):
+    samples = []
+    with open(input_jsonl, 'r') as f_in:
+        for line in f_in:
+            data = json.loads(line.strip())
+            samples.append((data['index'], data['generated']))
+    return samples
+
+def fit_objective_model(X, y, feature_names, k):
+    """
+    L1 logistic regression ranking, then an unpenalised refit on the top k features.
+
+    Both fits use z-scored features, so the ranking does not depend on the
+    scale of each feature; the model JSON keeps the mean and scale of its
+    features under `normalization`.
+
+    Returns:
+        Tuple[dict, np.ndarray, LogisticRegression]: Model JSON data, column
+            indices of the top k features and the refitted model
+    """
+    moments = RunningMoments.from_array(X)
+    mean, scale = moments.mean, moments.scale
+    Z = standardize(X, mean, scale)
     lr = LogisticRegression(penalty='l1', solver='liblinear', random_state=42)
-    lr.fit(X, y)
+    lr.fit(Z, y)
     
     coef_abs = np.abs(lr.coef_[0])
     top_indices = np.argsort(coef_abs)[::-1][:k]
     top_features = [feature_names[i] for i in top_indices]
-    X_top = X[:, top_indices]
+    Z_top = Z[:, top_indices]
     
     lr_top = LogisticRegression(penalty=None, solver='lbfgs', random_state=42)
-    lr_top.fit(X_top, y)
+    lr_top.fit(Z_top, y)
     
     model_data = {
         "feature_names": top_features,
         "coefficients": lr_top.coef_[0].tolist(),
-        "intercept": lr_top.intercept_[0]
+        "intercept": lr_top.intercept_[0],
+        "normalization": normalization_entry(mean, scale, top_indices)
     }
+    return model_data, top_indices, lr_top
+
+def training_inputs(exp_library):
+    """Fingerprint of the training data of a pool: its files and the feature extraction code."""
+    return pool_version(exp_library, extraction_fingerprint())
+
+def score_settings(model_file, N, k, inputs=None):
+    """What the records of a scores file depend on: (N, k), the training inputs and the model JSON."""
+    return {"N": N, "k": k, "inputs": inputs, "model": file_digest(model_file)}
+
+def completed_stream(output_dir, N, k, test_index, inputs=None, resume=None):
+    """
+    The ScoreStream of (N, k) if an earlier run wrote the model and, with the
+    same settings, the score of every test sample (all counted as skipped),
+    else None.
+    """
     model_file = os.path.join(output_dir, f"model_N{N}_k{k}.json")
+    if not os.path.exists(model_file):
+        return None
+    stream = ScoreStream(os.path.join(output_dir, f"scores_N{N}_k{k}.jsonl"), resume,
+                         score_settings(model_file, N, k, inputs))
+    if not stream.resume or stream.pending(test_index):
+        return None
+    return stream
+
+def scores_complete(output_dir, N, k, test_index, inputs=None):
+    """Whether an earlier run wrote the model and, with the same settings, the score of every test sample of (N, k)."""
+    return completed_stream(output_dir, N, k, test_index, inputs) is not None
+
+def train_and_score(X, y, feature_names, X_test, test_index, output_dir, N, k, resume=None, inputs=None):
+    """
+    Fit the L1 selection and top-k models and write model and scores files.
+
+    Test samples already in the scores file are skipped (unless resume is
+    False or CLASE_RESUME=0), and so is the fit when none is missing. The
+    settings of the scores (see score_settings) are recorded next to them, and
+    a scores file written with other inputs or another model is rescored.
+
+    Args:
+        X (np.ndarray): Training features (positives then negatives)
+        y (np.ndarray): Labels of X
+        feature_names (list): Column names of X and X_test
+        X_test (np.ndarray): Features of the test samples
+        test_index (list): `index` of each test sample
+        output_dir (str): Directory for model_N{N}_k{k}.json and scores_N{N}_k{k}.jsonl
+        inputs (str): Fingerprint of the training data (see training_inputs)
+
+    Returns:
+        dict: Skipped / computed / failed record counts
+    """
+    stream = completed_stream(output_dir, N, k, test_index, inputs, resume)
+    if stream is not None:
+        return stream.summary()
+    model_file = os.path.join(output_dir, f"model_N{N}_k{k}.json")
+    output_file = os.path.join(output_dir, f"scores_N{N}_k{k}.jsonl")
+    model_data, top_indices, lr_top = fit_objective_model(X, y, feature_names, k)
+    mean, scale = model_normalization(model_data)
     with open(model_file, 'w', encoding='utf-8') as f:
         json.dump(model_data, f, ensure_ascii=False, indent=2)
-    
-    output_file = os.path.join(output_dir, f"scores_N{N}_k{k}.jsonl")
-    with open(input_jsonl, 'r') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
-        for line in f_in:
-            data = json.loads(line.strip())
-            generated = data['generated']
-            index = data['index']
-            
-            features = extract_all_features(generated)
-            flat_dict = {}
-            for d in features:
-                flat_dict.update(d)
-            
-            X_new = np.zeros((1, k))
-            for j, name in enumerate(top_features):
-                X_new[0, j] = flat_dict.get(name, 0.0)
-            
-            linear_pred = lr_top.intercept_[0] + np.dot(lr_top.coef_[0], X_new[0])
+
+    # The fit is deterministic, so a refit of the same inputs resumes the scores of the earlier one
+    with ScoreStream(output_file, resume, score_settings(model_file, N, k, inputs)) as stream:
+        pending = [i for i, index in enumerate(test_index) if not stream.done(index)]
+        for i in pending:
+            # Contiguous copy, so np.dot sums exactly as for a per-document vector
+            x_new = standardize(np.ascontiguousarray(X_test[i][top_indices]), mean, scale)
+            linear_pred = lr_top.intercept_[0] + np.dot(lr_top.coef_[0], x_new)
             reg_score = 1 / (1 + np.exp(-linear_pred))
-            
-            result = {"index": index, "reg_score": reg_score}
-            f_out.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+            result = {"index": test_index[i], "reg_score": reg_score}
+            stream.write(result)
+    return stream.summary()
+
+def load_training_data(exp_library, N, instrumentation=None, client=None):
+    """
+    Features and labels of the pairs in the first N pool lines: positives
+    (label 1) then negatives (label 0).
+
+    A compiled pool with features is read directly (float32 values);
+    otherwise the texts are extracted.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, list]: X, y and the feature names
+    """
+    if is_compiled_pool(exp_library):
+        pool = CompiledPool(exp_library)
+        if pool.pos_features is not None:
+            m = pool.pair_count(N)
+            X = np.vstack([pool.pos_features[:m], pool.neg_features[:m]]).astype(np.float64)
+            return X, np.array([1] * m + [0] * m), list(pool.feature_names)
+    positives, negatives = pool_pairs(exp_library, N)
+    
+    all_texts = positives + negatives
+    labels = [1] * len(positives) + [0] * len(negatives)
+    
+    all_features = extract_features(all_texts, instrumentation, client, [f"pool:{i}" for i in range(len(all_texts))])
+    X, feature_names = dict_features_to_array(all_features)
+    return X, np.array(labels), feature_names
+
+def process(input_jsonl, output_dir, exp_library, N, k, instrumentation=None, client=None):
+    """
+    Fit the N-line, k-feature model and score input_jsonl with it.
+
+    `instrumentation` (see instrumentation_from_env) is owned by the caller,
+    who creates it once for all its runs and closes it.
+    """
+    # Extract through the extraction daemon (warm dictionaries) when CLASE_DAEMON_URL names a matching one
+    if client is None:
+        client = daemon_client()
+    samples = load_test_samples(input_jsonl)
+    test_index = [index for index, _ in samples]
+    inputs = training_inputs(exp_library)
+    stream = completed_stream(output_dir, N, k, test_index, inputs)
+    if stream is not None:
+        # Scored by an earlier run: no need to extract the pool
+        return stream.summary()
+    X, y, feature_names = load_training_data(exp_library, N, instrumentation, client)
+    
+    test_features = extract_features([text for _, text in samples], instrumentation, client, test_index, "Scoring")
+    X_test = features_to_matrix(test_features, feature_names)
+    
+    return train_and_score(X, y, feature_names, X_test, test_index, output_dir, N, k, inputs=inputs)
+
+def publish_ablation_data(input_jsonl, exp_library, steps_N, instrumentation=None, client=None):
+    """
+    Extract the features needed by every (N, k) ablation once.
+
+    Features of the pairs in the first max(steps_N) lines and of the test
+    samples are put in shared memory; the N-line training set of an ablation
+    is the first pair_counts[N] rows of `positives` and `negatives`.
+
+    Returns:
+        Tuple[SharedArrays, dict]: The published arrays and the pool
+            initializer arguments (spec, pair counts, feature names, test index)
+    """
+    X, y, feature_names = load_training_data(exp_library, max(steps_N), instrumentation, client)
+    m = len(y) // 2
+    pair_counts = {N: pair_count(exp_library, N) for N in steps_N}
+    samples = load_test_samples(input_jsonl)
+    test_index = [index for index, _ in samples]
+    test_features = extract_features([text for _, text in samples], instrumentation, client, test_index, "Scoring")
+    shared = SharedArrays({
+        "positives": X[:m],
+        "negatives": X[m:],
+        "X_test": features_to_matrix(test_features, feature_names),
+    })
+    return shared, (shared.spec, pair_counts, feature_names, test_index)
+
+_ablation = {}
+
+def init_ablation_worker(spec, pair_counts, feature_names, test_index, output_dir, inputs=None):
+    _ablation.update(arrays=attach(spec), pair_counts=pair_counts, feature_names=feature_names,
+                     test_index=test_index, output_dir=output_dir, inputs=inputs)
+
+def run_ablation(args):
+    N, k = args
+    arrays, m = _ablation['arrays'], _ablation['pair_counts'][N]
+    # Same row order as process(): the N-line positives, then their negatives
+    X = np.vstack([arrays['positives'][:m], arrays['negatives'][:m]])
+    y = np.array([1] * m + [0] * m)
+    return train_and_score(X, y, _ablation['feature_names'], arrays['X_test'], _ablation['test_index'],
+                           _ablation['output_dir'], N, k, inputs=_ablation['inputs'])
 
 if __name__ == "__main__":
     input_jsonl = "data/test_samples.jsonl"
@@ -102,10 +284,21 @@ if __name__ == "__main__":
     steps_N = [100, 500, 1000, 2000, 4000]
     steps_k = [5, 10, 15, 20, 25, 30, 35, 40, 45, 50]
     
-    def run_ablation(args):
-        N, k = args
-        process(input_jsonl, output_dir, exp_library, N, k)
-    
-    combinations = [(N, k) for N in steps_N for k in steps_k]
-    with Pool(processes=5) as pool:
-        pool.map(run_ablation, combinations) 
\ No newline at end of file
+    # Combinations finished by an earlier run need neither features nor fits
+    test_index = [index for index, _ in load_test_samples(input_jsonl)]
+    inputs = training_inputs(exp_library)
+    combinations = [(N, k) for N in steps_N for k in steps_k if not scores_complete(output_dir, N, k, test_index, inputs)]
+    print(f"{len(steps_N) * len(steps_k) - len(combinations)} of {len(steps_N) * len(steps_k)} combinations already scored")
+    if not combinations:
+        raise SystemExit(0)
+    instrumentation = instrumentation_from_env()
+    try:
+        shared, initargs = publish_ablation_data(input_jsonl, exp_library, sorted({N for N, _ in combinations}),
+                                                 instrumentation, daemon_client())
+    finally:
+        if instrumentation is not None:
+            instrumentation.close()
+    with shared, Pool(processes=5, initializer=init_ablation_worker, initargs=initargs + (output_dir, inputs)) as pool:
+        summaries = pool.map(run_ablation, combinations)
+    print(f"{sum(s['computed'] for s in summaries)} scores computed, {sum(s['skipped'] for s in summaries)} skipped, "
+          f"{sum(s['failed'] for s in summaries)} failed over {len(combinations)} (N, k) combinations")
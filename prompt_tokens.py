@@ -0,0 +1,161 @@
+"""
+Local estimate of the prompt tokens of LLM calls.
+
+The judge prompts are Chinese with some ASCII (numbers, JSON, case numbers).
+Common CJK characters and full-width punctuation are about one token each in
+the OpenAI tokenizers, and ASCII runs about one token per four characters,
+so `count_tokens` counts them that way. It is a rough estimate that needs no
+tokenizer, good enough to compare prompt variants and to keep prompts within
+a budget.
+
+`pack_pairs` fits (positive, negative) examples into a token budget: pairs
+contained in another pair (both sides substrings of its sides) are dropped,
+then the others are taken in rank order while they fit. `window_text` cuts a
+text to a token budget, keeping its beginning and end.
+
+`TokenTally` collects the input tokens of each scored document (thread-safe,
+for the pipelined scorer), with what the packer dropped, and summarises them
+per document.
+"""
+
+import re
+import threading
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+_PIECES = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]|[A-Za-z]+|\d+|\S')
+ELISION = "\n……\n"
+
+Pair = Tuple[str, str]
+
+
+def _piece_tokens(piece: str) -> int:
+    if len(piece) == 1:
+        return 1
+    if piece[0].isdigit():
+        return -(-len(piece) // 3)
+    return -(-len(piece) // 4)
+
+
+def count_tokens(text: str) -> int:
+    """Estimated number of tokens of `text`."""
+    return sum(_piece_tokens(piece) for piece in _PIECES.findall(text))
+
+
+def window_text(text: str, max_tokens: int, marker: str = ELISION) -> Tuple[str, int]:
+    """
+    `text` cut to at most max_tokens: its first and last tokens (half the
+    budget each) around `marker`.
+
+    Returns:
+        Tuple[str, int]: The text and the number of tokens left out
+    """
+    pieces = [(m.start(), m.end(), _piece_tokens(m.group())) for m in _PIECES.finditer(text)]
+    total = sum(tokens for _, _, tokens in pieces)
+    if total <= max_tokens:
+        return text, 0
+    head_budget = max_tokens // 2
+    tail_budget = max(0, max_tokens - head_budget - count_tokens(marker))
+    head, head_end = 0, 0
+    for _, end, tokens in pieces:
+        if head + tokens > head_budget:
+            break
+        head, head_end = head + tokens, end
+    tail, tail_start = 0, len(text)
+    for start, _, tokens in reversed(pieces):
+        if tail + tokens > tail_budget:
+            break
+        tail, tail_start = tail + tokens, start
+    return text[:head_end] + marker + text[tail_start:], total - head - tail
+
+
+class Packing(NamedTuple):
+    """Examples packed into a prompt, and what was left out."""
+    pairs: List[Pair]
+    contained: int     # pairs dropped as contained in another pair
+    over_budget: int   # pairs dropped for lack of room
+    truncated: int = 0  # tokens of the judged text left out
+
+
+def drop_contained(pairs: Sequence[Pair]) -> List[Pair]:
+    """The pairs, without those whose positive and negative are both inside another pair's."""
+    return [(pos, neg) for pos, neg in pairs
+            if not any((pos, neg) != (other_pos, other_neg) and pos in other_pos and neg in other_neg
+                       for other_pos, other_neg in pairs)]
+
+
+def pack_pairs(pairs: Sequence[Pair], budget: int, cost: Callable[[Pair], int]) -> Packing:
+    """
+    Best-ranked pairs fitting in a token budget.
+
+    Args:
+        pairs: Candidate (positive, negative) pairs, best first
+        budget (int): Tokens available for the examples
+        cost (callable): Tokens a pair takes in the prompt
+
+    Returns:
+        Packing: The pairs kept, in rank order, and the counts dropped
+    """
+    candidates = drop_contained(pairs)
+    packed, used = [], 0
+    for pair in candidates:
+        tokens = cost(pair)
+        # Keep scanning: a shorter, lower-ranked pair may still fit
+        if used + tokens <= budget:
+            packed.append(pair)
+            used += tokens
+    return Packing(packed, len(pairs) - len(candidates), len(candidates) - len(packed))
+
+
+class TokenTally:
+    """Input tokens of the LLM calls of each scored document, and what packing left out."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents: List[int] = []
+        self.calls = 0
+        self.max_call = 0
+        self.packed = 0
+        self.kept = 0
+        self.contained = 0
+        self.over_budget = 0
+        self.truncated_calls = 0
+        self.truncated_tokens = 0
+
+    def add(self, tokens: List[int], packings: Optional[List[Packing]] = None) -> None:
+        """Record the input tokens of each call made for one document (and how its examples were packed)."""
+        with self.lock:
+            self.documents.append(sum(tokens))
+            self.calls += len(tokens)
+            self.max_call = max([self.max_call] + list(tokens))
+            for packing in packings or ():
+                self.packed += 1
+                self.kept += len(packing.pairs)
+                self.contained += packing.contained
+                self.over_budget += packing.over_budget
+                self.truncated_calls += packing.truncated > 0
+                self.truncated_tokens += packing.truncated
+
+    def summary(self) -> Dict:
+        with self.lock:
+            per_document = np.array(self.documents, dtype=np.float64)
+            return {
+                "documents": len(per_document),
+                "calls": self.calls,
+                "input_tokens": int(per_document.sum()),
+                "per_document": {
+                    "mean": float(per_document.mean()) if len(per_document) else 0.0,
+                    "p50": float(np.percentile(per_document, 50)) if len(per_document) else 0.0,
+                    "max": float(per_document.max()) if len(per_document) else 0.0,
+                },
+                "max_call": self.max_call,
+                "packing": {
+                    "calls": self.packed,
+                    "pairs_kept": self.kept,
+                    "dropped_contained": self.contained,
+                    "dropped_over_budget": self.over_budget,
+                    "truncated_calls": self.truncated_calls,
+                    "truncated_tokens": self.truncated_tokens,
+                } if self.packed else None,
+            }
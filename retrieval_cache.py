@@ -0,0 +1,233 @@
+"""
+Cache of query-to-retrieval results for subjective scoring.
+
+`construct_queries` asks similar questions about many documents (colloquial
+verbs, pronoun misuse, ...), each of which `find_top_pairs` would embed and
+search from scratch. The cache maps a normalised query (Unicode NFKC, case
+folded, whitespace collapsed, list numbering and trailing punctuation removed)
+and the search it was run with (y, number of experiences) to the ids of the
+pairs retrieved, so a repeated query costs neither an embedding request nor a
+search. Optionally, a query missing the exact entry is embedded and matched
+against the embeddings of the cached queries: one with cosine similarity at
+least `similarity` is treated as the same query (the embedding request is
+made, the search is not).
+
+The cache is a bounded LRU, thread-safe, and tied to one pool version (the
+files of the pool, the retrieval backend and its settings); `validate` drops
+every entry when the version changes.
+
+Configuration of the default cache:
+    CLASE_RETRIEVAL_CACHE_SIZE: maximum number of entries (default 10000, 0 disables the cache)
+    CLASE_RETRIEVAL_CACHE_SIMILARITY: near-duplicate threshold on query embeddings (exact matches only if unset)
+"""
+
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+_LIST_MARKER = re.compile(r'^(?:[-*•·]|\(?\d+[.)、．:]|[（(]\d+[）)]|[一二三四五六七八九十]+、)\s*')
+_EDGE_PUNCTUATION = '\'"“”‘’「」《》。.？?！!；;：:，,'
+
+Key = Tuple[str, int, int]
+
+
+def normalize_query(query: str) -> str:
+    """The form of a query the cache is keyed by."""
+    text = unicodedata.normalize('NFKC', query).casefold()
+    text = ' '.join(text.split())
+    text = _LIST_MARKER.sub('', text)
+    return text.strip(_EDGE_PUNCTUATION + ' ')
+
+
+def pool_version(exp_library: str, *settings) -> str:
+    """
+    Fingerprint of a pool and the retrieval settings its results depend on.
+
+    Covers the size and mtime of examples.jsonl, or of every file of a compiled
+    pool (so re-quantising its embeddings is a new version), plus `settings`
+    (backend, embedding model, re-rank depth, ...).
+    """
+    if os.path.isdir(exp_library):
+        paths = sorted(os.path.join(exp_library, name) for name in os.listdir(exp_library))
+        paths = [path for path in paths if os.path.isfile(path)]
+    else:
+        paths = [exp_library]
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(f"{os.path.basename(path)}:{os.path.getsize(path)}:{os.path.getmtime(path)}\n".encode())
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()
+
+
+class RetrievalCache:
+    """
+    Bounded LRU cache of retrieved pair ids.
+
+    Args:
+        maxsize (int): Maximum number of cached queries
+        similarity (float): Cosine similarity from which a query embedding
+            matches a cached one; None for exact (normalised text) matches only
+        version (str): Pool version the entries belong to
+    """
+
+    def __init__(self, maxsize: int = 10000, similarity: Optional[float] = None, version: Optional[str] = None):
+        self.maxsize = maxsize
+        self.similarity = similarity
+        self.version = version
+        self.entries: 'OrderedDict[Key, Tuple[Tuple[int, ...], Optional[int]]]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Query embeddings of the entries, one slot each (allocated on the first embedding)
+        self._vectors: Optional[np.ndarray] = None
+        self._slot_scope = np.full((maxsize, 2), -1, dtype=np.int64)
+        self._slot_key = [None] * maxsize
+        self._free = list(range(maxsize - 1, -1, -1))
+
+    @staticmethod
+    def key(query: str, y: int, limit: int) -> Key:
+        return normalize_query(query), y, limit
+
+    def validate(self, version: str) -> None:
+        """Drop every entry if the pool version changed."""
+        with self.lock:
+            if version != self.version:
+                if self.entries:
+                    self.invalidations += 1
+                self._reset()
+                self.version = version
+
+    def _reset(self) -> None:
+        self.entries.clear()
+        self._slot_scope[:] = -1
+        self._slot_key = [None] * self.maxsize
+        self._free = list(range(self.maxsize - 1, -1, -1))
+
+    def get(self, key: Key):
+        """Pair ids cached for the exact (normalised) query, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            return None
+
+    def get_similar(self, key: Key, embedding: np.ndarray):
+        """
+        Pair ids of the most similar cached query of the same search (y, limit),
+        if its similarity reaches the threshold; counts a miss otherwise.
+        """
+        with self.lock:
+            if self.similarity is not None and self._vectors is not None and len(embedding) == self._vectors.shape[1]:
+                q = _unit(embedding)
+                sims = self._vectors @ q
+                sims[(self._slot_scope[:, 0] != key[1]) | (self._slot_scope[:, 1] != key[2])] = -np.inf
+                best = int(np.argmax(sims))
+                if sims[best] >= self.similarity:
+                    match = self._slot_key[best]
+                    self.entries.move_to_end(match)
+                    self.near_hits += 1
+                    return self.entries[match][0]
+            self.misses += 1
+            return None
+
+    def miss(self) -> None:
+        """Count a lookup that found nothing (when get_similar was not consulted)."""
+        with self.lock:
+            self.misses += 1
+
+    def put(self, key: Key, ids, embedding: Optional[np.ndarray] = None) -> None:
+        """Cache the ids retrieved for a query, with its embedding for near-duplicate matches."""
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._release(self.entries.pop(key)[1])
+            slot = None
+            if self.similarity is not None and embedding is not None:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.maxsize, len(embedding)), dtype=np.float32)
+                if len(embedding) == self._vectors.shape[1]:
+                    if not self._free:
+                        self._evict()
+                    slot = self._free.pop()
+                    self._vectors[slot] = _unit(embedding)
+                    self._slot_scope[slot] = key[1], key[2]
+                    self._slot_key[slot] = key
+            self.entries[key] = _freeze(ids), slot
+            while len(self.entries) > self.maxsize:
+                self._evict()
+
+    def _evict(self) -> None:
+        _, (_, slot) = self.entries.popitem(last=False)
+        self._release(slot)
+        self.evictions += 1
+
+    def _release(self, slot: Optional[int]) -> None:
+        if slot is not None:
+            self._slot_scope[slot] = -1
+            self._slot_key[slot] = None
+            self._free.append(slot)
+
+    def clear(self) -> None:
+        """Drop every entry and reset the statistics."""
+        with self.lock:
+            self._reset()
+            self.hits = self.near_hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': (self.hits + self.near_hits) / lookups if lookups else 0.0,
+        }
+
+
+def _freeze(ids):
+    # Ids of one shared set, or of each aspect's sub-index
+    if isinstance(ids, dict):
+        return {aspect: _freeze(group) for aspect, group in ids.items()}
+    return tuple(int(i) for i in ids)
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+_default_cache: Optional[RetrievalCache] = None
+
+
+def get_cache() -> Optional[RetrievalCache]:
+    """Process-wide cache configured from CLASE_RETRIEVAL_CACHE_* variables (None if disabled)."""
+    global _default_cache
+    if _default_cache is None:
+        maxsize = int(os.getenv('CLASE_RETRIEVAL_CACHE_SIZE', '10000'))
+        if maxsize <= 0:
+            return None
+        similarity = os.getenv('CLASE_RETRIEVAL_CACHE_SIMILARITY')
+        _default_cache = RetrievalCache(maxsize, float(similarity) if similarity else None)
+    return _default_cache
+
+
+def set_cache(cache: Optional[RetrievalCache]) -> None:
+    """Replace the process-wide cache."""
+    global _default_cache
+    _default_cache = cache
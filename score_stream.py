@@ -0,0 +1,166 @@
+"""
+Resumable JSON lines output of the scoring scripts.
+
+A scores file is opened for append and the `index` of every complete record
+already in it is collected, so a rerun after a crash (or of a sweep of which
+some configurations finished) only scores the documents still missing. Each
+record is written with a single `write` to a file opened with O_APPEND and
+flushed, so a crash leaves at most one torn last line, which is cut off when
+the file is reopened.
+
+    with ScoreStream(output_file) as stream:
+        for index, text in samples:
+            if stream.done(index):
+                continue
+            stream.write({"index": index, ...})
+    print(stream.summary())
+
+Resuming is the default; CLASE_RESUME=0 truncates existing scores files instead.
+With `settings` (the models, ablation parameters, pool version, ... a record
+depends on), they are written to `<scores file>.settings.json` and a file whose
+recorded settings differ, or that has none, is started afresh instead of
+resumed, so records of other settings are never mixed in.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+
+def resume_enabled() -> bool:
+    """Whether scoring runs resume existing scores files (CLASE_RESUME, default 1)."""
+    return os.getenv('CLASE_RESUME', '1') not in ('0', 'false', 'no')
+
+
+def settings_path(path: str) -> str:
+    """Where the settings of the records of a scores file are recorded."""
+    return path + '.settings.json'
+
+
+def recorded_settings(path: str) -> Optional[Dict]:
+    """Settings recorded next to a scores file, or None if there are none (or they are unreadable)."""
+    try:
+        with open(settings_path(path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_digest(path: str) -> str:
+    """Digest of the content of a file, e.g. of the model a scores file was computed with."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def completed_indices(path: str, repair: bool = False) -> Set:
+    """
+    `index` values of the complete records of a scores file.
+
+    Args:
+        path (str): Scores file (missing files have no records)
+        repair (bool): Truncate a torn (unterminated) last line
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb') as f:
+        data = f.read()
+    done = set()
+    end = data.rfind(b'\n') + 1
+    for line in data[:end].splitlines():
+        try:
+            done.add(_key(json.loads(line)['index']))
+        except (ValueError, KeyError, TypeError):
+            continue
+    if repair and end < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    return done
+
+
+def _key(index):
+    # JSON turns tuples into lists; compare indices in a hashable form
+    return tuple(index) if isinstance(index, list) else index
+
+
+class ScoreStream:
+    """
+    Append-only scores file that skips documents already scored.
+
+    Args:
+        path (str): Scores file
+        resume (bool): Keep the records already in the file (default from
+            CLASE_RESUME); otherwise the file is truncated
+        settings (dict): JSON-serialisable settings the records depend on;
+            the file is only resumed if the same settings were recorded for it
+    """
+
+    def __init__(self, path: str, resume: Optional[bool] = None, settings: Optional[Dict] = None):
+        self.path = path
+        self.resume = resume_enabled() if resume is None else resume
+        self.settings = None if settings is None else json.loads(json.dumps(settings))
+        # Records written with other (or unrecorded) settings are rescored, not resumed
+        self.restarted = False
+        if self.resume and self.settings is not None and recorded_settings(path) != self.settings:
+            self.restarted = os.path.exists(path) and os.path.getsize(path) > 0
+            self.resume = False
+        self.completed = completed_indices(path, repair=True) if self.resume else set()
+        self.fd = None
+        self.skipped = 0
+        self.computed = 0
+        self.failures: List[Dict] = []
+
+    def __enter__(self) -> 'ScoreStream':
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND | (0 if self.resume else os.O_TRUNC)
+        self.fd = os.open(self.path, flags, 0o644)
+        if self.settings is not None:
+            tmp = settings_path(self.path) + f'.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.settings, f, ensure_ascii=False, indent=2, sort_keys=True)
+            os.replace(tmp, settings_path(self.path))
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def done(self, index) -> bool:
+        """Whether the document was scored by an earlier run (counted as skipped)."""
+        if _key(index) in self.completed:
+            self.skipped += 1
+            return True
+        return False
+
+    def pending(self, indices: Iterable) -> list:
+        """The indices not scored yet, counting the others as skipped."""
+        return [index for index in indices if not self.done(index)]
+
+    def write(self, record: Dict) -> None:
+        """Append one record as a single write."""
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        written = os.write(self.fd, line)
+        while written < len(line):
+            written += os.write(self.fd, line[written:])
+        self.completed.add(_key(record['index']))
+        self.computed += 1
+
+    def fail(self, index, error: BaseException) -> None:
+        """Record a document that could not be scored; a later run retries it."""
+        self.failures.append({"index": index, "error": f"{type(error).__name__}: {error}"})
+
+    def summary(self) -> Dict:
+        return {
+            "path": self.path,
+            "restarted": self.restarted,
+            "skipped": self.skipped,
+            "computed": self.computed,
+            "failed": len(self.failures),
+            "failures": self.failures,
+        }
@@ -0,0 +1,542 @@
+"""
+Sharded map-reduce feature extraction over hosts that share a filesystem.
+
+    # 1. Split the inputs into deterministic shards
+    python sharded_extraction.py plan --jsonl data/test/restored_4001-4200.jsonl:gold:1 \\
+        --jsonl data/test/restored_4001-4200.jsonl:generated:0 --txt-dir reason_txts:1 \\
+        --shards 64 --strategy bytes --out shards/
+
+    # 2. On every host, run any number of workers; each claims pending shards
+    python sharded_extraction.py work --plan shards/plan.json --claim
+
+    # 3. Validate every shard and concatenate the blocks into the training matrix
+    python sharded_extraction.py reduce --plan shards/plan.json --output features.npz
+
+Sources are JSONL files (`path:field[:label]`, one document per line) or
+directories of .txt files (`dir[:label]`). With `--strategy bytes` each source
+is cut into `--shards` equal byte ranges and a document belongs to the range
+containing its first byte (JSONL through the line index of jsonl_index, text
+directories over the sorted files laid end to end); with `--strategy hash` a
+document goes to blake2b(line bytes or file name) mod `--shards`. Either way
+every worker derives its documents from the plan alone. Source paths are
+resolved against the workers' working directory.
+
+A worker writes `shard-NNNNN.npz` (features, labels, document ids) and then
+`shard-NNNNN.manifest.json` (plan digest, row count, block checksum, per
+document errors, column moments); the manifest is the commit marker. Workers claim shards with
+exclusive `.claim` files (stale claims are taken over after `--claim-timeout`
+seconds) and record failed shards in `.failed.json`. `reduce` lists the missing
+and failed shards, which are then retried on their own with
+`work --retry-failed` or `work --shard K`.
+
+    # Self-check: several local workers, one killed mid-shard and retried,
+    # must reduce to the same matrix as a single-process extraction
+    python sharded_extraction.py check --documents 12 --shards 6
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from feature_scaling import RunningMoments
+from jsonl_index import JsonlIndex
+from linguistic_features.feature_extractor import extract_all_features
+from linguistic_features.instrumentation import instrumentation_from_env
+
+PLAN_VERSION = 2
+
+
+def _digest(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'big')
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _txt_files(directory: str) -> List[str]:
+    return sorted(f for f in os.listdir(directory) if f.endswith('.txt'))
+
+
+def parse_source(spec: str, kind: str) -> Dict:
+    """Parse a `path:field[:label]` (jsonl) or `dir[:label]` (txt_dir) source spec."""
+    parts = spec.split(':')
+    if kind == 'jsonl':
+        if len(parts) not in (2, 3):
+            raise ValueError(f"JSONL source must be path:field[:label], got {spec}")
+        path, field, label = parts[0], parts[1], parts[2] if len(parts) == 3 else None
+    else:
+        if len(parts) not in (1, 2):
+            raise ValueError(f"Text directory source must be dir[:label], got {spec}")
+        path, field, label = parts[0], None, parts[1] if len(parts) == 2 else None
+    return {"kind": kind, "path": path, "field": field, "label": int(label) if label is not None else -1}
+
+
+def describe_source(source: Dict) -> Dict:
+    """Source with the size fingerprint workers check before extracting."""
+    source = dict(source)
+    if source['kind'] == 'jsonl':
+        with JsonlIndex(source['path']) as records:
+            source['documents'] = len(records)
+        source['bytes'] = os.path.getsize(source['path'])
+    else:
+        files = _txt_files(source['path'])
+        source['documents'] = len(files)
+        source['bytes'] = sum(os.path.getsize(os.path.join(source['path'], f)) for f in files)
+    return source
+
+
+def make_plan(sources: List[Dict], n_shards: int, strategy: str, out_dir: str) -> Dict:
+    """
+    Shard plan for `sources`.
+
+    Args:
+        sources: Parsed source specs (see parse_source)
+        n_shards (int): Number of shards
+        strategy (str): 'bytes' or 'hash'
+        out_dir (str): Directory receiving the plan, blocks and manifests
+
+    Returns:
+        Dict: The plan, also written to out_dir/plan.json
+    """
+    if strategy not in ('bytes', 'hash'):
+        raise ValueError(f"Unknown shard strategy: {strategy}")
+    os.makedirs(out_dir, exist_ok=True)
+    plan = {
+        "version": PLAN_VERSION,
+        "strategy": strategy,
+        "n_shards": n_shards,
+        "sources": [describe_source(source) for source in sources],
+    }
+    plan['digest'] = plan_digest(plan)
+    _write_atomic(os.path.join(out_dir, 'plan.json'), json.dumps(plan, ensure_ascii=False, indent=2).encode('utf-8'))
+    return plan
+
+
+def plan_digest(plan: Dict) -> str:
+    body = {key: value for key, value in plan.items() if key != 'digest'}
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def load_plan(path: str) -> Dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if plan.get('version') != PLAN_VERSION or plan.get('digest') != plan_digest(plan):
+        raise ValueError(f"{path} is not a valid version {PLAN_VERSION} shard plan")
+    plan['dir'] = os.path.dirname(os.path.abspath(path))
+    return plan
+
+
+def _in_shard(start: int, total: int, shard: int, n_shards: int) -> bool:
+    return total * shard // n_shards <= start < total * (shard + 1) // n_shards
+
+
+def shard_documents(plan: Dict, shard: int) -> Iterator[Tuple[str, str, int]]:
+    """
+    Documents of one shard as (doc_id, text, label), in a deterministic order.
+
+    doc_id is `path:field:line` for JSONL sources and the file path for text
+    directories.
+
+    Raises:
+        ValueError: If a source no longer matches the fingerprint in the plan
+    """
+    n_shards, strategy = plan['n_shards'], plan['strategy']
+    for source in plan['sources']:
+        current = describe_source({key: source[key] for key in ('kind', 'path', 'field', 'label')})
+        if (current['documents'], current['bytes']) != (source['documents'], source['bytes']):
+            raise ValueError(f"Source {source['path']} changed since the plan was made")
+        path, label = source['path'], source['label']
+        if source['kind'] == 'jsonl':
+            with JsonlIndex(path) as records:
+                if strategy == 'bytes':
+                    lines = records.shard_range(shard, n_shards)
+                else:
+                    lines = (i for i in range(len(records)) if _digest(records.raw(i)) % n_shards == shard)
+                for i in lines:
+                    # The field is part of the id: a file may be a source once per field
+                    yield f"{path}:{source['field']}:{i}", records[i][source['field']], label
+        else:
+            offset = 0
+            for name in _txt_files(path):
+                file_path = os.path.join(path, name)
+                start, offset = offset, offset + os.path.getsize(file_path)
+                if strategy == 'bytes':
+                    if not _in_shard(start, source['bytes'], shard, n_shards):
+                        continue
+                elif _digest(name.encode('utf-8')) % n_shards != shard:
+                    continue
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    text = f.read().strip()
+                yield file_path, text, label
+
+
+def shard_paths(plan: Dict, shard: int) -> Dict[str, str]:
+    stem = os.path.join(plan['dir'], f"shard-{shard:05d}")
+    return {"block": stem + '.npz', "manifest": stem + '.manifest.json', "claim": stem + '.claim',
+            "failed": stem + '.failed.json'}
+
+
+def feature_row(features: List[Dict], feature_names: Optional[List[str]]) -> Tuple[np.ndarray, List[str]]:
+    flat = {}
+    for feature_dict in features:
+        flat.update(feature_dict)
+    # Same column order as dict_features_to_array in objective_scoring
+    names = feature_names or sorted(flat)
+    return np.array([flat.get(name, 0.0) for name in names], dtype=np.float64), names
+
+
+def run_shard(plan: Dict, shard: int, instrumentation=None) -> Dict:
+    """
+    Extract the features of one shard and write its block and manifest.
+
+    Documents whose extraction raises are left out of the block and listed
+    in the manifest's `errors`.
+
+    Returns:
+        Dict: The manifest
+    """
+    paths = shard_paths(plan, shard)
+    started = time.time()
+    rows, labels, doc_ids, errors = [], [], [], []
+    feature_names = None
+    for doc_id, text, label in shard_documents(plan, shard):
+        try:
+            features = extract_all_features(text, instrumentation, doc_id=doc_id)
+        except Exception as e:
+            errors.append({"doc_id": doc_id, "error": f"{type(e).__name__}: {e}"})
+            continue
+        row, feature_names = feature_row(features, feature_names)
+        rows.append(row)
+        labels.append(label)
+        doc_ids.append(doc_id)
+
+    feature_names = feature_names or []
+    X = np.vstack(rows) if rows else np.zeros((0, len(feature_names)))
+    tmp_block = f"{paths['block']}.{socket.gethostname()}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_block, X=X, y=np.array(labels, dtype=np.int64), doc_ids=np.array(doc_ids, dtype=str))
+    os.replace(tmp_block, paths['block'])
+
+    manifest = {
+        "shard": shard,
+        "plan_digest": plan['digest'],
+        "rows": len(rows),
+        "feature_names": feature_names,
+        "block": os.path.basename(paths['block']),
+        "sha256": _file_sha256(paths['block']),
+        "errors": errors,
+        # Mergeable column statistics, so training needs no extra pass for the z-scores
+        "moments": RunningMoments.from_array(X).to_dict(),
+        "host": socket.gethostname(),
+        "pid": os.getpid(),
+        "seconds": time.time() - started,
+    }
+    _write_atomic(paths['manifest'], json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    if os.path.exists(paths['failed']):
+        os.remove(paths['failed'])
+    return manifest
+
+
+def read_manifest(plan: Dict, shard: int) -> Optional[Dict]:
+    """Manifest of a shard if it belongs to this plan, else None."""
+    try:
+        with open(shard_paths(plan, shard)['manifest'], 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('plan_digest') == plan['digest'] else None
+
+
+def validate_shard(plan: Dict, shard: int) -> Optional[str]:
+    """Reason the shard cannot be reduced, or None if its manifest and block agree."""
+    manifest = read_manifest(plan, shard)
+    if manifest is None:
+        failed = shard_paths(plan, shard)['failed']
+        return "failed" if os.path.exists(failed) else "missing"
+    block = os.path.join(plan['dir'], manifest['block'])
+    if not os.path.exists(block):
+        return "block missing"
+    if _file_sha256(block) != manifest['sha256']:
+        return "block checksum mismatch"
+    return None
+
+
+def try_claim(plan: Dict, shard: int, claim_timeout: float) -> bool:
+    """Create the shard's claim file exclusively, taking over claims older than claim_timeout."""
+    claim = shard_paths(plan, shard)['claim']
+    for _ in range(2):
+        try:
+            fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(claim) < claim_timeout:
+                    return False
+                os.remove(claim)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{socket.gethostname()} {os.getpid()} {time.time()}\n")
+        return True
+    return False
+
+
+def release_claim(plan: Dict, shard: int) -> None:
+    try:
+        os.remove(shard_paths(plan, shard)['claim'])
+    except FileNotFoundError:
+        pass
+
+
+def pending_shards(plan: Dict, retry_failed: bool = False) -> List[int]:
+    """Shards without a manifest for this plan (and, unless retry_failed, without a failure record)."""
+    pending = []
+    for shard in range(plan['n_shards']):
+        if read_manifest(plan, shard) is not None:
+            continue
+        if not retry_failed and os.path.exists(shard_paths(plan, shard)['failed']):
+            continue
+        pending.append(shard)
+    return pending
+
+
+def work(plan: Dict, shards: Optional[List[int]] = None, claim: bool = False, retry_failed: bool = False,
+         claim_timeout: float = 3600.0) -> Dict[str, List[int]]:
+    """
+    Process shards: the given ones, or with `claim` every pending shard this
+    worker manages to claim.
+
+    Returns:
+        Dict: Lists of 'done' and 'failed' shard ids
+    """
+    instrumentation = instrumentation_from_env()
+    result = {"done": [], "failed": []}
+    candidates = shards if shards is not None else pending_shards(plan, retry_failed)
+    for shard in candidates:
+        if claim:
+            # Re-check: another worker may have finished it since the listing
+            if read_manifest(plan, shard) is not None or not try_claim(plan, shard, claim_timeout):
+                continue
+        try:
+            manifest = run_shard(plan, shard, instrumentation)
+            print(f"shard {shard}: {manifest['rows']} rows, {len(manifest['errors'])} errors, "
+                  f"{manifest['seconds']:.1f}s")
+            result['done'].append(shard)
+        except Exception as e:
+            failure = {"shard": shard, "plan_digest": plan['digest'], "host": socket.gethostname(),
+                       "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+            _write_atomic(shard_paths(plan, shard)['failed'], json.dumps(failure, indent=2).encode('utf-8'))
+            print(f"shard {shard}: FAILED {failure['error']}", file=sys.stderr)
+            result['failed'].append(shard)
+        finally:
+            if claim:
+                release_claim(plan, shard)
+    if instrumentation is not None:
+        instrumentation.close()
+    return result
+
+
+def reduce_shards(plan: Dict, output: str) -> Dict:
+    """
+    Validate every shard and concatenate the blocks in shard order.
+
+    Shards whose block is missing or does not match its manifest are marked
+    failed. Writes `output` (.npz with X, y, doc_ids, feature_names).
+
+    Raises:
+        RuntimeError: Listing the shards that are missing, failed or corrupt
+    """
+    problems = {shard: reason for shard in range(plan['n_shards'])
+                if (reason := validate_shard(plan, shard)) is not None}
+    for shard, reason in problems.items():
+        if reason.startswith('block'):
+            # Turn corrupt shards into failures so `work --retry-failed` redoes them
+            paths = shard_paths(plan, shard)
+            failure = {"shard": shard, "plan_digest": plan['digest'], "host": socket.gethostname(), "error": reason}
+            _write_atomic(paths['failed'], json.dumps(failure, indent=2).encode('utf-8'))
+            os.remove(paths['manifest'])
+    if problems:
+        listing = ', '.join(f"{shard} ({reason})" for shard, reason in sorted(problems.items()))
+        raise RuntimeError(f"{len(problems)} of {plan['n_shards']} shards not ready: {listing}")
+
+    blocks, feature_names, errors = [], None, 0
+    for shard in range(plan['n_shards']):
+        manifest = read_manifest(plan, shard)
+        if manifest['rows']:
+            if feature_names is not None and manifest['feature_names'] != feature_names:
+                raise RuntimeError(f"Shard {shard} has different feature columns")
+            feature_names = manifest['feature_names']
+        errors += len(manifest['errors'])
+        with np.load(os.path.join(plan['dir'], manifest['block'])) as block:
+            if len(block['X']) != manifest['rows']:
+                raise RuntimeError(f"Shard {shard} block has {len(block['X'])} rows, manifest {manifest['rows']}")
+            blocks.append((block['X'], block['y'], block['doc_ids']))
+
+    feature_names = feature_names or []
+    X = np.vstack([b[0] for b in blocks if len(b[0])]) if any(len(b[0]) for b in blocks) else np.zeros((0, len(feature_names)))
+    y = np.concatenate([b[1] for b in blocks])
+    doc_ids = np.concatenate([b[2] for b in blocks])
+    np.savez(output, X=X, y=y, doc_ids=doc_ids, feature_names=np.array(feature_names, dtype=str))
+    return {"rows": len(X), "features": len(feature_names), "shards": plan['n_shards'], "errors": errors}
+
+
+def _worker(plan_path: str, *args: str) -> subprocess.Popen:
+    command = [sys.executable, os.path.abspath(__file__), 'work', '--plan', plan_path, *args]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def self_check(corpus: str, documents: int = 12, n_shards: int = 6, workers: int = 2) -> Dict:
+    """
+    Run the plan / work / reduce flow with local worker processes and compare
+    the reduced matrix with a single-process extraction.
+
+    The first `documents` lines of `corpus` are planned twice (`gold` with
+    label 1, `generated` with label 0). A first worker is killed while it
+    holds a shard claim; `workers` more claim the rest, `reduce` must then
+    report the killed shard missing, and a retry that takes over the stale
+    claim completes it.
+
+    Raises:
+        AssertionError: If any step does not behave as described
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='sharded_check_')
+    try:
+        source = os.path.join(tmp_dir, 'source.jsonl')
+        with open(corpus, 'r', encoding='utf-8') as f_in, open(source, 'w', encoding='utf-8') as f_out:
+            for _, line in zip(range(documents), f_in):
+                f_out.write(line)
+        sources = [parse_source(f"{source}:gold:1", 'jsonl'), parse_source(f"{source}:generated:0", 'jsonl')]
+        make_plan(sources, n_shards, 'bytes', os.path.join(tmp_dir, 'shards'))
+        plan_path = os.path.join(tmp_dir, 'shards', 'plan.json')
+        plan = load_plan(plan_path)
+
+        # Kill the first worker as soon as it holds a claim on an unfinished shard
+        victim = _worker(plan_path, '--claim')
+        killed = None
+        while killed is None and victim.poll() is None:
+            for shard in range(n_shards):
+                paths = shard_paths(plan, shard)
+                if os.path.exists(paths['claim']) and not os.path.exists(paths['manifest']):
+                    victim.send_signal(signal.SIGKILL)
+                    killed = shard
+                    break
+            time.sleep(0.002)
+        victim.wait()
+        assert killed is not None, "the first worker finished before it could be killed"
+        assert read_manifest(plan, killed) is None, f"shard {killed} was committed before the kill"
+
+        # The others skip the freshly claimed shard and share the rest
+        for process in [_worker(plan_path, '--claim') for _ in range(workers)]:
+            assert process.wait() == 0, "a worker failed"
+        output = os.path.join(tmp_dir, 'features.npz')
+        try:
+            reduce_shards(plan, output)
+            raise AssertionError("reduce succeeded with a shard missing")
+        except RuntimeError as e:
+            assert f"{killed} (missing)" in str(e), str(e)
+
+        # Retry: take over the killed worker's stale claim
+        assert _worker(plan_path, '--shard', str(killed), '--claim', '--claim-timeout', '0').wait() == 0
+        assert not os.path.exists(shard_paths(plan, killed)['claim'])
+        summary = reduce_shards(plan, output)
+
+        reference = {}
+        for shard in range(n_shards):
+            for doc_id, text, label in shard_documents(plan, shard):
+                reference[doc_id] = (feature_row(extract_all_features(text), None), label)
+        with np.load(output) as reduced:
+            doc_ids = reduced['doc_ids'].tolist()
+            assert len(doc_ids) == len(set(doc_ids)) == 2 * documents, "document ids are not unique"
+            assert set(doc_ids) == set(reference)
+            for doc_id, row, label in zip(doc_ids, reduced['X'], reduced['y']):
+                (expected, names), expected_label = reference[doc_id]
+                assert names == reduced['feature_names'].tolist()
+                assert np.array_equal(row, expected) and label == expected_label, doc_id
+        return dict(summary, killed_shard=killed, workers=workers + 1)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded map-reduce feature extraction")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = commands.add_parser('plan', help="Split the inputs into shards")
+    plan_parser.add_argument('--jsonl', action='append', default=[], help="path:field[:label]")
+    plan_parser.add_argument('--txt-dir', action='append', default=[], help="dir[:label]")
+    plan_parser.add_argument('--shards', type=int, required=True)
+    plan_parser.add_argument('--strategy', choices=['bytes', 'hash'], default='bytes')
+    plan_parser.add_argument('--out', required=True, help="Directory for the plan, blocks and manifests")
+
+    work_parser = commands.add_parser('work', help="Extract the features of shards")
+    work_parser.add_argument('--plan', required=True)
+    work_parser.add_argument('--shard', type=int, action='append', help="Process this shard (repeatable)")
+    work_parser.add_argument('--claim', action='store_true', help="Claim and process pending shards")
+    work_parser.add_argument('--retry-failed', action='store_true', help="Include shards that failed before")
+    work_parser.add_argument('--claim-timeout', type=float, default=3600.0)
+
+    reduce_parser = commands.add_parser('reduce', help="Validate shards and build the training matrix")
+    reduce_parser.add_argument('--plan', required=True)
+    reduce_parser.add_argument('--output', required=True)
+
+    check_parser = commands.add_parser('check', help="Self-check with local worker processes")
+    check_parser.add_argument('--corpus', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               'data', 'test', 'restored_4001-4200.jsonl'))
+    check_parser.add_argument('--documents', type=int, default=12)
+    check_parser.add_argument('--shards', type=int, default=6)
+    check_parser.add_argument('--workers', type=int, default=2, help="Workers started after the killed one")
+
+    args = parser.parse_args()
+    if args.command == 'check':
+        summary = self_check(args.corpus, args.documents, args.shards, args.workers)
+        print(f"{summary['rows']} rows from {summary['shards']} shards and {summary['workers']} workers "
+              f"(shard {summary['killed_shard']} killed and retried) match a single-process extraction")
+    elif args.command == 'plan':
+        sources = ([parse_source(spec, 'jsonl') for spec in args.jsonl] +
+                   [parse_source(spec, 'txt_dir') for spec in args.txt_dir])
+        plan = make_plan(sources, args.shards, args.strategy, args.out)
+        total = sum(source['documents'] for source in plan['sources'])
+        print(f"Plan {plan['digest']}: {total} documents in {args.shards} shards -> {args.out}/plan.json")
+    elif args.command == 'work':
+        plan = load_plan(args.plan)
+        result = work(plan, args.shard, args.claim or args.shard is None, args.retry_failed, args.claim_timeout)
+        print(f"{len(result['done'])} shards done, {len(result['failed'])} failed")
+        sys.exit(1 if result['failed'] else 0)
+    else:
+        plan = load_plan(args.plan)
+        try:
+            summary = reduce_shards(plan, args.output)
+        except RuntimeError as e:
+            print(f"{e}\nRetry with: python sharded_extraction.py work --plan {args.plan} --retry-failed",
+                  file=sys.stderr)
+            sys.exit(1)
+        print(f"{summary['rows']} rows x {summary['features']} features from {summary['shards']} shards "
+              f"({summary['errors']} documents failed) -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Publish NumPy arrays once in shared memory for multiprocessing.Pool workers.
+
+The parent process copies each array into a `multiprocessing.shared_memory`
+segment and passes the small, picklable `spec` to the pool initializer; every
+worker attaches to the segments by name and gets read-only views, so the data
+exists once regardless of the number of workers.
+
+    with SharedArrays({"X": X, "y": y}) as shared:
+        with Pool(4, initializer=init_worker, initargs=(shared.spec,)) as pool:
+            pool.map(task, params)
+
+    def init_worker(spec):
+        global arrays
+        arrays = attach(spec)
+
+Attach only from processes started by the publisher: they share its resource
+tracker, which unlinks the segments if the publisher dies without closing them.
+Lists of strings can be shared the same way with `encode_strings` /
+`StringArray` (one UTF-8 blob plus an offsets array).
+"""
+
+from multiprocessing import shared_memory
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+Spec = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+
+class SharedArrays:
+    """
+    Owner of shared-memory copies of a set of named arrays.
+
+    Args:
+        arrays (dict): Name -> array to publish
+
+    Attributes:
+        spec: Picklable description (segment name, shape, dtype) for `attach`
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.segments: Dict[str, shared_memory.SharedMemory] = {}
+        self.spec: Spec = {}
+        try:
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                # Zero-size segments are not allowed
+                shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+                self.segments[key] = shm
+                np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+                self.spec[key] = (shm.name, array.shape, array.dtype.str)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Release and remove the segments; attached views become invalid."""
+        for shm in self.segments.values():
+            shm.close()
+            shm.unlink()
+        self.segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Segments attached by this process, kept open for the lifetime of the views
+_attached: Dict[str, shared_memory.SharedMemory] = {}
+
+
+def attach(spec: Spec) -> Dict[str, np.ndarray]:
+    """
+    Read-only views of published arrays.
+
+    Args:
+        spec: `SharedArrays.spec` of the publisher
+
+    Returns:
+        Dict[str, np.ndarray]: Name -> read-only array backed by shared memory
+    """
+    arrays = {}
+    for key, (name, shape, dtype) in spec.items():
+        shm = _attached.get(name)
+        if shm is None:
+            shm = _attached[name] = shared_memory.SharedMemory(name=name)
+        view = np.ndarray(shape, np.dtype(dtype), buffer=shm.buf)
+        view.flags.writeable = False
+        arrays[key] = view
+    return arrays
+
+
+def encode_strings(strings: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Strings as a UTF-8 blob and an offsets array (length n + 1).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: uint8 blob, int64 offsets
+    """
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+class StringArray:
+    """Sequence view of strings stored by `encode_strings`."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
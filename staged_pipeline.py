@@ -0,0 +1,207 @@
+"""
+Staged producer/consumer pipeline with bounded queues.
+
+Each stage has its own pool of worker threads reading from a bounded input
+queue, so stages with different costs and resources (chat calls, embedding
+calls, local search) overlap across items: while item i is in a slow stage,
+item i + 1 already runs the stages before it. Results are yielded in input
+order, whatever order they finish in, so a consumer can write them as an
+ordered stream.
+
+Each stage records its latency, the time its workers wait for input and the
+depth of its input queue; `metrics()` (callable while the pipeline runs)
+reports them with the utilisation of every stage, and the stage with the
+highest utilisation is the bottleneck.
+
+    pipeline = StagedPipeline([Stage('fetch', fetch, 8), Stage('parse', parse, 2)], queue_size=16)
+    for item, result, error in pipeline.run(items):
+        ...
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+_STOP = object()
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    Args:
+        name (str): Name used in the metrics
+        fn (callable): Function mapping the previous stage's output to this
+            stage's output (the first stage receives the input items)
+        workers (int): Number of threads running `fn` concurrently
+    """
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1):
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.reset()
+
+    def reset(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.waiting = 0.0
+        self.depths: List[int] = []
+
+    def record(self, latency: float, waited: float, failed: bool) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.waiting += waited
+            self.errors += failed
+
+    def metrics(self, elapsed: float) -> Dict:
+        with self.lock:
+            latencies = np.array(self.latencies)
+            depths = np.array(self.depths)
+            busy = float(latencies.sum())
+            return {
+                "workers": self.workers,
+                "items": len(latencies),
+                "errors": self.errors,
+                "latency": {
+                    "mean": float(latencies.mean()) if len(latencies) else 0.0,
+                    "p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+                    "p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+                },
+                "utilization": busy / (self.workers * elapsed) if elapsed > 0 else 0.0,
+                "input_wait": self.waiting,
+                "queue_depth": {
+                    "mean": float(depths.mean()) if len(depths) else 0.0,
+                    "max": int(depths.max()) if len(depths) else 0,
+                },
+            }
+
+
+class StagedPipeline:
+    """
+    Runs items through a sequence of stages, each with its own thread pool.
+
+    Args:
+        stages (List[Stage]): The stages, in order
+        queue_size (int): Capacity of each stage's input queue
+        max_in_flight (int): Items admitted but not yet yielded (bounds the
+            results held back to restore the input order); by default the
+            total number of workers and queue slots
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8, max_in_flight: Optional[int] = None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight or sum(stage.workers for stage in stages) + queue_size * len(stages)
+        self.started = None
+        self.finished = None
+
+    def run(self, items: Iterable) -> Iterator[Tuple[object, object, Optional[BaseException]]]:
+        """
+        Yield `(item, result, error)` for every item, in input order.
+
+        A stage raising for an item skips the remaining stages for that item,
+        whose error is yielded with a None result; other items are unaffected.
+        Closing the generator early stops admitting items and waits for those
+        in flight.
+        """
+        queues = [queue.Queue(self.queue_size) for _ in self.stages] + [queue.Queue()]
+        admitted = threading.Semaphore(self.max_in_flight)
+        abort = threading.Event()
+        for stage in self.stages:
+            stage.reset()
+        self.started, self.finished = time.perf_counter(), None
+
+        feed_errors = []
+
+        def feed():
+            try:
+                for seq, item in enumerate(items):
+                    admitted.acquire()
+                    if abort.is_set():
+                        break
+                    queues[0].put((seq, item, item, None))
+                    self.stages[0].depths.append(queues[0].qsize())
+            except Exception as e:
+                feed_errors.append(e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_STOP)
+
+        remaining = [stage.workers for stage in self.stages]
+
+        def work(i):
+            stage, inbox, outbox = self.stages[i], queues[i], queues[i + 1]
+            while True:
+                start = time.perf_counter()
+                message = inbox.get()
+                waited = time.perf_counter() - start
+                if message is _STOP:
+                    break
+                seq, item, value, error = message
+                start = time.perf_counter()
+                if error is None and not abort.is_set():
+                    try:
+                        value = stage.fn(value)
+                    except Exception as e:
+                        value, error = None, e
+                stage.record(time.perf_counter() - start, waited, error is not None and message[3] is None)
+                outbox.put((seq, item, value, error))
+                if i + 1 < len(self.stages):
+                    self.stages[i + 1].depths.append(outbox.qsize())
+            with stage.lock:
+                remaining[i] -= 1
+                last = remaining[i] == 0
+            if last:
+                # The last worker of a stage to finish stops the next stage
+                for _ in range(self.stages[i + 1].workers if i + 1 < len(self.stages) else 1):
+                    outbox.put(_STOP)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=work, args=(i,), daemon=True)
+                    for i, stage in enumerate(self.stages) for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        pending, next_seq, done = {}, 0, False
+        try:
+            while not done:
+                message = queues[-1].get()
+                if message is _STOP:
+                    done = True
+                    continue
+                pending[message[0]] = message
+                while next_seq in pending:
+                    _, item, value, error = pending.pop(next_seq)
+                    next_seq += 1
+                    admitted.release()
+                    yield item, value, error
+            if feed_errors:
+                raise feed_errors[0]
+        finally:
+            if not done:
+                abort.set()
+                while queues[-1].get() is not _STOP:
+                    admitted.release()
+                admitted.release()
+            for thread in threads:
+                thread.join()
+            self.finished = time.perf_counter()
+
+    def metrics(self) -> Dict:
+        """Per-stage metrics of the current (or last) run, and its bottleneck stage."""
+        if self.started is None:
+            return {}
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        stages = {stage.name: stage.metrics(elapsed) for stage in self.stages}
+        return {
+            "elapsed": elapsed,
+            "stages": stages,
+            "bottleneck": max(stages, key=lambda name: stages[name]["utilization"]) if stages else None,
+        }
@@ -0,0 +1,318 @@
+"""
+Out-of-core training of the objective model from feature blocks on disk.
+
+Reads the shard blocks written by sharded_extraction (or any .npz files with
+X, y) one at a time, so memory is bounded by the largest block instead of the
+pool size, and fits the same two-step model as objective_scoring: an L1
+logistic regression ranks the features, then an unpenalised logistic
+regression is refitted on the top k. Both steps solve the same objective as
+the in-memory fit (liblinear's C=1, i.e. alpha = 1/(C n) on the mean loss) on
+z-scored features by proximal Newton: each iteration sums the loss, gradient
+and Hessian over the blocks in one pass and solves the L1-penalised quadratic
+model in memory, until the subgradient is within a tolerance. The column
+moments come from the shard manifests when every shard recorded them,
+otherwise from a first pass over the blocks (feature_scaling.RunningMoments). The model JSON (feature_names,
+coefficients, intercept, normalization) is scored exactly like the in-memory
+one (objective_scoring, extraction_daemon).
+
+    python streaming_training.py --plan shards/plan.json --k 20 --output model.json --compare
+
+`--compare` also fits objective_scoring's in-memory model on the concatenated
+blocks (only sensible when they fit in memory) and reports the top-k overlap
+and the agreement of the two models' scores.
+"""
+
+import argparse
+import json
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from feature_scaling import RunningMoments, merge_moments, model_normalization, normalization_entry, standardize
+from sharded_extraction import load_plan, read_manifest, shard_paths
+
+
+def plan_blocks(plan_path: str) -> Tuple[List[str], List[str], Optional[RunningMoments]]:
+    """
+    Block files of a completed shard plan, their feature columns and the
+    column moments merged from the manifests (None if a manifest has none).
+
+    Raises:
+        RuntimeError: If a shard has no manifest or the columns differ
+    """
+    plan = load_plan(plan_path)
+    paths, feature_names, entries = [], None, []
+    for shard in range(plan['n_shards']):
+        manifest = read_manifest(plan, shard)
+        if manifest is None:
+            raise RuntimeError(f"Shard {shard} of {plan_path} is not done")
+        if not manifest['rows']:
+            continue
+        if feature_names is not None and manifest['feature_names'] != feature_names:
+            raise RuntimeError(f"Shard {shard} has different feature columns")
+        feature_names = manifest['feature_names']
+        paths.append(shard_paths(plan, shard)['block'])
+        entries.append(manifest.get('moments'))
+    return paths, feature_names or [], merge_moments(entries) if entries else None
+
+
+def iter_blocks(paths: List[str], order: Optional[np.ndarray] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """(X, y) of each block file, in `order` if given."""
+    for i in (order if order is not None else range(len(paths))):
+        with np.load(paths[i]) as block:
+            yield block['X'], block['y']
+
+
+class LogisticFit(NamedTuple):
+    """Coefficients of a logistic regression on standardised columns, and how the solver got there."""
+    coef: np.ndarray
+    intercept: float
+    passes: int
+    converged: bool
+
+
+def block_terms(paths: List[str], columns: np.ndarray, mean: np.ndarray, scale: np.ndarray,
+                weights: np.ndarray) -> Tuple[float, np.ndarray, np.ndarray, int]:
+    """
+    Mean logistic loss over the blocks, its gradient and Hessian, in one pass.
+
+    Args:
+        paths: .npz block files with X and y
+        columns: Columns of X the model uses
+        mean, scale: Standardisation of those columns
+        weights: Coefficients of the standardised columns, then the intercept
+
+    Returns:
+        Tuple of (loss, gradient, Hessian, rows)
+    """
+    d = len(columns) + 1
+    loss, grad, hess, n = 0.0, np.zeros(d), np.zeros((d, d)), 0
+    for X, y in iter_blocks(paths):
+        # Standardised columns plus a column of ones for the intercept
+        Z = np.empty((len(y), d))
+        Z[:, :-1] = X[:, columns]
+        Z[:, :-1] -= mean
+        Z[:, :-1] /= scale
+        Z[:, -1] = 1.0
+        del X
+        margin = Z @ weights
+        p = np.exp(-np.logaddexp(0.0, -margin))
+        loss += float(np.sum(np.logaddexp(0.0, margin) - y * margin))
+        grad += Z.T @ (p - y)
+        hess += (Z.T * (p * (1 - p))) @ Z
+        n += len(y)
+    n_rows = max(n, 1)
+    return loss / n_rows, grad / n_rows, hess / n_rows, n
+
+
+def newton_direction(grad: np.ndarray, hess: np.ndarray, weights: np.ndarray, penalty: np.ndarray,
+                     sweeps: int = 1000, tol: float = 1e-12) -> np.ndarray:
+    """
+    Minimiser d of the quadratic model grad.d + d.hess.d/2 plus penalty.|weights + d|,
+    by coordinate descent (a plain Newton step when nothing is penalised).
+    """
+    d = len(weights)
+    hess = hess + 1e-10 * np.eye(d)
+    if not penalty.any():
+        return -np.linalg.solve(hess, grad)
+    direction, hd = np.zeros(d), np.zeros(d)
+    for _ in range(sweeps):
+        largest = 0.0
+        for j in range(d):
+            g, h, u = grad[j] + hd[j], hess[j, j], weights[j] + direction[j]
+            if g + penalty[j] <= h * u:
+                delta = -(g + penalty[j]) / h
+            elif g - penalty[j] >= h * u:
+                delta = -(g - penalty[j]) / h
+            else:
+                delta = -u
+            if delta:
+                direction[j] += delta
+                hd += hess[:, j] * delta
+                largest = max(largest, abs(delta))
+        if largest < tol:
+            break
+    return direction
+
+
+def subgradient_norm(grad: np.ndarray, weights: np.ndarray, penalty: np.ndarray) -> float:
+    """Largest entry of the minimum-norm subgradient of loss + penalty.|weights| (0 at the optimum)."""
+    zero = np.sign(grad) * np.maximum(np.abs(grad) - penalty, 0)
+    sub = np.where(weights > 0, grad + penalty, np.where(weights < 0, grad - penalty, zero))
+    return float(np.max(np.abs(sub)))
+
+
+def fit_logistic(paths: List[str], columns: np.ndarray, mean: np.ndarray, scale: np.ndarray,
+                 C: Optional[float] = None, tol: float = 1e-6, max_iter: int = 100,
+                 init: Optional[LogisticFit] = None) -> LogisticFit:
+    """
+    Logistic regression on the standardised `columns` of the blocks, by
+    proximal Newton with a line search; each iteration is one pass over the
+    blocks, and each line search halving one more.
+
+    With C, minimises the mean logistic loss plus alpha * |coef, intercept|_1
+    with alpha = 1 / (C * rows): the objective of the liblinear L1 fit of
+    objective_scoring.fit_objective_model, whose intercept is penalised like
+    a coefficient. Without C, the unpenalised loss of its refit.
+
+    Args:
+        paths: .npz block files with X and y
+        columns: Columns of X the model uses
+        mean, scale: Standardisation of those columns
+        C (float): Inverse regularisation strength, None for no penalty
+        tol (float): Stop once no entry of the minimum-norm subgradient exceeds this
+        max_iter (int): Maximum Newton iterations
+        init: Fit to start from (e.g. of the same columns on fewer blocks)
+    """
+    weights = np.zeros(len(columns) + 1) if init is None else np.append(init.coef, init.intercept)
+    loss, grad, hess, n = block_terms(paths, columns, mean, scale, weights)
+    passes = 1
+    penalty = np.full(len(weights), 1.0 / (C * max(n, 1)) if C else 0.0)
+    objective = loss + penalty @ np.abs(weights)
+    converged = False
+    for _ in range(max_iter):
+        if subgradient_norm(grad, weights, penalty) <= tol:
+            converged = True
+            break
+        direction = newton_direction(grad, hess, weights, penalty)
+        decrease = grad @ direction + penalty @ (np.abs(weights + direction) - np.abs(weights))
+        step = 1.0
+        while True:
+            trial = weights + step * direction
+            terms = block_terms(paths, columns, mean, scale, trial)
+            passes += 1
+            trial_objective = terms[0] + penalty @ np.abs(trial)
+            if trial_objective <= objective + 0.01 * step * decrease or step < 1e-8:
+                break
+            step /= 2
+        if trial_objective > objective:
+            break
+        weights, objective = trial, trial_objective
+        loss, grad, hess, _ = terms
+    return LogisticFit(weights[:-1], float(weights[-1]), passes, converged)
+
+
+def top_k_columns(ranker: LogisticFit, k: int) -> np.ndarray:
+    """Columns with the k largest |coefficients| of a ranker fitted on standardised features."""
+    return np.argsort(np.abs(ranker.coef))[::-1][:k]
+
+
+def model_json(refit: LogisticFit, feature_names: List[str], top_indices: np.ndarray, mean: np.ndarray,
+               scale: np.ndarray) -> Dict:
+    """Model JSON data of a refit on the standardised top-k columns, with their normalization."""
+    return {
+        "feature_names": [feature_names[i] for i in top_indices],
+        "coefficients": refit.coef.tolist(),
+        "intercept": refit.intercept,
+        "normalization": normalization_entry(mean, scale, top_indices),
+    }
+
+
+def fit_streaming(paths: List[str], feature_names: List[str], k: int, C: float = 1.0, tol: float = 1e-6,
+                  max_iter: int = 100, moments: Optional[RunningMoments] = None) -> Dict:
+    """
+    Fit the top-k objective model from block files.
+
+    Args:
+        paths: .npz block files with X (rows x len(feature_names)) and y
+        feature_names: Column names of the blocks
+        k (int): Number of features kept for the refit
+        C (float): Inverse L1 regularisation strength of the ranking fit
+            (liblinear's C; 1 as in fit_objective_model)
+        tol (float): Subgradient tolerance of both fits
+        max_iter (int): Maximum Newton iterations of each fit
+        moments: Column moments of the blocks if already known (e.g. merged
+            from shard manifests); otherwise computed in a first pass
+
+    Returns:
+        Dict: Model JSON data (feature_names, coefficients, intercept,
+            normalization)
+    """
+    if moments is None:
+        moments = RunningMoments(len(feature_names))
+        for X, _ in iter_blocks(paths):
+            moments.update(X)
+    mean, scale = moments.mean, moments.scale
+
+    ranker = fit_logistic(paths, np.arange(len(feature_names)), mean, scale, C, tol, max_iter)
+    top_indices = top_k_columns(ranker, k)
+    refit = fit_logistic(paths, top_indices, mean[top_indices], scale[top_indices], None, tol, max_iter)
+    return model_json(refit, feature_names, top_indices, mean, scale)
+
+
+def model_scores(model: Dict, X: np.ndarray, feature_names: List[str]) -> np.ndarray:
+    """Sigmoid scores of the rows of X (columns named by feature_names) under a model JSON."""
+    columns = [feature_names.index(name) for name in model['feature_names']]
+    mean, scale = model_normalization(model)
+    linear_pred = model['intercept'] + standardize(X[:, columns], mean, scale) @ np.array(model['coefficients'])
+    return 1 / (1 + np.exp(-linear_pred))
+
+
+def compare_models(a: Dict, b: Dict, paths: List[str], feature_names: List[str]) -> Dict:
+    """
+    Agreement of two model JSONs over the block files, computed block by block.
+
+    Returns:
+        Dict: top-k overlap, fraction of equal 0.5-threshold labels, Pearson
+            correlation of the scores and each model's accuracy
+    """
+    n = agree = correct_a = correct_b = 0
+    sums = np.zeros(5)  # sa, sb, sa^2, sb^2, sa*sb
+    for X, y in iter_blocks(paths):
+        sa, sb = model_scores(a, X, feature_names), model_scores(b, X, feature_names)
+        n += len(y)
+        agree += int(np.sum((sa >= 0.5) == (sb >= 0.5)))
+        correct_a += int(np.sum((sa >= 0.5) == (y == 1)))
+        correct_b += int(np.sum((sb >= 0.5) == (y == 1)))
+        sums += [sa.sum(), sb.sum(), np.dot(sa, sa), np.dot(sb, sb), np.dot(sa, sb)]
+    mean_a, mean_b = sums[0] / max(n, 1), sums[1] / max(n, 1)
+    cov = sums[4] / max(n, 1) - mean_a * mean_b
+    var_a, var_b = sums[2] / max(n, 1) - mean_a ** 2, sums[3] / max(n, 1) - mean_b ** 2
+    top_a, top_b = set(a['feature_names']), set(b['feature_names'])
+    return {
+        "rows": n,
+        "topk_overlap": len(top_a & top_b) / max(len(top_a), 1),
+        "label_agreement": agree / max(n, 1),
+        "score_correlation": float(cov / np.sqrt(var_a * var_b)) if var_a > 0 and var_b > 0 else 0.0,
+        "accuracy": [correct_a / max(n, 1), correct_b / max(n, 1)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Out-of-core objective model training from feature blocks")
+    parser.add_argument('--plan', help="Completed sharded_extraction plan.json")
+    parser.add_argument('--blocks', nargs='+', help="Block .npz files (X, y) instead of a plan")
+    parser.add_argument('--feature-names', help="JSON list of block columns (with --blocks)")
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--C', type=float, default=1.0, help="Inverse L1 regularisation strength of the ranking fit")
+    parser.add_argument('--tol', type=float, default=1e-6, help="Subgradient tolerance of the fits")
+    parser.add_argument('--max-iter', type=int, default=100, help="Maximum Newton iterations of each fit")
+    parser.add_argument('--output', required=True, help="Model JSON file")
+    parser.add_argument('--compare', action='store_true', help="Also fit in memory and report agreement")
+    args = parser.parse_args()
+
+    if args.plan:
+        paths, feature_names, moments = plan_blocks(args.plan)
+    else:
+        moments = None
+        paths = args.blocks
+        with open(args.feature_names, 'r', encoding='utf-8') as f:
+            feature_names = json.load(f)
+
+    model = fit_streaming(paths, feature_names, args.k, args.C, args.tol, args.max_iter, moments)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, indent=2)
+    print(f"Streaming model on {len(paths)} blocks -> {args.output}")
+
+    if args.compare:
+        from objective_scoring import fit_objective_model
+        blocks = list(iter_blocks(paths))
+        X = np.vstack([X for X, _ in blocks])
+        y = np.concatenate([y for _, y in blocks])
+        reference, _, _ = fit_objective_model(X, y, feature_names, args.k)
+        report = compare_models(model, reference, paths, feature_names)
+        print(json.dumps({"streaming_vs_in_memory": report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,26 +4,144 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from openai import OpenAI
 from dotenv import load_dotenv
+from jsonl_index import iter_jsonl
+from shared_arrays import SharedArrays, StringArray, attach, encode_strings
+from compiled_pool import CompiledPool, is_compiled_pool
+from embedding_index import EmbeddingIndex
+from lexical_index import load_index
+from retrieval_cache import get_cache, pool_version
+from staged_pipeline import Stage, StagedPipeline
+from score_stream import ScoreStream
+from aspect_tagging import aspect_rows, load_tags
+from prompt_tokens import TokenTally, count_tokens, pack_pairs, window_text
 
 load_dotenv()
 
+ASPECTS = {
+    "noun": {"name": "名词", "desc": "评估名词的使用是否准确、专业且符合法律文体"},
+    "verb": {"name": "动词", "desc": "评估动词的选择是否精确、正式，避免口语化表达"},
+    "adjective": {"name": "形容词", "desc": "评估形容词的使用是否适度、中立，避免主观情感色彩"},
+    "small_words": {"name": "小词（数词、量词、代词、副词、介词、助词）", "desc": "评估这些功能词是否规范、简洁，避免冗余或不当使用"},
+    "sentence_coherence": {"name": "句子衔接连贯", "desc": "评估句子间逻辑连接是否顺畅、条理清晰"},
+    "sentence_structure": {"name": "句子结构", "desc": "评估句子结构是否复杂适当、符合法律文书的规范"},
+    "intra_sentence_collocation": {"name": "句内搭配", "desc": "评估句内词语搭配是否自然、准确，避免搭配错误"}
+}
+
+SCORING_STAGES = ('queries', 'embed', 'search', 'judge')
+
 def compute_embedding(text, client, model_name):
     response = client.embeddings.create(input=[text], model=model_name)
     return np.array(response.data[0].embedding)
 
+def iter_pairs(file_path, N=None):
+    # The offset index lets each N ablation parse only its first N lines
+    for exp in iter_jsonl(file_path, 0, N):
+        yield from exp.get('pair', [])
+
+def retrieval_backend():
+    """`embedding` (default) or `bm25`, the local index that needs no embedding API (CLASE_RETRIEVAL)."""
+    backend = os.getenv('CLASE_RETRIEVAL', 'embedding')
+    if backend not in ('embedding', 'bm25'):
+        raise ValueError(f"CLASE_RETRIEVAL must be embedding or bm25, got {backend}")
+    return backend
+
+def scoring_stages():
+    """
+    Worker threads per stage of the pipelined scorer, from CLASE_SCORING_STAGES
+    (e.g. "queries=4,embed=4,search=1,judge=8"; stages left out get one
+    worker), or None to score documents one after the other (the default).
+    """
+    spec = os.getenv('CLASE_SCORING_STAGES')
+    if not spec:
+        return None
+    workers = dict.fromkeys(SCORING_STAGES, 1)
+    for part in spec.split(','):
+        name, _, count = part.partition('=')
+        if name.strip() not in workers:
+            raise ValueError(f"Unknown scoring stage {name.strip()}, expected one of {SCORING_STAGES}")
+        workers[name.strip()] = int(count)
+    return workers
+
+def prompt_budget():
+    """
+    Estimated input tokens allowed per judge call (CLASE_PROMPT_BUDGET), or
+    None to show every retrieved pair and the whole text (the default).
+    """
+    budget = os.getenv('CLASE_PROMPT_BUDGET')
+    return int(budget) if budget else None
+
+def aspect_retrieval():
+    """
+    Whether each aspect's examples come from its own sub-index of the pairs
+    tagged with it (CLASE_ASPECT_RETRIEVAL=1) instead of one shared set.
+    """
+    return os.getenv('CLASE_ASPECT_RETRIEVAL', '0') not in ('0', '')
+
+def embedding_rerank():
+    """Shortlist size re-ranked in float32 after a quantised search (CLASE_EMBEDDING_RERANK, 0: off)."""
+    return int(os.getenv('CLASE_EMBEDDING_RERANK', '0'))
+
+def retrieval_cache(exp_library, embedding_model):
+    """
+    The process-wide retrieval cache, emptied if the pool or the retrieval
+    settings changed since it was filled (None if CLASE_RETRIEVAL_CACHE_SIZE=0).
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.validate(pool_version(exp_library, retrieval_backend(), embedding_model, embedding_rerank(),
+                                    aspect_retrieval()))
+    return cache
+
+def check_pool_embeddings(pool, embedding_model=None):
+    """Raise ValueError unless a compiled pool has negative embeddings (of embedding_model, if given)."""
+    if pool.neg_embeddings is None:
+        raise ValueError(f"{pool.directory} was compiled without embeddings (build --embedding-model)")
+    if embedding_model is not None and pool.meta['embedding_model'] != embedding_model:
+        raise ValueError(f"{pool.directory} holds {pool.meta['embedding_model']} embeddings, not {embedding_model}")
+
+def load_compiled_experiences(pool_dir, N=None, embedding_model=None):
+    """
+    Experiences of the first N lines of a compiled pool with negative
+    embeddings, read from its memory-mapped arrays.
+    """
+    pool = CompiledPool(pool_dir)
+    check_pool_embeddings(pool, embedding_model)
+    return SharedExperiences(with_aspect_tags(pool.arrays, pool_dir), pool.pair_count(N), embedding_rerank())
+
+def with_aspect_tags(arrays, exp_library, n=None):
+    """The arrays, plus the pool's aspect tags (of the first n pairs) when aspect retrieval is on."""
+    if not aspect_retrieval():
+        return arrays
+    return dict(arrays, aspect_tags=load_tags(exp_library)[:n])
+
+def load_lexical_experiences(file_path, N=None):
+    """Experiences of the first N pool lines, retrieved through the pool's persisted BM25 index."""
+    index = load_index(file_path)
+    if is_compiled_pool(file_path):
+        pool = CompiledPool(file_path)
+        return SharedExperiences(with_aspect_tags(pool.arrays, file_path), pool.pair_count(N), lexical_index=index)
+    pairs = list(iter_pairs(file_path, N))
+    pos_blob, pos_offsets = encode_strings(pair['positive'] for pair in pairs)
+    neg_blob, neg_offsets = encode_strings(pair['negative'] for pair in pairs)
+    arrays = {"pos_blob": pos_blob, "pos_offsets": pos_offsets, "neg_blob": neg_blob, "neg_offsets": neg_offsets}
+    return SharedExperiences(with_aspect_tags(arrays, file_path, len(pairs)), len(pairs), lexical_index=index)
+
 def load_experiences(file_path, N=None, client=None, embedding_model=None):
-    experiences = []
-    with open(file_path, 'r') as f:
-        for i, line in enumerate(f):
-            if N is not None and i >= N:
-                break
-            exp = json.loads(line.strip())
-            for pair in exp.get('pair', []):
-                experiences.append(pair)
-    
+    if retrieval_backend() == 'bm25':
+        return load_lexical_experiences(file_path, N)
+    if is_compiled_pool(file_path):
+        return load_compiled_experiences(file_path, N, embedding_model)
+    experiences = list(iter_pairs(file_path, N))
+    embed_negatives(experiences, client, embedding_model)
+    if aspect_retrieval():
+        for exp, tags in zip(experiences, load_tags(file_path).tolist()):
+            exp['aspect_tags'] = tags
+    return experiences
+
+def embed_negatives(experiences, client, embedding_model):
+    """Add the `neg_embedding` of every experience."""
     for exp in experiences:
         exp['neg_embedding'] = compute_embedding(exp['negative'], client, embedding_model)
-    return experiences
 
 def construct_queries(generated, x, model_name, client):
     prompt = f"Generate {x} concise queries to extract potential errors in legal language style (word choice and sentence structure) from a negative example database. Point out specific problematic words and sentences.\n\n{generated}"
@@ -34,20 +152,124 @@ def construct_queries(generated, x, model_name, client):
     queries = [q.strip() for q in response.choices[0].message.content.split('\n') if q.strip()][:x]
     return queries
 
-def find_top_pairs(query, experiences, y, client, embedding_model):
-    q_emb = compute_embedding(query, client, embedding_model)
+def sub_indices(experiences):
+    """Pair ids of each aspect's sub-index, or None unless the experiences carry aspect tags."""
+    if isinstance(experiences, SharedExperiences):
+        return experiences.aspect_rows
+    if experiences and 'aspect_tags' in experiences[0]:
+        return aspect_rows(np.array([exp['aspect_tags'] for exp in experiences], dtype=np.uint8))
+    return None
+
+def top_pair_ids_by_aspect(query, experiences, y, rows, client, embedding_model, q_emb=None):
+    """
+    Top pair ids of each aspect's sub-index. The query is scored once; each
+    aspect gets its share of y, y * |sub-index| / |pool| (at least 1): about
+    as many of its pairs as a shared top y holds, but the most relevant ones.
+    """
+    n = len(experiences)
+    quota = {aspect: max(1, round(y * len(ids) / n)) for aspect, ids in rows.items()} if n else {}
+    lexical_index = getattr(experiences, 'lexical_index', None)
+    if lexical_index is not None:
+        scores = lexical_index.scores(query, limit=n)
+        return {aspect: lexical_index.rank(scores, quota[aspect], ids)[0] for aspect, ids in rows.items()}
+    if q_emb is None:
+        q_emb = compute_embedding(query, client, embedding_model)
+    index = getattr(experiences, 'retrieval_index', None)
+    if index is not None:
+        scores = index.scores(q_emb, limit=n)
+        return {aspect: index.rank(scores, q_emb, quota[aspect], ids)[0] for aspect, ids in rows.items()}
+    sims = np.array([cosine_similarity([q_emb], [exp['neg_embedding']])[0][0] for exp in experiences])
+    return {aspect: ids[np.argsort(sims[ids])[-quota[aspect]:][::-1]] for aspect, ids in rows.items()}
+
+def top_pair_ids(query, experiences, y, client, embedding_model, q_emb=None):
+    rows = sub_indices(experiences)
+    if rows is not None:
+        return top_pair_ids_by_aspect(query, experiences, y, rows, client, embedding_model, q_emb)
+    lexical_index = getattr(experiences, 'lexical_index', None)
+    if lexical_index is not None:
+        return lexical_index.search(query, y, limit=len(experiences))[0]
+    if q_emb is None:
+        q_emb = compute_embedding(query, client, embedding_model)
+    index = getattr(experiences, 'retrieval_index', None)
+    if index is not None:
+        return index.search(q_emb, y, limit=len(experiences))[0]
     sims = [cosine_similarity([q_emb], [exp['neg_embedding']])[0][0] for exp in experiences]
-    top_indices = np.argsort(sims)[-y:][::-1]
-    top_pairs = [(experiences[i]['positive'], experiences[i]['negative']) for i in top_indices]
-    return top_pairs
+    return np.argsort(sims)[-y:][::-1]
 
-def score_generated(generated, pairs, model_name, aspects, client):
-    pair_str = "\n".join([f"负面示例: {neg}\n正面示例: {pos}\n" for pos, neg in pairs])
-    aspect_results = {}
-    for aspect, info in aspects.items():
-        asp_name = info['name']
-        asp_desc = info['desc']
-        prompt = f"""使用提供的法律语言风格的正面和负面示例作为参考，对以下生成的文本在{asp_name}方面进行评估，从0到10分（打分务必极其严格，尽可能多地找出模型的缺陷，体现法律文书的严谨性和模型表现差距，不能全都打7分和8分，必要时可以勇敢打低分。）。{asp_desc}。
+def lookup_query(query, experiences, y, client, embedding_model, cache=None):
+    """
+    The network half of retrieval: cached pair ids of the query, or else the
+    query embedding its search needs (None with the bm25 backend).
+
+    Returns:
+        Tuple: Pair ids or None, query embedding or None
+    """
+    lexical = getattr(experiences, 'lexical_index', None) is not None
+    if cache is None:
+        return None, None if lexical else compute_embedding(query, client, embedding_model)
+    # Repeated queries skip the embedding request and the search; near-duplicates skip the search
+    key = cache.key(query, y, len(experiences))
+    top_indices = cache.get(key)
+    if top_indices is not None:
+        return top_indices, None
+    if lexical:
+        cache.miss()
+        return None, None
+    q_emb = compute_embedding(query, client, embedding_model)
+    if cache.similarity is not None:
+        return cache.get_similar(key, q_emb), q_emb
+    cache.miss()
+    return None, q_emb
+
+def search_query(query, experiences, y, client, embedding_model, cache=None, q_emb=None):
+    """The local half of retrieval: search the pool and cache the pair ids found."""
+    top_indices = top_pair_ids(query, experiences, y, client, embedding_model, q_emb)
+    if cache is not None:
+        cache.put(cache.key(query, y, len(experiences)), top_indices, q_emb)
+    return top_indices
+
+def pairs_of(experiences, top_indices):
+    if isinstance(top_indices, dict):
+        return {aspect: pairs_of(experiences, ids) for aspect, ids in top_indices.items()}
+    if isinstance(experiences, SharedExperiences):
+        return [(experiences.positives[i], experiences.negatives[i]) for i in top_indices]
+    return [(experiences[i]['positive'], experiences[i]['negative']) for i in top_indices]
+
+def find_top_pairs(query, experiences, y, client, embedding_model, cache=None):
+    top_indices, q_emb = lookup_query(query, experiences, y, client, embedding_model, cache)
+    if top_indices is None:
+        top_indices = search_query(query, experiences, y, client, embedding_model, cache, q_emb)
+    return pairs_of(experiences, top_indices)
+
+def merge_pairs(retrieved, ranked=False):
+    """
+    The pairs retrieved for all queries of a document, deduplicated: one list,
+    or with aspect retrieval one list per aspect.
+
+    With `ranked`, best first by reciprocal rank fusion of the queries' result
+    lists (each query's results are ordered by retrieval score, but BM25
+    scores of different queries are not comparable), so pairs near the top
+    for several queries come first.
+    """
+    if retrieved and isinstance(retrieved[0], dict):
+        return {aspect: merge_pairs([pairs[aspect] for pairs in retrieved], ranked) for aspect in retrieved[0]}
+    if not ranked:
+        return list(set(pair for pairs in retrieved for pair in pairs))
+    fused = {}
+    for pairs in retrieved:
+        for rank, pair in enumerate(pairs):
+            fused[pair] = fused.get(pair, 0.0) + 1.0 / (rank + 1)
+    return sorted(fused, key=fused.get, reverse=True)
+
+def example_text(pair):
+    pos, neg = pair
+    return f"负面示例: {neg}\n正面示例: {pos}\n"
+
+def judge_prompt(generated, pairs, info):
+    pair_str = "\n".join([example_text(pair) for pair in pairs])
+    asp_name = info['name']
+    asp_desc = info['desc']
+    return f"""使用提供的法律语言风格的正面和负面示例作为参考，对以下生成的文本在{asp_name}方面进行评估，从0到10分（打分务必极其严格，尽可能多地找出模型的缺陷，体现法律文书的严谨性和模型表现差距，不能全都打7分和8分，必要时可以勇敢打低分。）。{asp_desc}。
 
 示例：
 {pair_str}
@@ -65,6 +287,45 @@ def score_generated(generated, pairs, model_name, aspects, client):
 0-2 分：存在 6 处及以上缺陷。
 格式大致如：缺陷1:模型表现为……实际文书中……；缺陷2:……；缺陷3:……；缺陷4:……；打分：…分
 """
+
+def packed_prompt(generated, pairs, info, budget):
+    """
+    Judge prompt of about `budget` tokens at most: a generated text longer
+    than half the budget keeps its beginning and end, and the examples are
+    packed into the rest, best first.
+
+    Returns:
+        Tuple[str, Packing]: The prompt, and the examples kept and dropped
+    """
+    generated, truncated = window_text(generated, budget // 2)
+    room = budget - count_tokens(judge_prompt(generated, [], info))
+    # The newlines joining the pairs are whitespace, which count_tokens does not count
+    packing = pack_pairs(pairs, room, lambda pair: count_tokens(example_text(pair)))
+    return judge_prompt(generated, packing.pairs, info), packing._replace(truncated=truncated)
+
+def score_generated(generated, pairs, model_name, aspects, client, tally=None, budget=None):
+    """
+    Judge the generated text on each aspect, one chat call per aspect.
+
+    Args:
+        pairs: (positive, negative) examples shown for every aspect, or a dict
+            of each aspect's own examples (aspect retrieval); best first when
+            packed
+        tally (TokenTally): Receives the estimated input tokens of the calls
+            and what packing dropped
+        budget (int): Pack each prompt into about this many tokens (see
+            packed_prompt); None shows every pair and the whole text
+    """
+    aspect_results = {}
+    tokens, packings = [], []
+    for aspect, info in aspects.items():
+        examples = pairs.get(aspect, []) if isinstance(pairs, dict) else pairs
+        if budget is None:
+            prompt = judge_prompt(generated, examples, info)
+        else:
+            prompt, packing = packed_prompt(generated, examples, info, budget)
+            packings.append(packing)
+        tokens.append(count_tokens(prompt))
         response = client.chat.completions.create(
             model=model_name,
             messages=[{"role": "user", "content": prompt}],
@@ -81,34 +342,275 @@ def score_generated(generated, pairs, model_name, aspects, client):
             score = int(score_match.group(1)) if score_match else 0
             reason = reason_match.group(1) if reason_match else ""
             aspect_results[aspect] = {"score": score, "reason": reason}
+    if tally is not None:
+        tally.add(tokens, packings)
     return aspect_results
 
+def score_document(generated, experiences, generation_model, embedding_model, x, y, generation_client, embedding_client, aspects=ASPECTS, cache=None, tally=None, budget=None):
+    queries = construct_queries(generated, x, generation_model, generation_client)
+    all_pairs = merge_pairs([find_top_pairs(q, experiences, y, embedding_client, embedding_model, cache) for q in queries],
+                            ranked=budget is not None)
+    return score_generated(generated, all_pairs, generation_model, aspects, generation_client, tally, budget)
+
+def pending_documents(input_jsonl, stream):
+    """Documents of input_jsonl whose index is not in the scores file yet."""
+    with open(input_jsonl, 'r') as f_in:
+        for line in f_in:
+            if line.strip():
+                data = json.loads(line.strip())
+                if not stream.done(data['index']):
+                    yield data
+
+def scoring_settings(exp_library, generation_model, embedding_model, x, y, N):
+    """What the records of a scores file depend on: models, ablation parameters, pool and retrieval settings."""
+    return {
+        "generation_model": generation_model,
+        "embedding_model": embedding_model,
+        "x": x,
+        "y": y,
+        "N": N,
+        "pool": pool_version(exp_library, retrieval_backend(), embedding_rerank()),
+        "prompt_budget": prompt_budget(),
+        "aspect_retrieval": aspect_retrieval(),
+    }
+
+def completed_stream(input_jsonl, output_file, settings=None):
+    """
+    The ScoreStream of output_file if resuming is on and an earlier run with
+    the same settings scored every document of input_jsonl into it (all
+    counted as skipped), else None.
+    """
+    stream = ScoreStream(output_file, settings=settings)
+    if stream.resume and next(pending_documents(input_jsonl, stream), None) is None:
+        return stream
+    return None
+
+def scores_complete(input_jsonl, output_file, settings=None):
+    """Whether resuming is on and an earlier run with the same settings scored every document of input_jsonl into output_file."""
+    return completed_stream(input_jsonl, output_file, settings) is not None
+
+def score_file(input_jsonl, output_file, experiences, generation_model, embedding_model, x, y, generation_client, embedding_client, cache=None, stages=None, resume=None, budget=None, settings=None):
+    """
+    Score the documents of input_jsonl into output_file.
+
+    Documents already in output_file are skipped (unless resume is False,
+    CLASE_RESUME=0 or the file was written with other `settings`, see
+    scoring_settings), each record is appended and flushed as soon as it is
+    scored, and a document whose scoring fails is reported and left for the
+    next run. With `stages` (workers per stage, see scoring_stages) documents
+    go through the pipelined scorer. With a `budget` (see prompt_budget) each
+    judge prompt is packed into about that many tokens.
+
+    Returns:
+        dict: Skipped / computed / failed counts, estimated judge prompt
+            tokens, and the pipeline stage metrics (None when scoring
+            sequentially)
+    """
+    tally = TokenTally()
+    with ScoreStream(output_file, resume, settings) as stream:
+        if stages is not None:
+            metrics = score_file_pipelined(pending_documents(input_jsonl, stream), stream, experiences, generation_model,
+                                           embedding_model, x, y, generation_client, embedding_client, cache, stages, tally, budget)
+            return {"records": stream.summary(), "prompt_tokens": tally.summary(), "stages": metrics}
+        for data in pending_documents(input_jsonl, stream):
+            try:
+                aspect_results = score_document(data['generated'], experiences, generation_model, embedding_model, x, y, generation_client, embedding_client, cache=cache, tally=tally, budget=budget)
+            except Exception as e:
+                stream.fail(data['index'], e)
+                continue
+            result = {"index": data['index'], "aspects": aspect_results}
+            stream.write(result)
+    return {"records": stream.summary(), "prompt_tokens": tally.summary(), "stages": None}
+
+def scoring_pipeline(experiences, generation_model, embedding_model, x, y, generation_client, embedding_client, cache, stages, tally=None, budget=None):
+    """
+    The steps of score_document as pipeline stages, each with its own workers:
+    query generation (chat), cache lookup and query embedding (embedding API),
+    search (local) and the aspect judgements (chat). Documents flow through
+    them concurrently, so e.g. the queries of the next documents are embedded
+    while earlier ones are judged.
+    """
+    def queries(data):
+        return data, construct_queries(data['generated'], x, generation_model, generation_client)
+
+    def embed(job):
+        data, qs = job
+        return data, [(q,) + lookup_query(q, experiences, y, embedding_client, embedding_model, cache) for q in qs]
+
+    def search(job):
+        data, lookups = job
+        retrieved = []
+        for q, top_indices, q_emb in lookups:
+            if top_indices is None:
+                top_indices = search_query(q, experiences, y, embedding_client, embedding_model, cache, q_emb)
+            retrieved.append(pairs_of(experiences, top_indices))
+        return data, merge_pairs(retrieved, ranked=budget is not None)
+
+    def judge(job):
+        data, pairs = job
+        return {"index": data['index'], "aspects": score_generated(data['generated'], pairs, generation_model, ASPECTS, generation_client, tally, budget)}
+
+    steps = {'queries': queries, 'embed': embed, 'search': search, 'judge': judge}
+    return StagedPipeline([Stage(name, steps[name], stages[name]) for name in SCORING_STAGES],
+                          queue_size=max(stages.values()))
+
+def score_file_pipelined(documents, stream, experiences, generation_model, embedding_model, x, y, generation_client, embedding_client, cache, stages, tally=None, budget=None):
+    """
+    Score documents through the staged pipeline into a ScoreStream. Records
+    are written in input order, so a fresh output is always a prefix of the
+    sequential output.
+
+    Returns:
+        dict: Per-stage latency, utilisation and queue depth, and the bottleneck stage
+    """
+    pipeline = scoring_pipeline(experiences, generation_model, embedding_model, x, y, generation_client,
+                                embedding_client, cache, stages, tally, budget)
+    for data, result, error in pipeline.run(documents):
+        if error is not None:
+            stream.fail(data['index'], error)
+        else:
+            stream.write(result)
+    return pipeline.metrics()
+
 def process(input_jsonl, output_dir, exp_library, generation_model, embedding_model, x, y, N, generation_client, embedding_client):
+    """
+    Score input_jsonl against the first N pool lines.
+
+    Returns:
+        dict: Skipped / computed / failed record counts, estimated judge
+            prompt tokens, retrieval cache statistics (None if disabled) and
+            pipeline stage metrics (None when scoring sequentially)
+    """
+    output_file = os.path.join(output_dir, f"scores_x{x}_y{y}_N{N}.jsonl")
+    settings = scoring_settings(exp_library, generation_model, embedding_model, x, y, N)
+    stream = completed_stream(input_jsonl, output_file, settings)
+    if stream is not None:
+        # Scored by an earlier run: no need to load (and embed) the pool
+        return {"records": stream.summary(), "prompt_tokens": None, "stages": None, "retrieval_cache": None}
     experiences = load_experiences(exp_library, N, embedding_client, embedding_model)
-    aspects = {
-        "noun": {"name": "名词", "desc": "评估名词的使用是否准确、专业且符合法律文体"},
-        "verb": {"name": "动词", "desc": "评估动词的选择是否精确、正式，避免口语化表达"},
-        "adjective": {"name": "形容词", "desc": "评估形容词的使用是否适度、中立，避免主观情感色彩"},
-        "small_words": {"name": "小词（数词、量词、代词、副词、介词、助词）", "desc": "评估这些功能词是否规范、简洁，避免冗余或不当使用"},
-        "sentence_coherence": {"name": "句子衔接连贯", "desc": "评估句子间逻辑连接是否顺畅、条理清晰"},
-        "sentence_structure": {"name": "句子结构", "desc": "评估句子结构是否复杂适当、符合法律文书的规范"},
-        "intra_sentence_collocation": {"name": "句内搭配", "desc": "评估句内词语搭配是否自然、准确，避免搭配错误"}
+    cache = retrieval_cache(exp_library, embedding_model)
+    report = score_file(input_jsonl, output_file, experiences, generation_model, embedding_model, x, y,
+                        generation_client, embedding_client, cache, scoring_stages(), budget=prompt_budget(),
+                        settings=settings)
+    report["retrieval_cache"] = cache.stats() if cache is not None else None
+    return report
+
+def format_report(report):
+    """One-line summaries of the report of a process() / run_ablation() run."""
+    lines = []
+    records = report.get('records')
+    if records:
+        lines.append(f"{records['computed']} scored, {records['skipped']} skipped, {records['failed']} failed "
+                     f"-> {records['path']}" + (" (settings changed, earlier records discarded)" if records['restarted'] else ""))
+        lines.extend(f"  index {failure['index']}: {failure['error']}" for failure in records['failures'])
+    tokens = report.get('prompt_tokens')
+    if tokens and tokens['documents']:
+        per_document = tokens['per_document']
+        lines.append(f"judge prompts ~{tokens['input_tokens']} tokens in {tokens['calls']} calls, per document "
+                     f"mean {per_document['mean']:.0f} p50 {per_document['p50']:.0f} max {per_document['max']:.0f}, "
+                     f"largest call {tokens['max_call']}")
+        packing = tokens.get('packing')
+        if packing:
+            lines.append(f"packing kept {packing['pairs_kept']} examples in {packing['calls']} calls, dropped "
+                         f"{packing['dropped_contained']} contained in others and {packing['dropped_over_budget']} "
+                         f"over budget; {packing['truncated_calls']} calls cut {packing['truncated_tokens']} tokens "
+                         f"of the judged text")
+    stats = report.get('retrieval_cache')
+    if stats:
+        lookups = stats['hits'] + stats['near_hits'] + stats['misses']
+        lines.append(f"retrieval cache hit rate {(stats['hits'] + stats['near_hits']) / max(lookups, 1):.2f} "
+                     f"({stats['hits']} exact, {stats['near_hits']} near-duplicate, {stats['misses']} misses)")
+    metrics = report.get('stages')
+    if metrics:
+        stages = ", ".join(f"{name} {m['workers']}w p50 {m['latency']['p50']:.2f}s util {m['utilization']:.0%} "
+                           f"queue {m['queue_depth']['mean']:.1f}/{m['queue_depth']['max']}"
+                           for name, m in metrics['stages'].items())
+        lines.append(f"{metrics['elapsed']:.1f}s, bottleneck {metrics['bottleneck']}: {stages}")
+    return lines
+
+class SharedExperiences:
+    """
+    The first `n` experiences of a pool published by publish_experiences, read
+    from shared memory as the dicts load_experiences returns.
+
+    When the arrays include quantised embeddings (`neg_codes`, `neg_scales`),
+    `retrieval_index` searches them, re-ranking the best `rerank` candidates with
+    the float embeddings. With a `lexical_index` (BM25 over the whole pool)
+    retrieval uses it instead and the arrays need no embeddings. With
+    `aspect_tags` in the arrays, `aspect_rows` holds each aspect's sub-index.
+    """
+
+    def __init__(self, arrays, n, rerank=0, lexical_index=None):
+        self.positives = StringArray(arrays['pos_blob'], arrays['pos_offsets'])
+        self.negatives = StringArray(arrays['neg_blob'], arrays['neg_offsets'])
+        self.embeddings = arrays.get('neg_embeddings')
+        self.n = n
+        self.lexical_index = lexical_index
+        self.retrieval_index = None
+        if 'neg_codes' in arrays:
+            self.retrieval_index = EmbeddingIndex(arrays['neg_codes'], arrays.get('neg_scales'), self.embeddings, rerank)
+        self.aspect_rows = aspect_rows(arrays['aspect_tags'], n) if 'aspect_tags' in arrays else None
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        embedding = self.embeddings[i] if self.embeddings is not None else None
+        return {"positive": self.positives[i], "negative": self.negatives[i], "neg_embedding": embedding}
+
+    def __iter__(self):
+        return (self[i] for i in range(self.n))
+
+def publish_experiences(exp_library, steps, client, embedding_model):
+    """
+    Load and embed the experiences of the first max(steps) lines once and put
+    their texts and embeddings in shared memory (texts only with the bm25
+    backend, whose index the workers open from disk).
+
+    Returns:
+        Tuple[SharedArrays, dict]: The published arrays and the number of
+            experiences in the first N lines for each N in steps
+    """
+    lexical = retrieval_backend() == 'bm25'
+    if lexical:
+        # Built (or refreshed) once here, so the workers only open it
+        load_index(exp_library)
+    if is_compiled_pool(exp_library):
+        # Already flat arrays: copy the N-line prefix without building per-pair objects
+        pool = CompiledPool(exp_library)
+        n = pool.pair_count(max(steps))
+        arrays = {
+            "pos_blob": pool.arrays['pos_blob'][:pool.arrays['pos_offsets'][n]],
+            "pos_offsets": pool.arrays['pos_offsets'][:n + 1],
+            "neg_blob": pool.arrays['neg_blob'][:pool.arrays['neg_offsets'][n]],
+            "neg_offsets": pool.arrays['neg_offsets'][:n + 1],
+        }
+        if not lexical:
+            check_pool_embeddings(pool, embedding_model)
+            arrays["neg_embeddings"] = pool.neg_embeddings[:n]
+            arrays.update({key: pool.arrays[key][:n] for key in ('neg_codes', 'neg_scales') if key in pool.arrays})
+        return SharedArrays(with_aspect_tags(arrays, exp_library, n)), {N: pool.pair_count(N) for N in steps}
+    # One pass over the lines: the pairs, and the pair count of each line for the N-line prefixes
+    lines = [exp.get('pair', []) for exp in iter_jsonl(exp_library, 0, max(steps))]
+    experiences = [pair for pairs in lines for pair in pairs]
+    if not lexical:
+        embed_negatives(experiences, client, embedding_model)
+    ends = np.concatenate([[0], np.cumsum([len(pairs) for pairs in lines], dtype=np.int64)])
+    pair_counts = {N: int(ends[min(N, len(lines))]) for N in steps}
+    pos_blob, pos_offsets = encode_strings(exp['positive'] for exp in experiences)
+    neg_blob, neg_offsets = encode_strings(exp['negative'] for exp in experiences)
+    arrays = {
+        "pos_blob": pos_blob, "pos_offsets": pos_offsets,
+        "neg_blob": neg_blob, "neg_offsets": neg_offsets,
     }
-    output_file = os.path.join(output_dir, f"scores_x{x}_y{y}_N{N}.jsonl")
-    with open(input_jsonl, 'r') as f_in, open(output_file, 'w', encoding='utf-8') as f_out:
-        for line in f_in:
-            data = json.loads(line.strip())
-            generated = data['generated']
-            queries = construct_queries(generated, x, generation_model, generation_client)
-            all_pairs = []
-            for q in queries:
-                all_pairs.extend(find_top_pairs(q, experiences, y, embedding_client, embedding_model))
-            all_pairs = list(set(all_pairs))
-            aspect_results = score_generated(generated, all_pairs, generation_model, aspects, generation_client)
-            result = {"index": data['index'], "aspects": aspect_results}
-            f_out.write(json.dumps(result, ensure_ascii=False) + '\n')
+    if not lexical:
+        arrays["neg_embeddings"] = np.array([exp['neg_embedding'] for exp in experiences]) if experiences else np.zeros((0, 0))
+    shared = SharedArrays(with_aspect_tags(arrays, exp_library, len(experiences)))
+    return shared, pair_counts
 
-if __name__ == "__main__":
+def make_clients():
     generation_client = OpenAI(
         base_url=os.getenv('GENERATION_BASE_URL'),
         api_key=os.getenv('GENERATION_API_KEY'),
@@ -117,6 +619,41 @@ if __name__ == "__main__":
         base_url=os.getenv('EMBEDDING_BASE_URL'),
         api_key=os.getenv('EMBEDDING_API_KEY'),
     )
+    return generation_client, embedding_client
+
+_ablation = {}
+
+def init_ablation_worker(spec, pair_counts, input_jsonl, output_dir, generation_model, embedding_model, exp_library=None):
+    # Clients are created per worker; only the spec and parameters are pickled
+    generation_client, embedding_client = make_clients()
+    lexical_index = load_index(exp_library) if exp_library and retrieval_backend() == 'bm25' else None
+    # Each worker caches the retrievals of the runs it is given
+    cache = retrieval_cache(exp_library, embedding_model) if exp_library else None
+    _ablation.update(lexical_index=lexical_index, cache=cache, arrays=attach(spec), pair_counts=pair_counts, input_jsonl=input_jsonl, output_dir=output_dir,
+                     generation_model=generation_model, embedding_model=embedding_model, exp_library=exp_library,
+                     generation_client=generation_client, embedding_client=embedding_client)
+
+def run_ablation(args):
+    x, y, N = args
+    experiences = SharedExperiences(_ablation['arrays'], _ablation['pair_counts'][N], embedding_rerank(),
+                                    _ablation['lexical_index'])
+    cache = _ablation['cache']
+    before = cache.stats() if cache is not None else None
+    output_file = os.path.join(_ablation['output_dir'], f"scores_x{x}_y{y}_N{N}.jsonl")
+    settings = None
+    if _ablation['exp_library']:
+        settings = scoring_settings(_ablation['exp_library'], _ablation['generation_model'], _ablation['embedding_model'], x, y, N)
+    report = score_file(_ablation['input_jsonl'], output_file, experiences, _ablation['generation_model'],
+                        _ablation['embedding_model'], x, y, _ablation['generation_client'], _ablation['embedding_client'],
+                        cache, scoring_stages(), budget=prompt_budget(), settings=settings)
+    report["retrieval_cache"] = None
+    if cache is not None:
+        after = cache.stats()
+        report["retrieval_cache"] = {key: after[key] - before[key] for key in ('hits', 'near_hits', 'misses')}
+    return report
+
+if __name__ == "__main__":
+    generation_client, embedding_client = make_clients()
     embedding_model = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
     generation_model = os.getenv('GENERATION_MODEL', 'gpt-4o-mini')
     input_jsonl = "data/test_samples.jsonl"
@@ -126,9 +663,16 @@ if __name__ == "__main__":
     ablations = [(5,5), (5,10), (10,5), (10,10)]
     steps = [100, 500, 1000, 2000, 4000]
     from multiprocessing import Pool
-    def run_ablation(args):
-        x, y, N = args
-        process(input_jsonl, output_dir, exp_library, generation_model, embedding_model, x, y, N, generation_client, embedding_client)
-    combinations = [(x, y, N) for x, y in ablations for N in steps]
-    with Pool(processes=5) as pool:
-        pool.map(run_ablation, combinations) 
\ No newline at end of file
+    combinations = [(x, y, N) for x, y in ablations for N in steps
+                    if not scores_complete(input_jsonl, os.path.join(output_dir, f"scores_x{x}_y{y}_N{N}.jsonl"),
+                                           scoring_settings(exp_library, generation_model, embedding_model, x, y, N))]
+    print(f"{len(ablations) * len(steps) - len(combinations)} of {len(ablations) * len(steps)} combinations already scored")
+    if not combinations:
+        raise SystemExit(0)
+    shared, pair_counts = publish_experiences(exp_library, steps, embedding_client, embedding_model)
+    initargs = (shared.spec, pair_counts, input_jsonl, output_dir, generation_model, embedding_model, exp_library)
+    with shared, Pool(processes=5, initializer=init_ablation_worker, initargs=initargs) as pool:
+        reports = pool.map(run_ablation, combinations)
+    for (x, y, N), report in zip(combinations, reports):
+        for line in format_report(report):
+            print(f"x={x} y={y} N={N}: {line}")